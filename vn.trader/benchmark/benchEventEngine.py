@@ -0,0 +1,450 @@
+# encoding: UTF-8
+
+'''
+事件引擎吞吐量测试。
+
+按照设定的速率生成模拟的行情、委托、成交事件流，推送到挂载了CtaEngine、
+DrEngine、RmEngine（数据库操作替换为空实现）的事件引擎中，统计：
+1. 每秒处理的事件数量
+2. 运行过程中的队列长度变化
+3. 从生成事件到全部处理函数执行完毕的延迟分布
+
+运行方法：在vn.trader/benchmark目录下执行 python benchEventEngine.py -h 查看参数
+'''
+
+import os
+import sys
+import random
+from threading import Thread, Lock
+from time import sleep
+from timeit import default_timer
+from argparse import ArgumentParser
+
+# python2中多个线程首次同时调用datetime.strptime时可能出现导入错误，预先导入
+import _strptime
+
+# 把vn.trader根目录添加到python环境变量中
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import vtPath
+
+from eventEngine import *
+from vtConstant import *
+from vtGateway import VtTickData, VtOrderData, VtTradeData
+from ctaStrategy.ctaEngine import CtaEngine
+from ctaStrategy.ctaTemplate import CtaTemplate
+from dataRecorder.drEngine import DrEngine
+from dataRecorder.drBase import DrTickData, DrBarData
+from riskManager.rmEngine import RmEngine
+
+
+# 事件流中各类事件的比例（其余为行情）
+ORDER_RATIO = 0.05
+TRADE_RATIO = 0.02
+
+
+########################################################################
+class BenchMainEngine(object):
+    """模拟主引擎，只提供功能引擎用到的接口，数据库操作直接丢弃"""
+
+    # ----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.dbInsertCount = 0
+
+    # ----------------------------------------------------------------------
+    def subscribe(self, subscribeReq, gatewayName):
+        """订阅行情"""
+        pass
+
+    # ----------------------------------------------------------------------
+    def dbInsert(self, dbName, collectionName, d):
+        """插入数据"""
+        self.dbInsertCount += 1
+
+    # ----------------------------------------------------------------------
+    def dbQuery(self, dbName, collectionName, d):
+        """查询数据"""
+        return []
+
+    # ----------------------------------------------------------------------
+    def dbUpdate(self, dbName, collectionName, d, flt, upsert=False):
+        """更新数据"""
+        pass
+
+    # ----------------------------------------------------------------------
+    def getContract(self, vtSymbol):
+        """查询合约"""
+        return None
+
+    # ----------------------------------------------------------------------
+    def getAllWorkingOrders(self):
+        """查询所有活动委托"""
+        return []
+
+
+########################################################################
+class BenchStrategy(CtaTemplate):
+    """测试用策略，只做简单的行情计算，不发出委托"""
+    className = 'BenchStrategy'
+
+    # ----------------------------------------------------------------------
+    def __init__(self, ctaEngine, setting):
+        """Constructor"""
+        super(BenchStrategy, self).__init__(ctaEngine, setting)
+        self.lastPrice = 0.0
+        self.tickCount = 0
+
+    # ----------------------------------------------------------------------
+    def onTick(self, tick):
+        """收到行情TICK推送"""
+        self.tickCount += 1
+        self.lastPrice = (tick.bidPrice1 + tick.askPrice1) / 2
+
+    # ----------------------------------------------------------------------
+    def onOrder(self, order):
+        """收到委托变化推送"""
+        pass
+
+    # ----------------------------------------------------------------------
+    def onTrade(self, trade):
+        """收到成交推送"""
+        pass
+
+
+########################################################################
+class BenchDrEngine(DrEngine):
+    """测试用行情记录引擎，不读取配置文件，直接记录指定合约的TICK和K线"""
+
+    # ----------------------------------------------------------------------
+    def __init__(self, mainEngine, eventEngine, symbolList):
+        """Constructor"""
+        self.symbolList = symbolList
+        super(BenchDrEngine, self).__init__(mainEngine, eventEngine)
+
+    # ----------------------------------------------------------------------
+    def loadSetting(self):
+        """载入设置"""
+        for vtSymbol in self.symbolList:
+            self.tickDict[vtSymbol] = DrTickData()
+            self.barDict[vtSymbol] = DrBarData()
+
+        self.start()
+        self.registerEvent()
+
+
+########################################################################
+class EventGenerator(object):
+    """模拟接口，按照设定的速率生成事件推送到事件引擎"""
+
+    # ----------------------------------------------------------------------
+    def __init__(self, eventEngine, symbolList, count, rate):
+        """
+        Constructor
+        count：生成的事件总数
+        rate：每秒生成的事件数量，0表示不限速
+        """
+        self.eventEngine = eventEngine
+        self.symbolList = symbolList
+        self.count = count
+        self.rate = rate
+
+        self.orderID = 0
+        self.thread = Thread(target=self.run)
+
+    # ----------------------------------------------------------------------
+    def createTick(self, vtSymbol, n):
+        """创建TICK数据"""
+        tick = VtTickData()
+        tick.gatewayName = 'BENCH'
+        tick.symbol = vtSymbol
+        tick.vtSymbol = vtSymbol
+        tick.lastPrice = 3000 + random.randint(-10, 10) * 0.2
+        tick.bidPrice1 = tick.lastPrice - 0.2
+        tick.askPrice1 = tick.lastPrice + 0.2
+        tick.bidVolume1 = 10
+        tick.askVolume1 = 10
+        tick.volume = n
+        tick.date = '20170101'
+        tick.time = '09:%02d:%02d.%d' % (n // 120 % 60, n // 2 % 60, n % 2 * 500)
+        return tick
+
+    # ----------------------------------------------------------------------
+    def createOrder(self, vtSymbol):
+        """创建委托数据"""
+        self.orderID += 1
+
+        order = VtOrderData()
+        order.gatewayName = 'BENCH'
+        order.symbol = vtSymbol
+        order.vtSymbol = vtSymbol
+        order.orderID = str(self.orderID)
+        order.vtOrderID = '.'.join([order.gatewayName, order.orderID])
+        order.direction = DIRECTION_LONG
+        order.offset = OFFSET_OPEN
+        order.price = 3000
+        order.totalVolume = 1
+        order.status = random.choice([STATUS_NOTTRADED, STATUS_CANCELLED])
+        return order
+
+    # ----------------------------------------------------------------------
+    def createTrade(self, vtSymbol):
+        """创建成交数据"""
+        trade = VtTradeData()
+        trade.gatewayName = 'BENCH'
+        trade.symbol = vtSymbol
+        trade.vtSymbol = vtSymbol
+        trade.tradeID = str(self.orderID)
+        trade.vtTradeID = '.'.join([trade.gatewayName, trade.tradeID])
+        trade.orderID = str(self.orderID)
+        trade.vtOrderID = '.'.join([trade.gatewayName, trade.orderID])
+        trade.direction = random.choice([DIRECTION_LONG, DIRECTION_SHORT])
+        trade.offset = OFFSET_OPEN
+        trade.price = 3000
+        trade.volume = 1
+        return trade
+
+    # ----------------------------------------------------------------------
+    def createEvent(self, n):
+        """创建第n个事件，类型与接口推送的一致"""
+        vtSymbol = self.symbolList[n % len(self.symbolList)]
+
+        r = random.random()
+        if r < ORDER_RATIO:
+            data = self.createOrder(vtSymbol)
+            event = Event(type_=EVENT_ORDER + data.vtOrderID)
+        elif r < ORDER_RATIO + TRADE_RATIO:
+            data = self.createTrade(vtSymbol)
+            event = Event(type_=EVENT_TRADE + data.vtSymbol)
+        else:
+            data = self.createTick(vtSymbol, n)
+            event = Event(type_=EVENT_TICK + data.vtSymbol)
+
+        event.dict_['data'] = data
+        return event
+
+    # ----------------------------------------------------------------------
+    def run(self):
+        """运行生成循环，按照 开始时间+n/rate 控制发送时间，避免速率漂移"""
+        start = default_timer()
+
+        for n in xrange(self.count):
+            event = self.createEvent(n)
+
+            if self.rate:
+                wait = start + float(n) / self.rate - default_timer()
+                if wait > 0:
+                    sleep(wait)
+
+            event.dict_['sendTime'] = default_timer()
+            self.eventEngine.put(event)
+
+    # ----------------------------------------------------------------------
+    def start(self):
+        """启动"""
+        self.thread.start()
+
+
+########################################################################
+class BenchRecorder(object):
+    """统计事件处理的延迟和队列长度"""
+
+    # ----------------------------------------------------------------------
+    def __init__(self, eventEngine, count):
+        """Constructor"""
+        self.eventEngine = eventEngine
+        self.count = count
+
+        self.processed = 0
+        self.startTime = 0
+        self.endTime = 0
+        self.latency = LatencyHistogram()
+        self.lock = Lock()      # 分片模式下onEvent会在多个线程中调用
+
+        self.depthList = []     # (时间，队列长度)
+        self.active = False
+        self.thread = Thread(target=self.sampleDepth)
+
+    # ----------------------------------------------------------------------
+    def onEvent(self, event):
+        """通用处理函数，在该事件的所有处理函数之后执行"""
+        sendTime = event.dict_.get('sendTime')
+        if not sendTime:
+            return
+
+        now = default_timer()
+        with self.lock:
+            self.latency.record(now - sendTime)
+
+            self.processed += 1
+            if self.processed >= self.count:
+                self.endTime = now
+
+    # ----------------------------------------------------------------------
+    def sampleDepth(self):
+        """每100毫秒采样一次队列长度"""
+        while self.active:
+            self.depthList.append((default_timer() - self.startTime,
+                                   self.eventEngine.qsize()))
+            sleep(0.1)
+
+    # ----------------------------------------------------------------------
+    def start(self):
+        """启动"""
+        self.startTime = default_timer()
+        self.active = True
+        self.thread.start()
+
+    # ----------------------------------------------------------------------
+    def stop(self):
+        """停止"""
+        self.active = False
+        self.thread.join()
+
+    # ----------------------------------------------------------------------
+    def isFinished(self):
+        """是否所有事件都已经处理完"""
+        return self.processed >= self.count
+
+    # ----------------------------------------------------------------------
+    def printResult(self, title):
+        """打印结果"""
+        duration = (self.endTime or default_timer()) - self.startTime
+        summary = self.latency.getSummary()
+
+        print u'=' * 60
+        print title
+        print u'处理事件数量：%s，耗时：%.3f秒，吞吐量：%.0f事件/秒' % (self.processed, duration,
+                                                          self.processed / duration)
+        print u'延迟（毫秒）：mean %.3f，p50 %.3f，p99 %.3f，max %.3f' % (summary['mean'] * 1000,
+                                                                    summary['p50'] * 1000,
+                                                                    summary['p99'] * 1000,
+                                                                    summary['max'] * 1000)
+
+        if self.depthList:
+            depths = [depth for t, depth in self.depthList]
+            print u'队列长度：平均 %.1f，最大 %d' % (float(sum(depths)) / len(depths), max(depths))
+
+            # 每秒取一个采样点显示变化过程
+            print u'队列长度变化：' + ' '.join(['%.0fs:%d' % (t, depth)
+                                              for t, depth in self.depthList[::10]])
+
+
+# ----------------------------------------------------------------------
+def setupEngines(eventEngine, symbolList):
+    """创建功能引擎并挂载到事件引擎上，返回需要在结束时停止的引擎列表"""
+    mainEngine = BenchMainEngine()
+
+    ctaEngine = CtaEngine(mainEngine, eventEngine)
+    for vtSymbol in symbolList:
+        strategy = BenchStrategy(ctaEngine, {'name': vtSymbol, 'vtSymbol': vtSymbol})
+        strategy.inited = True
+        strategy.trading = True
+        ctaEngine.strategyDict[strategy.name] = strategy
+        ctaEngine.tickStrategyDict[vtSymbol] = [strategy]
+
+    drEngine = BenchDrEngine(mainEngine, eventEngine, symbolList)
+    RmEngine(mainEngine, eventEngine)
+
+    return [drEngine]
+
+
+# ----------------------------------------------------------------------
+def runEventEngine2(options):
+    """测试EventEngine2"""
+    symbolList = ['BENCH%02d' % i for i in range(options.symbols)]
+
+    ee = EventEngine2(shardCount=options.shards)
+    ee.setBatchSize(options.batch)
+    if options.stats:
+        ee.setStatsActive(True)
+
+    engineList = setupEngines(ee, symbolList)
+    recorder = BenchRecorder(ee, options.count)
+    ee.registerGeneralHandler(recorder.onEvent)
+
+    generator = EventGenerator(ee, symbolList, options.count, options.rate)
+
+    ee.start()
+    recorder.start()
+    generator.start()
+
+    while not recorder.isFinished():
+        sleep(0.1)
+
+    recorder.stop()
+    ee.stop()
+    for engine in engineList:
+        engine.stop()
+
+    recorder.printResult(u'EventEngine2（分片数量：%s）' % options.shards)
+    if options.stats:
+        print ee.dumpStats()
+
+
+# ----------------------------------------------------------------------
+def runEventEngine(options):
+    """测试EventEngine，需要运行Qt事件循环"""
+    from PyQt4.QtCore import QCoreApplication, QTimer
+
+    app = QCoreApplication.instance() or QCoreApplication([])
+    symbolList = ['BENCH%02d' % i for i in range(options.symbols)]
+
+    ee = EventEngine()
+    engineList = setupEngines(ee, symbolList)
+    recorder = BenchRecorder(ee, options.count)
+    ee.registerGeneralHandler(recorder.onEvent)
+
+    generator = EventGenerator(ee, symbolList, options.count, options.rate)
+
+    # 定时检查是否完成，完成后退出事件循环
+    def checkFinished():
+        if recorder.isFinished():
+            app.quit()
+
+    checkTimer = QTimer()
+    checkTimer.timeout.connect(checkFinished)
+    checkTimer.start(100)
+
+    ee.start()
+    recorder.start()
+    generator.start()
+    app.exec_()
+
+    checkTimer.stop()
+    recorder.stop()
+    ee.stop()
+    for engine in engineList:
+        engine.stop()
+
+    recorder.printResult(u'EventEngine')
+
+
+# ----------------------------------------------------------------------
+def main():
+    """解析参数并运行测试"""
+    parser = ArgumentParser(description=u'事件引擎吞吐量测试')
+    parser.add_argument('-e', '--engine', choices=['1', '2', 'all'], default='2',
+                        help=u'测试的引擎：1为EventEngine，2为EventEngine2')
+    parser.add_argument('-n', '--count', type=int, default=100000,
+                        help=u'事件总数')
+    parser.add_argument('-r', '--rate', type=int, default=0,
+                        help=u'每秒推送的事件数量，0表示不限速')
+    parser.add_argument('-s', '--symbols', type=int, default=10,
+                        help=u'合约数量')
+    parser.add_argument('--shards', type=int, default=0,
+                        help=u'EventEngine2的分片数量')
+    parser.add_argument('--batch', type=int, default=100,
+                        help=u'EventEngine2每批处理的事件数量')
+    parser.add_argument('--stats', action='store_true',
+                        help=u'打印EventEngine2中每个处理函数的延迟统计')
+    options = parser.parse_args()
+
+    if options.engine in ('1', 'all'):
+        runEventEngine(options)
+
+    if options.engine in ('2', 'all'):
+        runEventEngine2(options)
+
+
+if __name__ == '__main__':
+    main()
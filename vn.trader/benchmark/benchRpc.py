@@ -0,0 +1,325 @@
+# encoding: UTF-8
+
+'''
+RPC模块的延迟和吞吐量测试。
+
+在本机启动RpcServer和RpcClient，分别使用tcp和ipc传输、json/msgpack/pickle
+序列化工具，测试：
+1. 使用VtOrderReq数据调用sendOrder的延迟分布（REQ同步调用）和吞吐量（流水线模式）
+2. 推送VtTickData行情事件的吞吐量（pickle格式还会对比紧凑编码）
+3. 服务器端每个函数的调用次数和耗时统计
+
+运行方法：在vn.trader/benchmark目录下执行 python benchRpc.py -h 查看参数
+'''
+
+import os
+import sys
+import platform
+from threading import Event as ThreadEvent
+from time import sleep
+from timeit import default_timer
+from argparse import ArgumentParser
+
+# 把vn.trader根目录添加到python环境变量中
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import vtPath
+
+from eventEngine import Event
+from eventType import EVENT_TICK
+from vtConstant import *
+from vtGateway import VtTickData, VtOrderReq
+from vnrpc import RpcServer, RpcClient
+from vtCodec import VtEventCodec
+
+
+# 测试使用的序列化工具
+SERIALIZER_LIST = ['json', 'msgpack', 'pickle']
+
+# 端口编号，每组测试使用新的端口
+portCount = [23000]
+
+
+########################################################################
+class BenchServer(RpcServer):
+    """测试用服务器"""
+
+    # ----------------------------------------------------------------------
+    def __init__(self, repAddress, pubAddress):
+        """Constructor"""
+        super(BenchServer, self).__init__(repAddress, pubAddress)
+        self.orderCount = 0
+
+        self.register(self.sendOrder)
+        self.register(self.getCallStats)
+
+    # ----------------------------------------------------------------------
+    def sendOrder(self, orderReq, gatewayName):
+        """模拟发单，返回委托编号"""
+        self.orderCount += 1
+        return '.'.join([gatewayName, str(self.orderCount)])
+
+
+########################################################################
+class BenchClient(RpcClient):
+    """测试用客户端，统计收到的推送数量"""
+
+    # ----------------------------------------------------------------------
+    def __init__(self, reqAddress, subAddress):
+        """Constructor"""
+        super(BenchClient, self).__init__(reqAddress, subAddress)
+        self.codec = None           # 使用紧凑编码时的解码器
+        self.received = 0           # 收到的推送数量
+        self.target = 0             # 需要收到的推送数量
+        self.lastTime = 0           # 收到最后一条推送的时间
+        self.finished = ThreadEvent()
+
+    # ----------------------------------------------------------------------
+    def unpackPublish(self, topic, datab):
+        """解包广播数据"""
+        if self.codec:
+            return self.codec.decode(datab)
+        return self.unpack(datab)
+
+    # ----------------------------------------------------------------------
+    def callback(self, topic, data):
+        """回调函数"""
+        self.received += 1
+        self.lastTime = default_timer()
+        if self.received >= self.target:
+            self.finished.set()
+
+
+# ----------------------------------------------------------------------
+def createOrderReq():
+    """创建委托请求"""
+    req = VtOrderReq()
+    req.symbol = 'IF1706'
+    req.exchange = EXCHANGE_CFFEX
+    req.price = 3500.2
+    req.volume = 1
+    req.priceType = PRICETYPE_LIMITPRICE
+    req.direction = DIRECTION_LONG
+    req.offset = OFFSET_OPEN
+    return req
+
+
+# ----------------------------------------------------------------------
+def createTickEvent():
+    """创建行情事件"""
+    tick = VtTickData()
+    tick.gatewayName = 'CTP'
+    tick.symbol = 'IF1706'
+    tick.vtSymbol = 'IF1706'
+    tick.lastPrice = 3500.2
+    tick.volume = 12345
+    tick.openInterest = 23456
+    tick.time = '09:30:00.5'
+    tick.date = '20170601'
+    tick.bidPrice1 = 3500.0
+    tick.askPrice1 = 3500.4
+    tick.bidVolume1 = 10
+    tick.askVolume1 = 12
+
+    event = Event(type_=EVENT_TICK + tick.vtSymbol)
+    event.dict_['data'] = tick
+    return event
+
+
+# ----------------------------------------------------------------------
+def toPayload(obj, serializer):
+    """json和msgpack不能直接序列化对象，转换为字典"""
+    if serializer == 'pickle':
+        return obj
+    elif isinstance(obj, Event):
+        return {'type_': obj.type_, 'data': obj.dict_['data'].__dict__}
+    else:
+        return obj.__dict__
+
+
+# ----------------------------------------------------------------------
+def getAddress(transport):
+    """获取新的请求和推送地址"""
+    portCount[0] += 2
+    port = portCount[0]
+
+    if transport == 'tcp':
+        return 'tcp://127.0.0.1:%s' % port, 'tcp://127.0.0.1:%s' % (port + 1)
+    else:
+        return 'ipc:///tmp/vnpybench%s' % port, 'ipc:///tmp/vnpybench%s' % (port + 1)
+
+
+# ----------------------------------------------------------------------
+def percentile(l, percent):
+    """计算排序后列表的分位数"""
+    return l[min(int(len(l) * percent / 100.0), len(l) - 1)]
+
+
+# ----------------------------------------------------------------------
+def setSerializer(obj, serializer):
+    """设置序列化工具"""
+    if serializer == 'json':
+        obj.useJson()
+    elif serializer == 'msgpack':
+        obj.useMsgpack()
+    else:
+        obj.usePickle()
+
+
+# ----------------------------------------------------------------------
+def benchCall(server, reqAddress, subAddress, serializer, count):
+    """测试调用延迟和流水线吞吐量，返回(p50, p99, max, 同步调用每秒次数, 流水线每秒次数)"""
+    req = toPayload(createOrderReq(), serializer)
+
+    # REQ同步调用
+    client = BenchClient(reqAddress, subAddress)
+    setSerializer(client, serializer)
+    client.start()
+
+    costList = []
+    start = default_timer()
+    for i in xrange(count):
+        t = default_timer()
+        client.sendOrder(req, 'CTP')
+        costList.append(default_timer() - t)
+    syncRate = count / (default_timer() - start)
+
+    client.stop()
+    costList.sort()
+
+    # 流水线模式
+    client = BenchClient(reqAddress, subAddress)
+    setSerializer(client, serializer)
+    client.usePipeline()
+    client.start()
+
+    start = default_timer()
+    futureList = [client.asyncCall('sendOrder', req, 'CTP') for i in xrange(count)]
+    for future in futureList:
+        future.get()
+    pipelineRate = count / (default_timer() - start)
+
+    client.stop()
+
+    return (percentile(costList, 50), percentile(costList, 99), costList[-1],
+            syncRate, pipelineRate)
+
+
+# ----------------------------------------------------------------------
+def benchPublish(server, reqAddress, subAddress, serializer, count, compact=False):
+    """测试推送吞吐量，返回(每秒收到的推送数量, 丢失的推送数量, 每条数据字节数)"""
+    event = createTickEvent()
+    payload = toPayload(event, serializer)
+    topic = event.type_
+
+    client = BenchClient(reqAddress, subAddress)
+    setSerializer(client, serializer)
+    client.target = count
+    client.subscribeTopic(topic)
+    client.start()
+
+    if compact:
+        codec = VtEventCodec()
+        client.codec = codec
+
+    # 等待订阅到达服务器
+    while not server.hasSubscriber(topic):
+        sleep(0.1)
+
+    start = default_timer()
+    for i in xrange(count):
+        if compact:
+            datab = codec.encode(event)
+            server.publishRaw(topic, datab)
+        else:
+            server.publish(topic, payload)
+
+    # 客户端处理不及时，推送队列满时zmq会丢弃数据，因此最多等待10秒
+    client.finished.wait(10)
+    client.unsubscribeTopic(topic)
+    client.stop()
+
+    received = client.received
+    rate = received / (client.lastTime - start) if received else 0
+
+    if compact:
+        size = len(codec.encode(event))
+    else:
+        size = len(server.pack(payload))
+
+    return rate, count - received, size
+
+
+# ----------------------------------------------------------------------
+def runBenchmark(options):
+    """运行测试"""
+    transportList = ['tcp']
+    if 'Windows' not in platform.uname():
+        transportList.append('ipc')
+
+    callLines = []
+    publishLines = []
+    statsLines = []
+
+    for transport in transportList:
+        for serializer in SERIALIZER_LIST:
+            reqAddress, subAddress = getAddress(transport)
+            server = BenchServer(reqAddress.replace('127.0.0.1', '*'),
+                                 subAddress.replace('127.0.0.1', '*'))
+            setSerializer(server, serializer)
+            server.start()
+
+            name = '%s/%s' % (transport, serializer)
+
+            p50, p99, maxCost, syncRate, pipelineRate = benchCall(server, reqAddress, subAddress,
+                                                                  serializer, options.calls)
+            callLines.append('%-20s%10.1f%10.1f%10.1f%12.0f%12.0f' % (name, p50 * 1e6, p99 * 1e6,
+                                                                       maxCost * 1e6, syncRate,
+                                                                       pipelineRate))
+
+            rate, lost, size = benchPublish(server, reqAddress, subAddress, serializer,
+                                            options.ticks)
+            publishLines.append('%-20s%12.0f%10d%10d' % (name, rate, lost, size))
+
+            if serializer == 'pickle':
+                rate, lost, size = benchPublish(server, reqAddress, subAddress, serializer,
+                                                options.ticks, compact=True)
+                publishLines.append('%-20s%12.0f%10d%10d' % ('%s/compact' % transport, rate,
+                                                             lost, size))
+
+            for funcName, stats in server.getCallStats().items():
+                statsLines.append('%-20s%-16s%10d%10d%10.1f%10.1f' % (name, funcName,
+                                                                       stats['count'],
+                                                                       stats['error'],
+                                                                       stats['mean'] * 1e6,
+                                                                       stats['max'] * 1e6))
+
+            server.stop()
+
+    print u'调用延迟（微秒）和吞吐量（次/秒），调用次数：%s' % options.calls
+    print '%-20s%10s%10s%10s%12s%12s' % ('name', 'p50', 'p99', 'max', 'sync', 'pipeline')
+    print '\n'.join(callLines)
+    print
+    print u'推送吞吐量（条/秒），推送数量：%s' % options.ticks
+    print '%-20s%12s%10s%10s' % ('name', 'rate', 'lost', 'bytes')
+    print '\n'.join(publishLines)
+    print
+    print u'服务器函数调用统计（微秒）'
+    print '%-20s%-16s%10s%10s%10s%10s' % ('name', 'function', 'count', 'error', 'mean', 'max')
+    print '\n'.join(statsLines)
+
+
+# ----------------------------------------------------------------------
+def main():
+    """解析参数并运行测试"""
+    parser = ArgumentParser(description=u'RPC延迟和吞吐量测试')
+    parser.add_argument('-c', '--calls', type=int, default=10000,
+                        help=u'每组测试的调用次数')
+    parser.add_argument('-t', '--ticks', type=int, default=100000,
+                        help=u'每组测试的推送数量')
+    options = parser.parse_args()
+
+    runBenchmark(options)
+
+
+if __name__ == '__main__':
+    main()
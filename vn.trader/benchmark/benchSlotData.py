@@ -0,0 +1,118 @@
+# encoding: UTF-8
+
+'''
+比较普通数据类和__slots__版本数据类的内存占用和创建速度。
+
+运行方法：在vn.trader/benchmark目录下执行 python benchSlotData.py [对象数量]
+'''
+
+import os
+import sys
+import gc
+from time import time
+
+import cPickle
+
+# 把vn.trader根目录添加到python环境变量中
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import vtPath
+
+from eventEngine import Event
+from vtGateway import (VtTickData, VtOrderData, VtTradeData,
+                       VtSlotTickData, VtSlotOrderData, VtSlotTradeData)
+from ctaBase import CtaTickData, CtaBarData, CtaSlotTickData, CtaSlotBarData
+
+
+########################################################################
+class DictEvent:
+    """改为__slots__之前的事件对象，仅用于对比"""
+
+    # ----------------------------------------------------------------------
+    def __init__(self, type_=None):
+        """Constructor"""
+        self.type_ = type_
+        self.dict_ = {}
+
+
+# ----------------------------------------------------------------------
+def sizeOf(obj):
+    """计算对象本身及其__dict__占用的内存（字节），不包括属性值对象"""
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+# ----------------------------------------------------------------------
+def fillData(obj):
+    """模拟接口推送时给数据对象的所有属性赋值"""
+    for key in fieldNames(obj):
+        value = getattr(obj, key)
+        if isinstance(value, float):
+            setattr(obj, key, 3000.2)
+        elif isinstance(value, int):
+            setattr(obj, key, 10)
+    return obj
+
+
+# ----------------------------------------------------------------------
+def fieldNames(obj):
+    """获取数据对象的属性名列表"""
+    if hasattr(obj, '__slots__'):
+        return obj.__slots__
+    return obj.__dict__.keys()
+
+
+# ----------------------------------------------------------------------
+def benchClass(cls, n):
+    """测试单个数据类，返回(每个对象字节数, 创建耗时, 序列化耗时)"""
+    gc.collect()
+
+    start = time()
+    l = [fillData(cls()) for i in xrange(n)]
+    createTime = time() - start
+
+    size = sizeOf(l[0])
+    if isinstance(l[0], (Event, DictEvent)):
+        size += sys.getsizeof(l[0].dict_)
+
+    start = time()
+    for obj in l[:10000]:
+        cPickle.loads(cPickle.dumps(obj, 2))
+    pickleTime = time() - start
+
+    return size, createTime, pickleTime
+
+
+# ----------------------------------------------------------------------
+def runBenchmark(n=100000):
+    """运行对比测试"""
+    pairs = [
+        (DictEvent, Event),
+        (VtTickData, VtSlotTickData),
+        (VtOrderData, VtSlotOrderData),
+        (VtTradeData, VtSlotTradeData),
+        (CtaTickData, CtaSlotTickData),
+        (CtaBarData, CtaSlotBarData),
+    ]
+
+    print u'对象数量：%s' % n
+    print '%-16s%-16s%12s%12s%12s%12s%12s%12s' % ('class', 'slot class',
+                                                  'bytes', 'slot bytes',
+                                                  'create(s)', 'slot(s)',
+                                                  'pickle(s)', 'slot(s)')
+
+    for cls, slotCls in pairs:
+        size, createTime, pickleTime = benchClass(cls, n)
+        slotSize, slotCreateTime, slotPickleTime = benchClass(slotCls, n)
+        print '%-16s%-16s%12d%12d%12.3f%12.3f%12.3f%12.3f' % (cls.__name__, slotCls.__name__,
+                                                              size, slotSize,
+                                                              createTime, slotCreateTime,
+                                                              pickleTime, slotPickleTime)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        runBenchmark(int(sys.argv[1]))
+    else:
+        runBenchmark()
@@ -0,0 +1,526 @@
+# encoding: UTF-8
+
+'''
+回测引擎撮合结果一致性检查。
+
+用固定随机种子生成的K线序列驱动一个频繁挂撤限价单和停止单的测试策略，
+分别在当前的回测引擎和逐个检查委托字典撮合的旧版回测引擎中运行，
+比较两边的成交列表（成交编号、委托编号、时间、方向、开平、价格、数量）是否完全一致。
+
+然后对同一个成交列表，分别用当前随成交逐笔更新的交易统计和旧版回测结束后
+遍历全部成交的计算方式得到回测结果，比较资金、回撤和每笔交易结果序列是否完全一致。
+
+运行方法：在vn.trader/benchmark目录下执行 python checkBacktesting.py -h 查看参数
+'''
+
+from __future__ import division
+
+import os
+import sys
+import copy
+import random
+from datetime import datetime, timedelta
+from argparse import ArgumentParser
+
+# 把vn.trader根目录添加到python环境变量中
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import vtPath
+
+from vtConstant import *
+from vtGateway import VtOrderData, VtTradeData
+from ctaBase import *
+from ctaTemplate import CtaTemplate
+from ctaBacktesting import BacktestingEngine, TradingResult
+
+
+# 需要完全一致的回测结果字段
+RESULT_KEYS = ['capital', 'maxCapital', 'drawdown', 'totalResult', 'totalTurnover',
+               'totalCommission', 'totalSlippage', 'winningRate', 'averageWinning',
+               'averageLosing', 'profitLossRatio',
+               'timeList', 'pnlList', 'capitalList', 'drawdownList',
+               'posList', 'tradeTimeList']
+
+# 和列表对应的NumPy数组字段
+ARRAY_KEYS = [('pnlArray', 'pnlList'),
+              ('capitalArray', 'capitalList'),
+              ('drawdownArray', 'drawdownList')]
+
+
+########################################################################
+class LegacyBacktestingEngine(BacktestingEngine):
+    """
+    使用委托簿之前的撮合方式：每个数据点逐个检查委托字典中的全部委托，
+    除了成交统计外和旧版代码完全相同，仅用于对比
+    """
+
+    # ----------------------------------------------------------------------
+    def crossLimitOrder(self):
+        """基于最新数据撮合限价单"""
+        if self.mode == self.BAR_MODE:
+            buyCrossPrice = self.bar.low
+            sellCrossPrice = self.bar.high
+            buyBestCrossPrice = self.bar.open
+            sellBestCrossPrice = self.bar.open
+        else:
+            buyCrossPrice = self.tick.askPrice1
+            sellCrossPrice = self.tick.bidPrice1
+            buyBestCrossPrice = self.tick.askPrice1
+            sellBestCrossPrice = self.tick.bidPrice1
+
+        for orderID, order in self.workingLimitOrderDict.items():
+            buyCross = (order.direction==DIRECTION_LONG and
+                        order.price>=buyCrossPrice and
+                        buyCrossPrice > 0)
+
+            sellCross = (order.direction==DIRECTION_SHORT and
+                         order.price<=sellCrossPrice and
+                         sellCrossPrice > 0)
+
+            if buyCross or sellCross:
+                self.tradeCount += 1
+                tradeID = str(self.tradeCount)
+                trade = VtTradeData()
+                trade.vtSymbol = order.vtSymbol
+                trade.tradeID = tradeID
+                trade.vtTradeID = tradeID
+                trade.orderID = order.orderID
+                trade.vtOrderID = order.orderID
+                trade.direction = order.direction
+                trade.offset = order.offset
+
+                if buyCross:
+                    trade.price = min(order.price, buyBestCrossPrice)
+                    self.strategy.pos += order.totalVolume
+                else:
+                    trade.price = max(order.price, sellBestCrossPrice)
+                    self.strategy.pos -= order.totalVolume
+
+                trade.volume = order.totalVolume
+                trade.tradeTime = str(self.dt)
+                trade.dt = self.dt
+                self.strategy.onTrade(trade)
+
+                self.tradeDict[tradeID] = trade
+                self.statistics.addTrade(trade, self.rate, self.slippage, self.size)
+                if self.dailyMode:
+                    self.dailyStatistics.addTrade(trade, self.rate, self.slippage, self.size)
+
+                order.tradedVolume = order.totalVolume
+                order.status = STATUS_ALLTRADED
+                self.strategy.onOrder(order)
+
+                del self.workingLimitOrderDict[orderID]
+
+    # ----------------------------------------------------------------------
+    def crossStopOrder(self):
+        """基于最新数据撮合停止单"""
+        if self.mode == self.BAR_MODE:
+            buyCrossPrice = self.bar.high
+            sellCrossPrice = self.bar.low
+            bestCrossPrice = self.bar.open
+        else:
+            buyCrossPrice = self.tick.lastPrice
+            sellCrossPrice = self.tick.lastPrice
+            bestCrossPrice = self.tick.lastPrice
+
+        for stopOrderID, so in self.workingStopOrderDict.items():
+            buyCross = so.direction==DIRECTION_LONG and so.price<=buyCrossPrice
+            sellCross = so.direction==DIRECTION_SHORT and so.price>=sellCrossPrice
+
+            if buyCross or sellCross:
+                self.tradeCount += 1
+                tradeID = str(self.tradeCount)
+                trade = VtTradeData()
+                trade.vtSymbol = so.vtSymbol
+                trade.tradeID = tradeID
+                trade.vtTradeID = tradeID
+
+                if buyCross:
+                    self.strategy.pos += so.volume
+                    trade.price = max(bestCrossPrice, so.price)
+                else:
+                    self.strategy.pos -= so.volume
+                    trade.price = min(bestCrossPrice, so.price)
+
+                self.limitOrderCount += 1
+                orderID = str(self.limitOrderCount)
+                trade.orderID = orderID
+                trade.vtOrderID = orderID
+
+                trade.direction = so.direction
+                trade.offset = so.offset
+                trade.volume = so.volume
+                trade.tradeTime = str(self.dt)
+                trade.dt = self.dt
+                self.strategy.onTrade(trade)
+
+                self.tradeDict[tradeID] = trade
+                self.statistics.addTrade(trade, self.rate, self.slippage, self.size)
+                if self.dailyMode:
+                    self.dailyStatistics.addTrade(trade, self.rate, self.slippage, self.size)
+
+                so.status = STOPORDER_TRIGGERED
+
+                order = VtOrderData()
+                order.vtSymbol = so.vtSymbol
+                order.symbol = so.vtSymbol
+                order.orderID = orderID
+                order.vtOrderID = orderID
+                order.direction = so.direction
+                order.offset = so.offset
+                order.price = so.price
+                order.totalVolume = so.volume
+                order.tradedVolume = so.volume
+                order.status = STATUS_ALLTRADED
+                order.orderTime = trade.tradeTime
+                self.strategy.onOrder(order)
+
+                self.limitOrderDict[orderID] = order
+
+                if stopOrderID in self.workingStopOrderDict:
+                    del self.workingStopOrderDict[stopOrderID]
+
+
+########################################################################
+class CheckStrategy(CtaTemplate):
+    """
+    每根K线撤掉全部限价单，在收盘价上下随机挂出多个限价单和停止单，
+    任意成交后在回调函数中撤掉全部停止单，覆盖同一根K线多个委托成交的情况
+    """
+    className = 'CheckStrategy'
+    author = u''
+
+    seed = 0
+
+    paramList = ['name',
+                 'className',
+                 'author',
+                 'vtSymbol',
+                 'seed']
+
+    varList = ['inited',
+               'trading',
+               'pos']
+
+    # ----------------------------------------------------------------------
+    def __init__(self, ctaEngine, setting):
+        """Constructor"""
+        super(CheckStrategy, self).__init__(ctaEngine, setting)
+
+        self.rng = random.Random(self.seed)
+        self.orderList = []     # 活动限价单编号
+        self.stopList = []      # 活动停止单编号
+
+    # ----------------------------------------------------------------------
+    def onInit(self):
+        """初始化策略"""
+        pass
+
+    # ----------------------------------------------------------------------
+    def onStart(self):
+        """启动策略"""
+        pass
+
+    # ----------------------------------------------------------------------
+    def onTrade(self, trade):
+        """成交推送，撤掉全部停止单"""
+        for stopOrderID in self.stopList:
+            self.cancelOrder(stopOrderID)
+        self.stopList = []
+
+    # ----------------------------------------------------------------------
+    def onOrder(self, order):
+        """委托推送"""
+        pass
+
+    # ----------------------------------------------------------------------
+    def onBar(self, bar):
+        """K线推送"""
+        for orderID in self.orderList:
+            self.cancelOrder(orderID)
+        self.orderList = []
+
+        rng = self.rng
+
+        for i in range(rng.randint(1, 4)):
+            offset = rng.randint(1, 10)
+            volume = rng.randint(1, 3)
+            if self.pos > 0 and rng.random() < 0.5:
+                self.orderList.append(self.sell(bar.close + offset, volume))
+            elif self.pos < 0 and rng.random() < 0.5:
+                self.orderList.append(self.cover(bar.close - offset, volume))
+            elif rng.random() < 0.5:
+                self.orderList.append(self.buy(bar.close - offset, volume))
+            else:
+                self.orderList.append(self.short(bar.close + offset, volume))
+
+        if not self.stopList and rng.random() < 0.3:
+            for i in range(rng.randint(1, 3)):
+                offset = rng.randint(1, 8)
+                self.stopList.append(self.buy(bar.close + offset, 1, stop=True))
+                self.stopList.append(self.short(bar.close - offset, 1, stop=True))
+
+
+# ----------------------------------------------------------------------
+def generateBars(count, seed):
+    """生成随机游走的K线序列"""
+    rng = random.Random(seed)
+    dt = datetime(2017, 1, 3, 9, 0)
+    price = 3000
+    barList = []
+
+    for i in range(count):
+        bar = CtaSlotBarData()
+        bar.vtSymbol = 'TEST'
+        bar.symbol = 'TEST'
+        bar.open = price
+        bar.close = price + rng.randint(-6, 6)
+        bar.high = max(bar.open, bar.close) + rng.randint(0, 5)
+        bar.low = min(bar.open, bar.close) - rng.randint(0, 5)
+        bar.datetime = dt
+        bar.date = dt.strftime('%Y%m%d')
+        bar.time = dt.strftime('%H:%M:%S')
+        bar.volume = rng.randint(1, 1000)
+        barList.append(bar)
+
+        price = bar.close
+        dt += timedelta(minutes=1)
+
+    return barList
+
+
+# ----------------------------------------------------------------------
+def runEngine(engineClass, barList, seed):
+    """用指定的回测引擎回放K线，返回引擎对象"""
+    engine = engineClass()
+    engine.setBacktestingMode(engine.BAR_MODE)
+    engine.setSlippage(0.2)
+    engine.setRate(0.3/10000)
+    engine.setSize(300)
+    engine.setPriceTick(1)
+    engine.setDailyMode(True)
+
+    engine.initStrategy(CheckStrategy, {'vtSymbol': 'TEST', 'seed': seed})
+    strategy = engine.strategy
+    strategy.inited = True
+    strategy.onInit()
+    strategy.trading = True
+    strategy.onStart()
+
+    for bar in barList:
+        engine.newBar(bar)
+
+    return engine
+
+
+# ----------------------------------------------------------------------
+def getTradeList(engine):
+    """提取用于比较的成交列表"""
+    return [(trade.tradeID, trade.orderID, trade.dt, trade.direction,
+             trade.offset, trade.price, trade.volume)
+            for trade in engine.tradeDict.values()]
+
+
+# ----------------------------------------------------------------------
+def checkCross(count, seed):
+    """比较当前和旧版撮合方式的成交列表，一致则返回True"""
+    barList = generateBars(count, seed)
+    engine = runEngine(BacktestingEngine, barList, seed)
+    legacy = runEngine(LegacyBacktestingEngine, barList, seed)
+
+    tradeList = getTradeList(engine)
+    legacyList = getTradeList(legacy)
+    print u'成交数量：当前%s，旧版%s' %(len(tradeList), len(legacyList))
+
+    for new, old in zip(tradeList, legacyList):
+        if new != old:
+            print u'成交不一致：当前%s，旧版%s' %(new, old)
+            return False
+
+    if len(tradeList) != len(legacyList) or engine.strategy.pos != legacy.strategy.pos:
+        print u'成交数量或最终持仓不一致'
+        return False
+
+    print u'成交列表一致'
+    return True
+
+
+# ----------------------------------------------------------------------
+def calculateLegacyResult(tradeList, rate, slippage, size):
+    """旧版回测结束后遍历全部成交计算回测结果的方式，会修改成交的数量，需传入副本"""
+    resultList = []             # 交易结果列表
+
+    longTrade = []              # 未平仓的多头交易
+    shortTrade = []             # 未平仓的空头交易
+
+    tradeTimeList = []          # 每笔成交时间戳
+    posList = [0]               # 每笔成交后的持仓情况
+
+    for trade in tradeList:
+        if trade.direction == DIRECTION_LONG:
+            entryList = shortTrade
+            openList = longTrade
+            pos = -1
+        else:
+            entryList = longTrade
+            openList = shortTrade
+            pos = 1
+
+        if not entryList:
+            openList.append(trade)
+        else:
+            while True:
+                entryTrade = entryList[0]
+                exitTrade = trade
+
+                closedVolume = min(exitTrade.volume, entryTrade.volume)
+                result = TradingResult(entryTrade.price, entryTrade.dt, 
+                                       exitTrade.price, exitTrade.dt,
+                                       pos*closedVolume, rate, slippage, size)
+                resultList.append(result)
+
+                posList.extend([pos, 0])
+                tradeTimeList.extend([result.entryDt, result.exitDt])
+
+                entryTrade.volume -= closedVolume
+                exitTrade.volume -= closedVolume
+
+                if not entryTrade.volume:
+                    entryList.pop(0)
+
+                if not exitTrade.volume:
+                    break
+
+                if not entryList:
+                    openList.append(exitTrade)
+                    break
+
+    if not resultList:
+        return {}
+
+    capital = 0
+    maxCapital = 0
+    drawdown = 0
+
+    totalResult = 0
+    totalTurnover = 0
+    totalCommission = 0
+    totalSlippage = 0
+
+    timeList = []
+    pnlList = []
+    capitalList = []
+    drawdownList = []
+
+    winningResult = 0
+    losingResult = 0
+    totalWinning = 0
+    totalLosing = 0
+
+    for result in resultList:
+        capital += result.pnl
+        maxCapital = max(capital, maxCapital)
+        drawdown = capital - maxCapital
+
+        pnlList.append(result.pnl)
+        timeList.append(result.exitDt)
+        capitalList.append(capital)
+        drawdownList.append(drawdown)
+
+        totalResult += 1
+        totalTurnover += result.turnover
+        totalCommission += result.commission
+        totalSlippage += result.slippage
+
+        if result.pnl >= 0:
+            winningResult += 1
+            totalWinning += result.pnl
+        else:
+            losingResult += 1
+            totalLosing += result.pnl
+
+    winningRate = winningResult/totalResult*100
+
+    averageWinning = 0
+    averageLosing = 0
+    profitLossRatio = 0
+
+    if winningResult:
+        averageWinning = totalWinning/winningResult
+    if losingResult:
+        averageLosing = totalLosing/losingResult
+    if averageLosing:
+        profitLossRatio = -averageWinning/averageLosing
+
+    d = {}
+    d['capital'] = capital
+    d['maxCapital'] = maxCapital
+    d['drawdown'] = drawdown
+    d['totalResult'] = totalResult
+    d['totalTurnover'] = totalTurnover
+    d['totalCommission'] = totalCommission
+    d['totalSlippage'] = totalSlippage
+    d['timeList'] = timeList
+    d['pnlList'] = pnlList
+    d['capitalList'] = capitalList
+    d['drawdownList'] = drawdownList
+    d['winningRate'] = winningRate
+    d['averageWinning'] = averageWinning
+    d['averageLosing'] = averageLosing
+    d['profitLossRatio'] = profitLossRatio
+    d['posList'] = posList
+    d['tradeTimeList'] = tradeTimeList
+
+    return d
+
+
+# ----------------------------------------------------------------------
+def checkResult(count, seed):
+    """比较当前和旧版回测结果计算方式的结果，一致则返回True"""
+    barList = generateBars(count, seed)
+    engine = runEngine(BacktestingEngine, barList, seed)
+
+    # 旧版计算会修改成交数量，使用副本
+    tradeList = [copy.copy(trade) for trade in engine.tradeDict.values()]
+    legacy = calculateLegacyResult(tradeList, engine.rate, engine.slippage, engine.size)
+    d = engine.calculateBacktestingResult()
+    print u'交易结果数量：当前%s，旧版%s' %(d.get('totalResult', 0), legacy.get('totalResult', 0))
+
+    if not d or not legacy:
+        print u'没有交易结果'
+        return False
+
+    for key in RESULT_KEYS:
+        if d[key] != legacy[key]:
+            print u'回测结果不一致：%s' %key
+            return False
+
+    for arrayKey, listKey in ARRAY_KEYS:
+        if d[arrayKey].tolist() != legacy[listKey]:
+            print u'回测结果不一致：%s' %arrayKey
+            return False
+
+    if d['maxDrawdown'] != min(legacy['drawdownList']):
+        print u'回测结果不一致：maxDrawdown'
+        return False
+
+    print u'回测结果一致'
+    return True
+
+
+# ----------------------------------------------------------------------
+def main():
+    """运行检查"""
+    parser = ArgumentParser(description=u'回测引擎撮合和回测结果一致性检查')
+    parser.add_argument('-n', '--count', type=int, default=5000, help=u'K线数量')
+    parser.add_argument('-s', '--seed', type=int, default=0, help=u'随机种子')
+    args = parser.parse_args()
+
+    crossOk = checkCross(args.count, args.seed)
+    resultOk = checkResult(args.count, args.seed)
+    if not (crossOk and resultOk):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
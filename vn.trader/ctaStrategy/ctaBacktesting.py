@@ -6,11 +6,20 @@
 '''
 from __future__ import division
 
+import os
+import json
+import shutil
+import tempfile
+import random
+import hashlib
+import inspect
 from datetime import datetime, timedelta
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from itertools import product
+from bisect import bisect_left, bisect_right, insort
 import multiprocessing
 import pymongo
+import numpy as np
 
 from ctaBase import *
 from vtConstant import *
@@ -18,6 +27,29 @@ from vtGateway import VtOrderData, VtTradeData
 from vtFunction import loadMongoSetting
 
 
+# 默认的历史数据缓存目录
+HISTORY_CACHE_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'historyCache')
+
+# 默认的参数优化结果存储目录
+OPTIMIZATION_RESULT_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'optimizationResult')
+
+# 缓存信息文件中日期的格式
+CACHE_DATE_FORMAT = '%Y%m%d %H:%M:%S'
+
+# 委托簿二分查找价格上界时使用的序号
+INF = float('inf')
+
+# 每年的交易日数量，用于年化收益率和夏普比率
+ANNUAL_DAYS = 240
+
+# 逐日盯市统计的结果字段，作为优化目标时自动启用逐日盯市统计
+DAILY_RESULT_FIELDS = ['totalDays', 'profitDays', 'lossDays', 'endBalance',
+                       'maxDailyDrawdown', 'maxDdPercent', 'totalNetPnl',
+                       'totalReturn', 'annualizedReturn', 'dailyReturn', 'returnStd',
+                       'sharpeRatio', 'returnDrawdownRatio',
+                       'dailyNetPnl', 'dailyTurnover', 'dailyCommission', 'dailySlippage']
+
+
 ########################################################################
 class BacktestingEngine(object):
     """
@@ -40,6 +72,7 @@ class BacktestingEngine(object):
         # key为stopOrderID，value为stopOrder对象
         self.stopOrderDict = {}             # 停止单撤销后不会从本字典中删除
         self.workingStopOrderDict = {}      # 停止单撤销后会从本字典中删除
+        self.stopOrderBook = OrderBook()    # 按价格排序的活动停止单，用于撮合
         
         # 引擎类型为回测
         self.engineType = ENGINETYPE_BACKTESTING
@@ -67,16 +100,40 @@ class BacktestingEngine(object):
         self.dbName = ''            # 回测数据库名
         self.symbol = ''            # 回测集合名
         
+        self.fastMode = False       # 是否使用K线快速回测
+        self.barArray = None        # 快速回测使用的列式K线数据
+        self.barArrayKey = None     # 已载入的K线数据对应的数据库、集合和日期范围
+        self.backtestingStart = 0   # 回测数据在列式K线数据中的起始位置
+        self.cacheFolder = ''       # 历史数据缓存目录，为空则不使用缓存
+        
+        self.dailyMode = False      # 是否进行逐日盯市统计
+        self.capital = 1000000      # 逐日盯市统计使用的初始资金
+        
+        self.optimizeStrategyClass = None   # 优化的策略类
+        self.optimizeTargetName = ''        # 优化目标字段
+        self.optimizePool = None            # 并行优化的进程池
+        self.optimizeProcessCount = 0       # 并行优化的进程数量
+        self.optimizeCount = 0              # 已完成的优化回测次数
+        self.optimizeBestResult = None      # 当前最优的(参数字典, 目标值)
+        self.optimizeStrategyKey = ''       # 优化的策略类的标识，包含源代码的摘要
+        self.optimizeDataEndDate = ''       # 优化使用的数据的实际结束时间
+        
+        self.resultFolder = ''              # 优化结果存储目录，为空则不存储
+        self.resultStore = None             # 优化结果存储
+        
         self.dataStartDate = None       # 回测数据开始日期，datetime对象
         self.dataEndDate = None         # 回测数据结束日期，datetime对象
         self.strategyStartDate = None   # 策略启动日期（即前面的数据用于初始化），datetime对象
         
         self.limitOrderDict = OrderedDict()         # 限价单字典
         self.workingLimitOrderDict = OrderedDict()  # 活动限价单字典，用于进行撮合用
+        self.limitOrderBook = OrderBook()           # 按价格排序的活动限价单，用于撮合
         self.limitOrderCount = 0                    # 限价单编号
         
         self.tradeCount = 0             # 成交编号
         self.tradeDict = OrderedDict()  # 成交字典
+        self.statistics = TradingStatistics()   # 随成交逐笔更新的交易统计
+        self.dailyStatistics = DailyStatistics()    # 逐日盯市统计
         
         self.logList = []               # 日志记录
         
@@ -104,12 +161,65 @@ class BacktestingEngine(object):
             self.dataEndDate= datetime.strptime(endDate, '%Y%m%d')
             # 若不修改时间则会导致不包含dataEndDate当天数据
             self.dataEndDate.replace(hour=23, minute=59)    
+        else:
+            self.dataEndDate = None
         
     # ----------------------------------------------------------------------
     def setBacktestingMode(self, mode):
         """设置回测模式"""
         self.mode = mode
     
+    # ----------------------------------------------------------------------
+    def setFastMode(self, fastMode):
+        """
+        设置是否使用K线快速回测（仅对K线模式有效）
+        
+        快速回测一次性将K线数据载入为NumPy列式数组，之后在内存中回放，
+        同一个引擎再次回测（如参数优化）相同的数据时不再访问数据库；
+        没有活动委托时不进行撮合。回测结果和普通回测完全一致。
+        """
+        self.fastMode = fastMode
+    
+    # ----------------------------------------------------------------------
+    def setCacheFolder(self, cacheFolder=HISTORY_CACHE_FOLDER):
+        """
+        设置历史数据的硬盘缓存目录（仅对K线快速回测有效），传入空字符串则不使用缓存
+        
+        第一次回测时从数据库载入的数据按字段保存到缓存目录，之后回测相同合约
+        范围内的数据时直接以内存映射的方式读取缓存文件，不再访问数据库。
+        没有设置结束日期的回测只使用同样没有结束日期的缓存，数据库中数据更新后
+        需要调用clearHistoryCache清空缓存。
+        """
+        self.cacheFolder = cacheFolder
+    
+    # ----------------------------------------------------------------------
+    def setDailyMode(self, dailyMode):
+        """
+        设置是否进行逐日盯市统计
+        
+        回测过程中记录每日的收盘价、持仓和成交，回测结束后按日结算盈亏，
+        计算夏普比率、年化收益率、收益回撤比、日均成交金额等指标（见DAILY_RESULT_FIELDS），
+        这些指标可以作为参数优化的目标，优化时会自动启用本统计。
+        """
+        self.dailyMode = dailyMode
+        
+    # ----------------------------------------------------------------------
+    def setCapital(self, capital):
+        """设置逐日盯市统计使用的初始资金"""
+        self.capital = capital
+    
+    # ----------------------------------------------------------------------
+    def setResultFolder(self, resultFolder=OPTIMIZATION_RESULT_FOLDER):
+        """
+        设置参数优化结果的存储目录，传入空字符串则不存储
+        
+        每组参数的回测结果按照策略类（包含源代码）、参数、数据范围和成本设置的
+        摘要保存在目录中，再次优化时已经回测过的参数直接使用保存的结果。
+        优化中断后重新运行同样的优化即可从中断处继续，扩大参数范围后也只需
+        回测新增的参数组合。
+        """
+        self.resultFolder = resultFolder
+    
     # ----------------------------------------------------------------------
     def setDatabase(self, dbName, symbol):
         """设置历史数据所用的数据库"""
@@ -119,19 +229,20 @@ class BacktestingEngine(object):
     # ----------------------------------------------------------------------
     def loadHistoryData(self):
         """载入历史数据"""
-        host, port, logging = loadMongoSetting()
-        
-        self.dbClient = pymongo.MongoClient(host, port)
+        if not self.dbClient:
+            host, port, logging = loadMongoSetting()
+            self.dbClient = pymongo.MongoClient(host, port)
+            
         collection = self.dbClient[self.dbName][self.symbol]          
 
         self.output(u'开始载入数据')
       
         # 首先根据回测模式，确认要使用的数据类
         if self.mode == self.BAR_MODE:
-            dataClass = CtaBarData
+            dataClass = CtaSlotBarData
             func = self.newBar
         else:
-            dataClass = CtaTickData
+            dataClass = CtaSlotTickData
             func = self.newTick
 
         # 载入初始化需要用的数据
@@ -142,8 +253,7 @@ class BacktestingEngine(object):
         # 将数据从查询指针中读取出，并生成列表
         self.initData = []              # 清空initData列表
         for d in initCursor:
-            data = dataClass()
-            data.__dict__ = d
+            data = dataClass.fromDict(d)
             self.initData.append(data)      
         
         # 载入回测数据
@@ -156,18 +266,150 @@ class BacktestingEngine(object):
         
         self.output(u'载入完成，数据量：%s' %(initCursor.count() + self.dbCursor.count()))
         
+    # ----------------------------------------------------------------------
+    def loadBarArray(self):
+        """载入列式K线数据，已经载入过相同范围的数据时直接使用"""
+        key = (self.dbName, self.symbol, self.dataStartDate, self.dataEndDate)
+        
+        if key != self.barArrayKey:
+            barArray = None
+            
+            # 优先从硬盘缓存载入
+            if self.cacheFolder:
+                barArray = self.loadBarArrayCache()
+                
+            # 缓存中没有时从数据库载入，并写入缓存
+            if barArray is None:
+                barArray = self.loadBarArrayDb()
+                
+                if self.cacheFolder:
+                    self.saveBarArrayCache(barArray)
+            
+            self.barArray = barArray
+            self.barArrayKey = key
+        
+        # 策略启动日期之前的数据用于初始化
+        self.backtestingStart = self.barArray.searchDatetime(self.strategyStartDate)
+        self.initData = self.barArray.getBarList(0, self.backtestingStart)
+        
+    # ----------------------------------------------------------------------
+    def loadBarArrayDb(self):
+        """从数据库载入列式K线数据"""
+        if not self.dbClient:
+            host, port, logging = loadMongoSetting()
+            self.dbClient = pymongo.MongoClient(host, port)
+            
+        collection = self.dbClient[self.dbName][self.symbol]
+        
+        self.output(u'开始载入数据')
+        
+        # 一次性读取初始化和回测所需的全部数据，按时间排序
+        if not self.dataEndDate:
+            flt = {'datetime':{'$gte':self.dataStartDate}}
+        else:
+            flt = {'datetime':{'$gte':self.dataStartDate,
+                               '$lte':self.dataEndDate}}
+        cursor = collection.find(flt, list(BarArray.FIELDS)).sort('datetime', pymongo.ASCENDING)
+        
+        barArray = BarArray.fromCursor(cursor)
+        
+        self.output(u'载入完成，数据量：%s' %len(barArray))
+        
+        return barArray
+    
+    # ----------------------------------------------------------------------
+    def getCachePath(self):
+        """获取当前合约的缓存目录"""
+        return os.path.join(self.cacheFolder, self.dbName, self.symbol)
+    
+    # ----------------------------------------------------------------------
+    def loadBarArrayCache(self):
+        """从硬盘缓存载入列式K线数据，缓存不存在或者不包含回测的日期范围时返回None"""
+        path = self.getCachePath()
+        
+        try:
+            with open(os.path.join(path, 'cache.json')) as f:
+                info = json.load(f)
+        except (IOError, ValueError):
+            return None
+        
+        # 检查缓存的日期范围是否包含回测需要的范围
+        cacheStartDate = datetime.strptime(info['startDate'], CACHE_DATE_FORMAT)
+        if cacheStartDate > self.dataStartDate:
+            return None
+        
+        if info['endDate']:
+            cacheEndDate = datetime.strptime(info['endDate'], CACHE_DATE_FORMAT)
+            if not self.dataEndDate or cacheEndDate < self.dataEndDate:
+                return None
+        
+        barArray = BarArray.load(path)
+        
+        # 截取回测需要的范围，和数据库查询的条件保持一致
+        start = barArray.searchDatetime(self.dataStartDate)
+        if self.dataEndDate:
+            end = barArray.searchDatetime(self.dataEndDate, 'right')
+        else:
+            end = len(barArray)
+        barArray = barArray.slice(start, end)
+        
+        self.output(u'从缓存载入数据，数据量：%s' %len(barArray))
+        
+        return barArray
+    
+    # ----------------------------------------------------------------------
+    def saveBarArrayCache(self, barArray):
+        """将列式K线数据写入硬盘缓存"""
+        path = self.getCachePath()
+        
+        # 先写入临时目录再替换，避免写入中断或者多个进程同时写入导致缓存损坏
+        tempPath = '%s.%s.tmp' %(path, os.getpid())
+        if os.path.exists(tempPath):
+            shutil.rmtree(tempPath)
+        
+        barArray.save(tempPath)
+        
+        info = {'startDate': self.dataStartDate.strftime(CACHE_DATE_FORMAT),
+                'endDate': ''}
+        if self.dataEndDate:
+            info['endDate'] = self.dataEndDate.strftime(CACHE_DATE_FORMAT)
+        
+        with open(os.path.join(tempPath, 'cache.json'), 'w') as f:
+            json.dump(info, f)
+        
+        try:
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            os.rename(tempPath, path)
+        except OSError:
+            shutil.rmtree(tempPath, ignore_errors=True)
+            
+    # ----------------------------------------------------------------------
+    def clearHistoryCache(self):
+        """清空当前合约的历史数据缓存"""
+        path = self.getCachePath()
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        
+        self.barArray = None
+        self.barArrayKey = None
+        
     # ----------------------------------------------------------------------
     def runBacktesting(self):
         """运行回测"""
+        if self.fastMode and self.mode == self.BAR_MODE:
+            self.runFastBacktesting()
+            return
+        
         # 载入历史数据
         self.loadHistoryData()
         
         # 首先根据回测模式，确认要使用的数据类
         if self.mode == self.BAR_MODE:
-            dataClass = CtaBarData
+            dataClass = CtaSlotBarData
             func = self.newBar
         else:
-            dataClass = CtaTickData
+            dataClass = CtaSlotTickData
             func = self.newTick
 
         self.output(u'开始回测')
@@ -183,17 +425,61 @@ class BacktestingEngine(object):
         self.output(u'开始回放数据')
 
         for d in self.dbCursor:
-            data = dataClass()
-            data.__dict__ = d
+            data = dataClass.fromDict(d)
             func(data)     
             
         self.output(u'数据回放结束')
         
+    # ----------------------------------------------------------------------
+    def runFastBacktesting(self):
+        """运行K线快速回测"""
+        # 载入列式K线数据
+        self.loadBarArray()
+        
+        self.output(u'开始回测')
+        
+        strategy = self.strategy
+        
+        strategy.inited = True
+        strategy.onInit()
+        self.output(u'策略初始化完成')
+        
+        strategy.trading = True
+        strategy.onStart()
+        self.output(u'策略启动完成')
+        
+        self.output(u'开始回放数据')
+        
+        # 活动委托字典在回测中不会被替换，直接引用可以减少属性访问
+        workingLimitOrderDict = self.workingLimitOrderDict
+        workingStopOrderDict = self.workingStopOrderDict
+        dailyMode = self.dailyMode
+        updatePrice = self.dailyStatistics.updatePrice
+        
+        for bar in self.barArray.iterBars(self.backtestingStart, len(self.barArray)):
+            self.bar = bar
+            self.dt = bar.datetime
+            
+            if dailyMode:
+                updatePrice(bar.datetime, bar.close)
+            
+            # 没有活动委托时跳过撮合
+            if workingLimitOrderDict:
+                self.crossLimitOrder()
+            if workingStopOrderDict:
+                self.crossStopOrder()
+                
+            strategy.onBar(bar)
+            
+        self.output(u'数据回放结束')
+        
     # ----------------------------------------------------------------------
     def newBar(self, bar):
         """新的K线"""
         self.bar = bar
         self.dt = bar.datetime
+        if self.dailyMode:
+            self.dailyStatistics.updatePrice(bar.datetime, bar.close)
         self.crossLimitOrder()      # 先撮合限价单
         self.crossStopOrder()       # 再撮合停止单
         self.strategy.onBar(bar)    # 推送K线到策略中
@@ -203,6 +489,8 @@ class BacktestingEngine(object):
         """新的Tick"""
         self.tick = tick
         self.dt = tick.datetime
+        if self.dailyMode:
+            self.dailyStatistics.updatePrice(tick.datetime, tick.lastPrice)
         self.crossLimitOrder()
         self.crossStopOrder()
         self.strategy.onTick(tick)
@@ -248,6 +536,7 @@ class BacktestingEngine(object):
         # 保存到限价单字典中
         self.workingLimitOrderDict[orderID] = order
         self.limitOrderDict[orderID] = order
+        self.limitOrderBook.add(orderID, order.direction, order.price, order)
         
         return orderID
     
@@ -259,6 +548,7 @@ class BacktestingEngine(object):
             order.status = STATUS_CANCELLED
             order.cancelTime = str(self.dt)
             del self.workingLimitOrderDict[vtOrderID]
+            self.limitOrderBook.remove(vtOrderID)
         
     # ----------------------------------------------------------------------
     def sendStopOrder(self, vtSymbol, orderType, price, volume, strategy):
@@ -290,6 +580,7 @@ class BacktestingEngine(object):
         # 保存stopOrder对象到字典中
         self.stopOrderDict[stopOrderID] = so
         self.workingStopOrderDict[stopOrderID] = so
+        self.stopOrderBook.add(stopOrderID, so.direction, so.price, so)
         
         return stopOrderID
     
@@ -301,7 +592,20 @@ class BacktestingEngine(object):
             so = self.workingStopOrderDict[stopOrderID]
             so.status = STOPORDER_CANCELLED
             del self.workingStopOrderDict[stopOrderID]
+            self.stopOrderBook.remove(stopOrderID)
             
+    # ----------------------------------------------------------------------
+    def sortCrossList(self, crossList, orderDict):
+        """
+        将委托簿中找出的[(序号, 委托编号, 委托)]按照委托字典的遍历顺序排列，返回[(委托编号, 委托)]
+        撮合顺序和逐个检查字典中全部委托时完全一致，从而成交编号和回调顺序不变
+        """
+        if len(crossList) < 2:
+            return [(orderID, order) for seq, orderID, order in crossList]
+        
+        crossDict = dict([(orderID, order) for seq, orderID, order in crossList])
+        return [(orderID, crossDict[orderID]) for orderID in orderDict if orderID in crossDict]
+    
     # ----------------------------------------------------------------------
     def crossLimitOrder(self):
         """基于最新数据撮合限价单"""
@@ -317,56 +621,65 @@ class BacktestingEngine(object):
             buyBestCrossPrice = self.tick.askPrice1
             sellBestCrossPrice = self.tick.bidPrice1
         
-        # 遍历限价单字典中的所有限价单
-        for orderID, order in self.workingLimitOrderDict.items():
-            # 判断是否会成交
-            buyCross = (order.direction==DIRECTION_LONG and 
-                        order.price>=buyCrossPrice and
-                        buyCrossPrice > 0)      # 国内的tick行情在涨停时askPrice1为0，此时买无法成交
-            
-            sellCross = (order.direction==DIRECTION_SHORT and 
-                         order.price<=sellCrossPrice and
-                         sellCrossPrice > 0)    # 国内的tick行情在跌停时bidPrice1为0，此时卖无法成交
-            
-            # 如果发生了成交
-            if buyCross or sellCross:
-                # 推送成交数据
-                self.tradeCount += 1            # 成交编号自增1
-                tradeID = str(self.tradeCount)
-                trade = VtTradeData()
-                trade.vtSymbol = order.vtSymbol
-                trade.tradeID = tradeID
-                trade.vtTradeID = tradeID
-                trade.orderID = order.orderID
-                trade.vtOrderID = order.orderID
-                trade.direction = order.direction
-                trade.offset = order.offset
-                
-                # 以买入为例：
-                # 1. 假设当根K线的OHLC分别为：100, 125, 90, 110
-                # 2. 假设在上一根K线结束(也是当前K线开始)的时刻，策略发出的委托为限价105
-                # 3. 则在实际中的成交价会是100而不是105，因为委托发出时市场的最优价格是100
-                if buyCross:
-                    trade.price = min(order.price, buyBestCrossPrice)
-                    self.strategy.pos += order.totalVolume
-                else:
-                    trade.price = max(order.price, sellBestCrossPrice)
-                    self.strategy.pos -= order.totalVolume
-                
-                trade.volume = order.totalVolume
-                trade.tradeTime = str(self.dt)
-                trade.dt = self.dt
-                self.strategy.onTrade(trade)
-                
-                self.tradeDict[tradeID] = trade
-                
-                # 推送委托数据
-                order.tradedVolume = order.totalVolume
-                order.status = STATUS_ALLTRADED
-                self.strategy.onOrder(order)
-                
-                # 从字典中删除该限价单
-                del self.workingLimitOrderDict[orderID]
+        # 从委托簿中找出价格被穿越的限价单
+        crossList = []
+        
+        # 国内的tick行情在涨停时askPrice1为0，此时买无法成交
+        if buyCrossPrice > 0:
+            crossList.extend(self.limitOrderBook.getLong(minPrice=buyCrossPrice))
+        
+        # 国内的tick行情在跌停时bidPrice1为0，此时卖无法成交
+        if sellCrossPrice > 0:
+            crossList.extend(self.limitOrderBook.getShort(maxPrice=sellCrossPrice))
+            
+        for orderID, order in self.sortCrossList(crossList, self.workingLimitOrderDict):
+            # 已在之前成交的回调函数中被撤销（逐个检查全部委托时此处会因删除不存在的键而出错）
+            if orderID not in self.workingLimitOrderDict:
+                continue
+            
+            buyCross = order.direction==DIRECTION_LONG
+            
+            # 推送成交数据
+            self.tradeCount += 1            # 成交编号自增1
+            tradeID = str(self.tradeCount)
+            trade = VtTradeData()
+            trade.vtSymbol = order.vtSymbol
+            trade.tradeID = tradeID
+            trade.vtTradeID = tradeID
+            trade.orderID = order.orderID
+            trade.vtOrderID = order.orderID
+            trade.direction = order.direction
+            trade.offset = order.offset
+            
+            # 以买入为例：
+            # 1. 假设当根K线的OHLC分别为：100, 125, 90, 110
+            # 2. 假设在上一根K线结束(也是当前K线开始)的时刻，策略发出的委托为限价105
+            # 3. 则在实际中的成交价会是100而不是105，因为委托发出时市场的最优价格是100
+            if buyCross:
+                trade.price = min(order.price, buyBestCrossPrice)
+                self.strategy.pos += order.totalVolume
+            else:
+                trade.price = max(order.price, sellBestCrossPrice)
+                self.strategy.pos -= order.totalVolume
+            
+            trade.volume = order.totalVolume
+            trade.tradeTime = str(self.dt)
+            trade.dt = self.dt
+            self.strategy.onTrade(trade)
+            
+            self.tradeDict[tradeID] = trade
+            self.statistics.addTrade(trade, self.rate, self.slippage, self.size)
+            if self.dailyMode:
+                self.dailyStatistics.addTrade(trade, self.rate, self.slippage, self.size)
+            
+            # 推送委托数据
+            order.tradedVolume = order.totalVolume
+            order.status = STATUS_ALLTRADED
+            self.strategy.onOrder(order)
+            
+            # 从字典中删除该限价单
+            del self.workingLimitOrderDict[orderID]
+            self.limitOrderBook.remove(orderID)
                 
     # ----------------------------------------------------------------------
     def crossStopOrder(self):
@@ -381,65 +694,69 @@ class BacktestingEngine(object):
             sellCrossPrice = self.tick.lastPrice
             bestCrossPrice = self.tick.lastPrice
         
-        # 遍历停止单字典中的所有停止单
-        for stopOrderID, so in self.workingStopOrderDict.items():
-            # 判断是否会成交
-            buyCross = so.direction==DIRECTION_LONG and so.price<=buyCrossPrice
-            sellCross = so.direction==DIRECTION_SHORT and so.price>=sellCrossPrice
-            
-            # 如果发生了成交
-            if buyCross or sellCross:
-                # 推送成交数据
-                self.tradeCount += 1            # 成交编号自增1
-                tradeID = str(self.tradeCount)
-                trade = VtTradeData()
-                trade.vtSymbol = so.vtSymbol
-                trade.tradeID = tradeID
-                trade.vtTradeID = tradeID
-                
-                if buyCross:
-                    self.strategy.pos += so.volume
-                    trade.price = max(bestCrossPrice, so.price)
-                else:
-                    self.strategy.pos -= so.volume
-                    trade.price = min(bestCrossPrice, so.price)                
-                
-                self.limitOrderCount += 1
-                orderID = str(self.limitOrderCount)
-                trade.orderID = orderID
-                trade.vtOrderID = orderID
-                
-                trade.direction = so.direction
-                trade.offset = so.offset
-                trade.volume = so.volume
-                trade.tradeTime = str(self.dt)
-                trade.dt = self.dt
-                self.strategy.onTrade(trade)
-                
-                self.tradeDict[tradeID] = trade
-                
-                # 推送委托数据
-                so.status = STOPORDER_TRIGGERED
-                
-                order = VtOrderData()
-                order.vtSymbol = so.vtSymbol
-                order.symbol = so.vtSymbol
-                order.orderID = orderID
-                order.vtOrderID = orderID
-                order.direction = so.direction
-                order.offset = so.offset
-                order.price = so.price
-                order.totalVolume = so.volume
-                order.tradedVolume = so.volume
-                order.status = STATUS_ALLTRADED
-                order.orderTime = trade.tradeTime
-                self.strategy.onOrder(order)
-                
-                self.limitOrderDict[orderID] = order
-                
-                # 从字典中删除该限价单
-                if stopOrderID in self.workingStopOrderDict:
-                    del self.workingStopOrderDict[stopOrderID]        
+        # 从委托簿中找出价格被穿越的停止单，和逐个检查全部停止单时一样，
+        # 在之前成交的回调函数中被撤销的停止单仍然会触发
+        crossList = self.stopOrderBook.getLong(maxPrice=buyCrossPrice)
+        crossList.extend(self.stopOrderBook.getShort(minPrice=sellCrossPrice))
+        
+        for stopOrderID, so in self.sortCrossList(crossList, self.workingStopOrderDict):
+            buyCross = so.direction==DIRECTION_LONG
+            
+            # 推送成交数据
+            self.tradeCount += 1            # 成交编号自增1
+            tradeID = str(self.tradeCount)
+            trade = VtTradeData()
+            trade.vtSymbol = so.vtSymbol
+            trade.tradeID = tradeID
+            trade.vtTradeID = tradeID
+            
+            if buyCross:
+                self.strategy.pos += so.volume
+                trade.price = max(bestCrossPrice, so.price)
+            else:
+                self.strategy.pos -= so.volume
+                trade.price = min(bestCrossPrice, so.price)                
+            
+            self.limitOrderCount += 1
+            orderID = str(self.limitOrderCount)
+            trade.orderID = orderID
+            trade.vtOrderID = orderID
+            
+            trade.direction = so.direction
+            trade.offset = so.offset
+            trade.volume = so.volume
+            trade.tradeTime = str(self.dt)
+            trade.dt = self.dt
+            self.strategy.onTrade(trade)
+            
+            self.tradeDict[tradeID] = trade
+            self.statistics.addTrade(trade, self.rate, self.slippage, self.size)
+            if self.dailyMode:
+                self.dailyStatistics.addTrade(trade, self.rate, self.slippage, self.size)
+            
+            # 推送委托数据
+            so.status = STOPORDER_TRIGGERED
+            
+            order = VtOrderData()
+            order.vtSymbol = so.vtSymbol
+            order.symbol = so.vtSymbol
+            order.orderID = orderID
+            order.vtOrderID = orderID
+            order.direction = so.direction
+            order.offset = so.offset
+            order.price = so.price
+            order.totalVolume = so.volume
+            order.tradedVolume = so.volume
+            order.status = STATUS_ALLTRADED
+            order.orderTime = trade.tradeTime
+            self.strategy.onOrder(order)
+            
+            self.limitOrderDict[orderID] = order
+            
+            # 从字典中删除该限价单
+            if stopOrderID in self.workingStopOrderDict:
+                del self.workingStopOrderDict[stopOrderID]        
+                self.stopOrderBook.remove(stopOrderID)
 
     # ----------------------------------------------------------------------
     def insertData(self, dbName, collectionName, data):
@@ -474,184 +791,16 @@ class BacktestingEngine(object):
         """
         self.output(u'计算回测结果')
         
-        # 首先基于回测后的成交记录，计算每笔交易的盈亏
-        resultList = []             # 交易结果列表
+        # 交易统计在回测过程中随成交逐笔更新，这里只需汇总
+        d = self.statistics.getResult()
         
-        longTrade = []              # 未平仓的多头交易
-        shortTrade = []             # 未平仓的空头交易
+        # 逐日盯市统计
+        if self.dailyMode:
+            d.update(self.dailyStatistics.getResult(self.capital, self.size))
         
-        tradeTimeList = []          # 每笔成交时间戳
-        posList = [0]               # 每笔成交后的持仓情况        
-
-        for trade in self.tradeDict.values():
-            # 多头交易
-            if trade.direction == DIRECTION_LONG:
-                # 如果尚无空头交易
-                if not shortTrade:
-                    longTrade.append(trade)
-                # 当前多头交易为平空
-                else:
-                    while True:
-                        entryTrade = shortTrade[0]
-                        exitTrade = trade
-                        
-                        # 清算开平仓交易
-                        closedVolume = min(exitTrade.volume, entryTrade.volume)
-                        result = TradingResult(entryTrade.price, entryTrade.dt, 
-                                               exitTrade.price, exitTrade.dt,
-                                               -closedVolume, self.rate, self.slippage, self.size)
-                        resultList.append(result)
-                        
-                        posList.extend([-1,0])
-                        tradeTimeList.extend([result.entryDt, result.exitDt])
-                        
-                        # 计算未清算部分
-                        entryTrade.volume -= closedVolume
-                        exitTrade.volume -= closedVolume
-                        
-                        # 如果开仓交易已经全部清算，则从列表中移除
-                        if not entryTrade.volume:
-                            shortTrade.pop(0)
-                        
-                        # 如果平仓交易已经全部清算，则退出循环
-                        if not exitTrade.volume:
-                            break
-                        
-                        # 如果平仓交易未全部清算，
-                        if exitTrade.volume:
-                            # 且开仓交易已经全部清算完，则平仓交易剩余的部分
-                            # 等于新的反向开仓交易，添加到队列中
-                            if not shortTrade:
-                                longTrade.append(exitTrade)
-                                break
-                            # 如果开仓交易还有剩余，则进入下一轮循环
-                            else:
-                                pass
-                        
-            # 空头交易        
-            else:
-                # 如果尚无多头交易
-                if not longTrade:
-                    shortTrade.append(trade)
-                # 当前空头交易为平多
-                else:                    
-                    while True:
-                        entryTrade = longTrade[0]
-                        exitTrade = trade
-                        
-                        # 清算开平仓交易
-                        closedVolume = min(exitTrade.volume, entryTrade.volume)
-                        result = TradingResult(entryTrade.price, entryTrade.dt, 
-                                               exitTrade.price, exitTrade.dt,
-                                               closedVolume, self.rate, self.slippage, self.size)
-                        resultList.append(result)
-                        
-                        posList.extend([1,0])
-                        tradeTimeList.extend([result.entryDt, result.exitDt])
-
-                        # 计算未清算部分
-                        entryTrade.volume -= closedVolume
-                        exitTrade.volume -= closedVolume
-                        
-                        # 如果开仓交易已经全部清算，则从列表中移除
-                        if not entryTrade.volume:
-                            longTrade.pop(0)
-                        
-                        # 如果平仓交易已经全部清算，则退出循环
-                        if not exitTrade.volume:
-                            break
-                        
-                        # 如果平仓交易未全部清算，
-                        if exitTrade.volume:
-                            # 且开仓交易已经全部清算完，则平仓交易剩余的部分
-                            # 等于新的反向开仓交易，添加到队列中
-                            if not longTrade:
-                                shortTrade.append(exitTrade)
-                                break
-                            # 如果开仓交易还有剩余，则进入下一轮循环
-                            else:
-                                pass                    
-                    
         # 检查是否有交易
-        if not resultList:
+        if not d:
             self.output(u'无交易结果')
-            return {}
-        
-        # 然后基于每笔交易的结果，我们可以计算具体的盈亏曲线和最大回撤等        
-        capital = 0             # 资金
-        maxCapital = 0          # 资金最高净值
-        drawdown = 0            # 回撤
-        
-        totalResult = 0         # 总成交数量
-        totalTurnover = 0       # 总成交金额（合约面值）
-        totalCommission = 0     # 总手续费
-        totalSlippage = 0       # 总滑点
-        
-        timeList = []           # 时间序列
-        pnlList = []            # 每笔盈亏序列
-        capitalList = []        # 盈亏汇总的时间序列
-        drawdownList = []       # 回撤的时间序列
-        
-        winningResult = 0       # 盈利次数
-        losingResult = 0        # 亏损次数		
-        totalWinning = 0        # 总盈利金额		
-        totalLosing = 0         # 总亏损金额        
-        
-        for result in resultList:
-            capital += result.pnl
-            maxCapital = max(capital, maxCapital)
-            drawdown = capital - maxCapital
-            
-            pnlList.append(result.pnl)
-            timeList.append(result.exitDt)      # 交易的时间戳使用平仓时间
-            capitalList.append(capital)
-            drawdownList.append(drawdown)
-            
-            totalResult += 1
-            totalTurnover += result.turnover
-            totalCommission += result.commission
-            totalSlippage += result.slippage
-            
-            if result.pnl >= 0:
-                winningResult += 1
-                totalWinning += result.pnl
-            else:
-                losingResult += 1
-                totalLosing += result.pnl
-                
-        # 计算盈亏相关数据
-        winningRate = winningResult/totalResult*100         # 胜率
-        
-        averageWinning = 0                                  # 这里把数据都初始化为0
-        averageLosing = 0
-        profitLossRatio = 0
-        
-        if winningResult:
-            averageWinning = totalWinning/winningResult     # 平均每笔盈利
-        if losingResult:
-            averageLosing = totalLosing/losingResult        # 平均每笔亏损
-        if averageLosing:
-            profitLossRatio = -averageWinning/averageLosing # 盈亏比
-
-        # 返回回测结果
-        d = {}
-        d['capital'] = capital
-        d['maxCapital'] = maxCapital
-        d['drawdown'] = drawdown
-        d['totalResult'] = totalResult
-        d['totalTurnover'] = totalTurnover
-        d['totalCommission'] = totalCommission
-        d['totalSlippage'] = totalSlippage
-        d['timeList'] = timeList
-        d['pnlList'] = pnlList
-        d['capitalList'] = capitalList
-        d['drawdownList'] = drawdownList
-        d['winningRate'] = winningRate
-        d['averageWinning'] = averageWinning
-        d['averageLosing'] = averageLosing
-        d['profitLossRatio'] = profitLossRatio
-        d['posList'] = posList
-        d['tradeTimeList'] = tradeTimeList
         
         return d
         
@@ -667,7 +816,7 @@ class BacktestingEngine(object):
         
         self.output(u'总交易次数：\t%s' % formatNumber(d['totalResult']))        
         self.output(u'总盈亏：\t%s' % formatNumber(d['capital']))
-        self.output(u'最大回撤: \t%s' % formatNumber(min(d['drawdownList'])))                
+        self.output(u'最大回撤: \t%s' % formatNumber(d['maxDrawdown']))                
         
         self.output(u'平均每笔盈利：\t%s' %formatNumber(d['capital']/d['totalResult']))
         self.output(u'平均每笔滑点：\t%s' %formatNumber(d['totalSlippage']/d['totalResult']))
@@ -677,6 +826,20 @@ class BacktestingEngine(object):
         self.output(u'盈利交易平均值\t%s' %formatNumber(d['averageWinning']))
         self.output(u'亏损交易平均值\t%s' %formatNumber(d['averageLosing']))
         self.output(u'盈亏比：\t%s' %formatNumber(d['profitLossRatio']))
+        
+        if d.get('totalDays'):
+            self.output('-' * 30)
+            self.output(u'交易日数：\t%s' % d['totalDays'])
+            self.output(u'盈利日数：\t%s' % d['profitDays'])
+            self.output(u'亏损日数：\t%s' % d['lossDays'])
+            self.output(u'结束资金：\t%s' % formatNumber(d['endBalance']))
+            self.output(u'总收益率：\t%s%%' % formatNumber(d['totalReturn']))
+            self.output(u'年化收益：\t%s%%' % formatNumber(d['annualizedReturn']))
+            self.output(u'最大回撤：\t%s' % formatNumber(d['maxDailyDrawdown']))
+            self.output(u'百分比最大回撤：\t%s%%' % formatNumber(d['maxDdPercent']))
+            self.output(u'日均成交金额：\t%s' % formatNumber(d['dailyTurnover']))
+            self.output(u'夏普比率：\t%s' % formatNumber(d['sharpeRatio']))
+            self.output(u'收益回撤比：\t%s' % formatNumber(d['returnDrawdownRatio']))
     
         # 绘图
         import matplotlib.pyplot as plt        
@@ -744,27 +907,29 @@ class BacktestingEngine(object):
     def runOptimization(self, strategyClass, optimizationSetting):
         """优化参数"""
         # 获取优化设置        
-        settingList = optimizationSetting.generateSetting()
         targetName = optimizationSetting.optimizeTarget
         
         # 检查参数设置问题
-        if not settingList or not targetName:
+        if not optimizationSetting.paramDict or not targetName:
             self.output(u'优化设置有问题，请检查')
         
-        # 遍历优化
-        resultList = []
-        for setting in settingList:
-            self.clearBacktestingResult()
-            self.output('-' * 30)
-            self.output('setting: %s' %str(setting))
-            self.initStrategy(strategyClass, setting)
-            self.runBacktesting()
-            d = self.calculateBacktestingResult()
-            try:
-                targetValue = d[targetName]
-            except KeyError:
-                targetValue = 0
-            resultList.append(([str(setting)], targetValue))
+        # 优化目标为逐日盯市统计的结果，优化结束后恢复原来的设置
+        savedDailyMode = self.dailyMode
+        if targetName in DAILY_RESULT_FIELDS:
+            self.setDailyMode(True)
+        
+        self.optimizeStrategyClass = strategyClass
+        
+        # 使用参数搜索算法选择需要回测的参数组合
+        search = optimizationSetting.search or GridSearch()
+        
+        self.startOptimization(strategyClass, targetName)
+        try:
+            resultList = search.run(optimizationSetting, self.evaluateSerial)
+        finally:
+            self.stopOptimization()
+            self.setDailyMode(savedDailyMode)
+        resultList = [(str(setting), targetValue) for setting, targetValue in resultList]
         
         # 显示结果
         resultList.sort(reverse=True, key=lambda result:result[1])
@@ -772,7 +937,182 @@ class BacktestingEngine(object):
         self.output(u'优化结果：')
         for result in resultList:
             self.output(u'%s: %s' %(result[0], result[1]))
-        return result
+        return resultList
+    
+    # ----------------------------------------------------------------------
+    def evaluateSerial(self, settingList, fraction=1):
+        """
+        在本进程中依次回测一组参数，返回[(参数字典, 目标值)]列表
+        fraction为使用的回测数据比例，小于1时只回测开头的部分数据
+        """
+        endDate = self.getFractionEndDate(fraction)
+        resultList, settingList = self.loadStoredResult(settingList, endDate, fraction)
+        
+        savedEndDate = self.endDate
+        self.setEndDate(endDate)
+        
+        try:
+            for setting in settingList:
+                self.clearBacktestingResult()
+                self.output('-' * 30)
+                self.output('setting: %s' %str(setting))
+                self.initStrategy(self.optimizeStrategyClass, setting)
+                self.runBacktesting()
+                d = getScalarResult(self.calculateBacktestingResult())
+                resultList.append(self.saveResult(setting, endDate, d, fraction))
+        finally:
+            self.setEndDate(savedEndDate)
+            
+        self.outputBatchResult(resultList, fraction)
+        return resultList
+    
+    # ----------------------------------------------------------------------
+    def getFractionEndDate(self, fraction):
+        """获取只使用开头fraction比例的回测数据时的结束日期"""
+        if fraction >= 1:
+            return self.endDate
+        
+        start = self.strategyStartDate
+        end = self.getDataEndDate()
+        
+        # 至少包含策略启动后的一个自然日
+        fractionEnd = start + timedelta(seconds=(end - start).total_seconds() * fraction)
+        fractionEnd = max(fractionEnd, start + timedelta(1))
+        
+        return fractionEnd.strftime('%Y%m%d')
+    
+    # ----------------------------------------------------------------------
+    def getDataEndDate(self):
+        """获取回测数据的结束时间"""
+        if self.dataEndDate:
+            return self.dataEndDate
+        
+        # 使用K线快速回测时从列式数据中获取
+        if self.fastMode and self.mode == self.BAR_MODE:
+            self.loadBarArray()
+            if len(self.barArray):
+                return self.barArray.datetimeArray[-1].astype(datetime)
+            return self.strategyStartDate
+        
+        # 否则查询数据库中最后一条数据的时间
+        if not self.dbClient:
+            host, port, logging = loadMongoSetting()
+            self.dbClient = pymongo.MongoClient(host, port)
+            
+        collection = self.dbClient[self.dbName][self.symbol]
+        flt = {'datetime':{'$gte':self.strategyStartDate}}
+        cursor = collection.find(flt, ['datetime']).sort('datetime', pymongo.DESCENDING).limit(1)
+        
+        for d in cursor:
+            return d['datetime']
+        return self.strategyStartDate
+    
+    # ----------------------------------------------------------------------
+    def startOptimization(self, strategyClass, targetName):
+        """开始优化，初始化优化进度并打开结果存储"""
+        self.optimizeTargetName = targetName
+        self.optimizeCount = 0          # 已完成的回测次数
+        self.optimizeBestResult = None  # 使用全部数据回测的当前最优结果
+        
+        # 策略类的标识包含源代码的摘要，修改策略代码后不再使用之前的结果
+        try:
+            source = inspect.getsource(strategyClass)
+        except (IOError, TypeError):
+            source = ''
+        self.optimizeStrategyKey = '%s.%s' %(strategyClass.__name__, 
+                                             hashlib.md5(source).hexdigest())
+        
+        if self.resultFolder:
+            # 未设置结束日期时使用实际数据的结束时间，数据更新后不再使用之前的结果
+            self.optimizeDataEndDate = str(self.getDataEndDate())
+            
+            path = os.path.join(self.resultFolder, '%s.jsonl' %strategyClass.__name__)
+            self.resultStore = OptimizationResultStore(path)
+            self.output(u'打开优化结果存储，已保存结果数量：%s' %len(self.resultStore))
+        
+    # ----------------------------------------------------------------------
+    def stopOptimization(self):
+        """结束优化，关闭结果存储"""
+        if self.resultStore is not None:
+            self.resultStore.close()
+            self.resultStore = None
+    
+    # ----------------------------------------------------------------------
+    def getResultKey(self, setting, endDate):
+        """获取一组参数回测结果的存储键，为策略、参数、数据范围和成本设置的摘要"""
+        content = {'strategy': self.optimizeStrategyKey,
+                   'setting': setting,
+                   'mode': self.mode,
+                   'dbName': self.dbName,
+                   'symbol': self.symbol,
+                   'startDate': self.startDate,
+                   'initDays': self.initDays,
+                   'endDate': endDate or self.optimizeDataEndDate,
+                   'slippage': self.slippage,
+                   'rate': self.rate,
+                   'size': self.size,
+                   'priceTick': self.priceTick,
+                   'dailyMode': self.dailyMode,
+                   'capital': self.capital}
+        return hashlib.md5(json.dumps(content, sort_keys=True)).hexdigest()
+    
+    # ----------------------------------------------------------------------
+    def loadStoredResult(self, settingList, endDate, fraction):
+        """从结果存储中载入已经回测过的参数，返回([(参数字典, 目标值)], 需要回测的参数列表)"""
+        if self.resultStore is None:
+            return [], settingList
+        
+        resultList = []
+        newList = []
+        
+        for setting in settingList:
+            d = self.resultStore.get(self.getResultKey(setting, endDate))
+            if d is None:
+                newList.append(setting)
+            else:
+                targetValue = d.get(self.optimizeTargetName, 0)
+                resultList.append((setting, targetValue))
+                self.updateOptimizationProgress(setting, targetValue, fraction)
+        
+        if resultList:
+            self.output(u'使用已保存的结果%s组，需要回测%s组' %(len(resultList), len(newList)))
+            
+        return resultList, newList
+    
+    # ----------------------------------------------------------------------
+    def saveResult(self, setting, endDate, d, fraction):
+        """保存一组参数的回测结果，返回(参数字典, 目标值)"""
+        if self.resultStore is not None:
+            self.resultStore.put(self.getResultKey(setting, endDate), setting, d)
+        
+        targetValue = d.get(self.optimizeTargetName, 0)
+        self.updateOptimizationProgress(setting, targetValue, fraction)
+        return setting, targetValue
+        
+    # ----------------------------------------------------------------------
+    def updateOptimizationProgress(self, setting, targetValue, fraction):
+        """更新优化进度，出现更优的结果时输出"""
+        self.optimizeCount += 1
+        
+        # 只有使用全部数据的结果参与比较
+        if fraction < 1:
+            return
+        
+        if self.optimizeBestResult is None or targetValue > self.optimizeBestResult[1]:
+            self.optimizeBestResult = (setting, targetValue)
+            self.output(u'当前最优（已完成%s次回测）：%s: %s' %(self.optimizeCount, 
+                                                           str(setting), targetValue))
+    
+    # ----------------------------------------------------------------------
+    def outputBatchResult(self, resultList, fraction):
+        """输出一组参数的回测结果汇总"""
+        if not resultList:
+            return
+        
+        setting, targetValue = max(resultList, key=lambda result:result[1])
+        self.output(u'完成%s组参数回测，数据比例%s，本组最优：%s: %s' %(len(resultList), 
+                                                                round(fraction, 4),
+                                                                str(setting), targetValue))
             
     # ----------------------------------------------------------------------
     def clearBacktestingResult(self):
@@ -781,48 +1121,144 @@ class BacktestingEngine(object):
         self.limitOrderCount = 0
         self.limitOrderDict.clear()
         self.workingLimitOrderDict.clear()        
+        self.limitOrderBook.clear()
         
         # 清空停止单相关
         self.stopOrderCount = 0
         self.stopOrderDict.clear()
         self.workingStopOrderDict.clear()
+        self.stopOrderBook.clear()
         
         # 清空成交相关
         self.tradeCount = 0
         self.tradeDict.clear()
+        self.statistics.clear()
+        self.dailyStatistics.clear()
+        
+        # 清空日志
+        del self.logList[:]
         
     # ----------------------------------------------------------------------
     def runParallelOptimization(self, strategyClass, optimizationSetting):
-        """并行优化参数"""
+        """
+        并行优化参数
+        
+        每个子进程只创建一个回测引擎，依次回测分配到的多组参数，参数按块分配以减少
+        进程间通讯。使用K线快速回测时，历史数据由主进程载入一次并写入硬盘缓存，
+        子进程以只读内存映射的方式共享读取，不再各自访问数据库。
+        """
         # 获取优化设置        
-        settingList = optimizationSetting.generateSetting()
         targetName = optimizationSetting.optimizeTarget
         
         # 检查参数设置问题
-        if not settingList or not targetName:
+        if not optimizationSetting.paramDict or not targetName:
             self.output(u'优化设置有问题，请检查')
         
+        # 优化目标为逐日盯市统计的结果，优化结束后恢复原来的设置
+        savedDailyMode = self.dailyMode
+        if targetName in DAILY_RESULT_FIELDS:
+            self.setDailyMode(True)
+        
+        # 准备子进程共享的历史数据
+        tempFolder = ''
+        cacheFolder = self.cacheFolder
+        
+        if self.fastMode and self.mode == self.BAR_MODE:
+            if not cacheFolder:
+                tempFolder = tempfile.mkdtemp()
+                cacheFolder = tempFolder
+            self.prepareSharedData(cacheFolder)
+        
+        engineSetting = {'mode': self.mode,
+                         'startDate': self.startDate,
+                         'initDays': self.initDays,
+                         'endDate': self.endDate,
+                         'slippage': self.slippage,
+                         'rate': self.rate,
+                         'size': self.size,
+                         'priceTick': self.priceTick,
+                         'dbName': self.dbName,
+                         'symbol': self.symbol,
+                         'fastMode': self.fastMode,
+                         'cacheFolder': cacheFolder,
+                         'dailyMode': self.dailyMode,
+                         'capital': self.capital}
+        
         # 多进程优化，启动一个对应CPU核心数量的进程池
-        pool = multiprocessing.Pool(multiprocessing.cpu_count())
-        l = []
-
-        for setting in settingList:
-            l.append(pool.apply_async(optimize, (strategyClass, setting,
-                                                 targetName, self.mode, 
-                                                 self.startDate, self.initDays, self.endDate,
-                                                 self.slippage, self.rate, self.size,
-                                                 self.dbName, self.symbol)))
-        pool.close()
-        pool.join()
+        self.optimizeProcessCount = multiprocessing.cpu_count()
+        self.optimizePool = multiprocessing.Pool(self.optimizeProcessCount, initOptimizeProcess,
+                                                 (engineSetting, strategyClass))
+        
+        # 使用参数搜索算法选择需要回测的参数组合
+        search = optimizationSetting.search or GridSearch()
+        
+        try:
+            self.startOptimization(strategyClass, targetName)
+            resultList = search.run(optimizationSetting, self.evaluateParallel)
+        except:
+            # 出错或者被Ctrl-C中断时直接结束子进程，不再等待剩余的任务完成
+            self.optimizePool.terminate()
+            raise
+        else:
+            self.optimizePool.close()
+        finally:
+            self.stopOptimization()
+            self.setDailyMode(savedDailyMode)
+            self.optimizePool.join()
+            self.optimizePool = None
+            
+            if tempFolder:
+                shutil.rmtree(tempFolder, ignore_errors=True)
+        
+        resultList = [(str(setting), targetValue) for setting, targetValue in resultList]
         
         # 显示结果
-        resultList = [res.get() for res in l]
         resultList.sort(reverse=True, key=lambda result:result[1])
         self.output('-' * 30)
         self.output(u'优化结果：')
         for result in resultList:
             self.output(u'%s: %s' %(result[0], result[1]))    
             
+        return resultList
+    
+    # ----------------------------------------------------------------------
+    def evaluateParallel(self, settingList, fraction=1):
+        """
+        在进程池中并行回测一组参数，返回[(参数字典, 目标值)]列表
+        fraction为使用的回测数据比例，小于1时只回测开头的部分数据
+        """
+        endDate = self.getFractionEndDate(fraction)
+        resultList, settingList = self.loadStoredResult(settingList, endDate, fraction)
+        taskList = [(setting, endDate) for setting in settingList]
+        
+        # 每个进程平均分到4块左右，兼顾通讯次数和各进程的负载均衡
+        chunkSize = max(1, len(taskList) // (self.optimizeProcessCount * 4))
+        
+        # 每完成一组参数就保存结果，优化中断时已完成的结果不会丢失
+        for setting, d in self.optimizePool.imap_unordered(optimizeSetting, taskList, chunkSize):
+            resultList.append(self.saveResult(setting, endDate, d, fraction))
+        
+        self.outputBatchResult(resultList, fraction)
+        return resultList
+    
+    # ----------------------------------------------------------------------
+    def prepareSharedData(self, cacheFolder):
+        """并行优化前确认缓存目录中有回测需要的列式K线数据"""
+        savedFolder = self.cacheFolder
+        self.cacheFolder = cacheFolder
+        
+        try:
+            if self.loadBarArrayCache() is None:
+                # 内存中已有相同范围的数据时直接写入，否则从数据库载入
+                key = (self.dbName, self.symbol, self.dataStartDate, self.dataEndDate)
+                if key == self.barArrayKey:
+                    barArray = self.barArray
+                else:
+                    barArray = self.loadBarArrayDb()
+                self.saveBarArrayCache(barArray)
+        finally:
+            self.cacheFolder = savedFolder
+            
     # ----------------------------------------------------------------------
     def roundToPriceTick(self, price):
         """取整价格到合约最小价格变动"""
@@ -835,13 +1271,231 @@ class BacktestingEngine(object):
         
 
 ########################################################################
-class TradingResult(object):
-    """每笔交易的结果"""
+class BarArray(object):
+    """
+    列式保存的K线数据
+    
+    每个字段保存为一个NumPy数组（datetime保存为datetime64数组），回放时按位置
+    取值直接生成K线对象，不再逐条从数据库文档转换。可以保存到硬盘，之后以
+    内存映射的方式载入，不需要读取全部文件内容。
+    """
+    
+    NUMBER_FIELDS = ('open', 'high', 'low', 'close', 'volume', 'openInterest')
+    STRING_FIELDS = ('vtSymbol', 'symbol', 'exchange', 'date', 'time')
+    COLUMN_FIELDS = NUMBER_FIELDS + STRING_FIELDS
+    FIELDS = COLUMN_FIELDS + ('datetime',)
 
     # ----------------------------------------------------------------------
-    def __init__(self, entryPrice, entryDt, exitPrice, 
-                 exitDt, volume, rate, slippage, size):
-        """Constructor"""
+    def __init__(self, columnDict, datetimeArray):
+        """
+        Constructor
+        columnDict：COLUMN_FIELDS中每个字段对应的数组
+        datetimeArray：K线时间的datetime64数组，按时间排序
+        """
+        self.columnDict = columnDict
+        self.datetimeArray = datetimeArray
+        
+    # ----------------------------------------------------------------------
+    @classmethod
+    def fromCursor(cls, cursor):
+        """从数据库查询指针创建，缺少的字段使用K线数据类中的默认值"""
+        default = CtaSlotBarData()
+        listDict = dict([(key, []) for key in cls.FIELDS])
+        
+        for d in cursor:
+            for key in cls.FIELDS:
+                listDict[key].append(d.get(key, getattr(default, key)))
+        
+        columnDict = {}
+        for key in cls.COLUMN_FIELDS:
+            column = np.array(listDict[key])
+            
+            # 数值字段中有空值时统一转为浮点数，保证数组可以保存和内存映射
+            if key in cls.NUMBER_FIELDS and column.dtype == object:
+                column = np.array(listDict[key], dtype=float)
+            
+            columnDict[key] = column
+            
+        datetimeArray = np.array(listDict['datetime'], dtype='datetime64[us]')
+            
+        return cls(columnDict, datetimeArray)
+    
+    # ----------------------------------------------------------------------
+    @classmethod
+    def load(cls, path):
+        """从硬盘目录中以内存映射的方式载入"""
+        columnDict = {}
+        for key in cls.COLUMN_FIELDS:
+            columnDict[key] = np.load(os.path.join(path, key + '.npy'), mmap_mode='r')
+            
+        datetimeArray = np.load(os.path.join(path, 'datetime.npy'), mmap_mode='r')
+        
+        return cls(columnDict, datetimeArray)
+    
+    # ----------------------------------------------------------------------
+    def save(self, path):
+        """保存到硬盘目录中，每个字段一个文件"""
+        if not os.path.exists(path):
+            os.makedirs(path)
+            
+        for key in self.COLUMN_FIELDS:
+            np.save(os.path.join(path, key + '.npy'), self.columnDict[key])
+            
+        np.save(os.path.join(path, 'datetime.npy'), self.datetimeArray)
+    
+    # ----------------------------------------------------------------------
+    def __len__(self):
+        """K线数量"""
+        return len(self.datetimeArray)
+    
+    # ----------------------------------------------------------------------
+    def searchDatetime(self, dt, side='left'):
+        """
+        查找时间dt在数据中的位置
+        side为left时返回第一根时间不早于dt的K线的位置，为right时返回第一根时间晚于dt的K线的位置
+        """
+        return int(np.searchsorted(self.datetimeArray, np.datetime64(dt, 'us'), side))
+    
+    # ----------------------------------------------------------------------
+    def slice(self, start, end):
+        """获取[start, end)范围内的数据，返回的对象和原对象共享数组内存"""
+        columnDict = dict([(key, column[start:end]) for key, column in self.columnDict.items()])
+        return BarArray(columnDict, self.datetimeArray[start:end])
+    
+    # ----------------------------------------------------------------------
+    def iterBars(self, start, end):
+        """逐根生成[start, end)范围内的K线对象"""
+        # 先将数组转为Python对象的列表，避免逐个元素生成NumPy数值对象
+        columnList = [self.columnDict[key][start:end].tolist() for key in self.COLUMN_FIELDS]
+        columnList.append(self.datetimeArray[start:end].tolist())
+            
+        newBar = CtaSlotBarData.__new__
+        
+        for (open_, high, low, close, volume, openInterest,
+             vtSymbol, symbol, exchange, date, time, dt) in zip(*columnList):
+            bar = newBar(CtaSlotBarData)
+            bar.open = open_
+            bar.high = high
+            bar.low = low
+            bar.close = close
+            bar.volume = volume
+            bar.openInterest = openInterest
+            bar.vtSymbol = vtSymbol
+            bar.symbol = symbol
+            bar.exchange = exchange
+            bar.date = date
+            bar.time = time
+            bar.datetime = dt
+            yield bar
+    
+    # ----------------------------------------------------------------------
+    def getBarList(self, start, end):
+        """获取[start, end)范围内的K线对象列表"""
+        return list(self.iterBars(start, end))
+
+
+########################################################################
+class OrderBook(object):
+    """
+    按价格排序的活动委托，用于撮合时快速找出价格被穿越的委托
+
+    多空两个方向各自维护一个按(价格, 序号)排序的列表，撮合时用二分查找
+    定位价格边界，只需访问会成交的委托，不再遍历全部活动委托。
+    序号按照委托加入的先后递增，用于保持委托发出的顺序。
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.seqCount = 0       # 委托序号
+
+        self.longList = []      # 多头委托的(价格, 序号)列表，按价格从低到高排序
+        self.shortList = []     # 空头委托的(价格, 序号)列表
+
+        self.seqDict = {}       # 序号：(委托编号, 委托对象)
+        self.idDict = {}        # 委托编号：(方向, 价格, 序号)
+
+    # ----------------------------------------------------------------------
+    def add(self, orderID, direction, price, order):
+        """添加委托"""
+        self.seqCount += 1
+        seq = self.seqCount
+
+        if direction == DIRECTION_LONG:
+            insort(self.longList, (price, seq))
+        else:
+            insort(self.shortList, (price, seq))
+
+        self.seqDict[seq] = (orderID, order)
+        self.idDict[orderID] = (direction, price, seq)
+
+    # ----------------------------------------------------------------------
+    def remove(self, orderID):
+        """删除委托"""
+        if orderID not in self.idDict:
+            return
+
+        direction, price, seq = self.idDict.pop(orderID)
+        del self.seqDict[seq]
+
+        if direction == DIRECTION_LONG:
+            l = self.longList
+        else:
+            l = self.shortList
+        del l[bisect_left(l, (price, seq))]
+
+    # ----------------------------------------------------------------------
+    def clear(self):
+        """清空委托"""
+        del self.longList[:]
+        del self.shortList[:]
+        self.seqDict.clear()
+        self.idDict.clear()
+
+    # ----------------------------------------------------------------------
+    def getLong(self, minPrice=None, maxPrice=None):
+        """获取价格在[minPrice, maxPrice]范围内的多头委托，返回(序号, 委托编号, 委托对象)列表"""
+        return self.getOrders(self.longList, minPrice, maxPrice)
+
+    # ----------------------------------------------------------------------
+    def getShort(self, minPrice=None, maxPrice=None):
+        """获取价格在[minPrice, maxPrice]范围内的空头委托，返回(序号, 委托编号, 委托对象)列表"""
+        return self.getOrders(self.shortList, minPrice, maxPrice)
+
+    # ----------------------------------------------------------------------
+    def getOrders(self, l, minPrice, maxPrice):
+        """二分查找价格范围内的委托"""
+        if minPrice is None:
+            start = 0
+        else:
+            start = bisect_left(l, (minPrice,))
+
+        if maxPrice is None:
+            end = len(l)
+        else:
+            end = bisect_right(l, (maxPrice, INF))
+
+        seqDict = self.seqDict
+        result = []
+        for price, seq in l[start:end]:
+            orderID, order = seqDict[seq]
+            result.append((seq, orderID, order))
+        return result
+
+    # ----------------------------------------------------------------------
+    def __len__(self):
+        """活动委托数量"""
+        return len(self.idDict)
+
+
+########################################################################
+class TradingResult(object):
+    """每笔交易的结果"""
+
+    # ----------------------------------------------------------------------
+    def __init__(self, entryPrice, entryDt, exitPrice, 
+                 exitDt, volume, rate, slippage, size):
+        """Constructor"""
         self.entryPrice = entryPrice    # 开仓价格
         self.exitPrice = exitPrice      # 平仓价格
         
@@ -857,6 +1511,324 @@ class TradingResult(object):
                     - self.commission - self.slippage)                      # 净盈亏
 
 
+########################################################################
+class TradingStatistics(object):
+    """
+    回测过程中随成交逐笔更新的交易统计
+
+    每笔成交按照先开先平的规则和未平仓的反向交易配对，生成交易结果后
+    立即累计盈亏、回撤、胜率、成交金额和手续费等统计，回测结束后
+    不再需要重新遍历全部成交。
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.clear()
+
+    # ----------------------------------------------------------------------
+    def clear(self):
+        """清空统计"""
+        self.longTrade = deque()    # 未平仓的多头交易，元素为[价格, 时间, 剩余数量]
+        self.shortTrade = deque()   # 未平仓的空头交易
+
+        self.capital = 0            # 资金
+        self.maxCapital = 0         # 资金最高净值
+        self.drawdown = 0           # 回撤
+
+        self.totalResult = 0        # 总成交数量
+        self.totalTurnover = 0      # 总成交金额（合约面值）
+        self.totalCommission = 0    # 总手续费
+        self.totalSlippage = 0      # 总滑点
+
+        self.winningResult = 0      # 盈利次数
+        self.losingResult = 0       # 亏损次数
+        self.totalWinning = 0       # 总盈利金额
+        self.totalLosing = 0        # 总亏损金额
+
+        self.timeList = []          # 时间序列
+        self.pnlList = []           # 每笔盈亏序列
+        self.capitalList = []       # 盈亏汇总的时间序列
+        self.drawdownList = []      # 回撤的时间序列
+
+        self.tradeTimeList = []     # 每笔成交时间戳
+        self.posList = [0]          # 每笔成交后的持仓情况
+
+    # ----------------------------------------------------------------------
+    def addTrade(self, trade, rate, slippage, size):
+        """加入一笔成交，和未平仓的反向交易配对清算"""
+        # 多头成交平空头，空头成交平多头
+        if trade.direction == DIRECTION_LONG:
+            entryQueue = self.shortTrade
+            openQueue = self.longTrade
+            pos = -1
+        else:
+            entryQueue = self.longTrade
+            openQueue = self.shortTrade
+            pos = 1
+
+        volume = trade.volume
+
+        # 从最早的开仓交易开始清算
+        while volume and entryQueue:
+            entry = entryQueue[0]
+            closedVolume = min(volume, entry[2])
+            result = TradingResult(entry[0], entry[1], trade.price, trade.dt,
+                                   pos*closedVolume, rate, slippage, size)
+            self.addResult(result, pos)
+
+            # 计算未清算部分，开仓交易已经全部清算则从队列中移除
+            entry[2] -= closedVolume
+            volume -= closedVolume
+
+            if not entry[2]:
+                entryQueue.popleft()
+
+        # 未清算的部分为新的开仓交易
+        if volume:
+            openQueue.append([trade.price, trade.dt, volume])
+
+    # ----------------------------------------------------------------------
+    def addResult(self, result, pos):
+        """累计一笔交易结果"""
+        self.capital += result.pnl
+        self.maxCapital = max(self.capital, self.maxCapital)
+        self.drawdown = self.capital - self.maxCapital
+
+        self.pnlList.append(result.pnl)
+        self.timeList.append(result.exitDt)     # 交易的时间戳使用平仓时间
+        self.capitalList.append(self.capital)
+        self.drawdownList.append(self.drawdown)
+
+        self.totalResult += 1
+        self.totalTurnover += result.turnover
+        self.totalCommission += result.commission
+        self.totalSlippage += result.slippage
+
+        if result.pnl >= 0:
+            self.winningResult += 1
+            self.totalWinning += result.pnl
+        else:
+            self.losingResult += 1
+            self.totalLosing += result.pnl
+
+        self.posList.extend([pos, 0])
+        self.tradeTimeList.extend([result.entryDt, result.exitDt])
+
+    # ----------------------------------------------------------------------
+    def getResult(self):
+        """汇总统计结果，没有交易结果时返回空字典"""
+        if not self.totalResult:
+            return {}
+
+        # 计算盈亏相关数据
+        winningRate = self.winningResult/self.totalResult*100   # 胜率
+
+        averageWinning = 0                                      # 这里把数据都初始化为0
+        averageLosing = 0
+        profitLossRatio = 0
+
+        if self.winningResult:
+            averageWinning = self.totalWinning/self.winningResult   # 平均每笔盈利
+        if self.losingResult:
+            averageLosing = self.totalLosing/self.losingResult      # 平均每笔亏损
+        if averageLosing:
+            profitLossRatio = -averageWinning/averageLosing         # 盈亏比
+
+        pnlArray = np.array(self.pnlList)
+        capitalArray = np.array(self.capitalList)
+        drawdownArray = np.array(self.drawdownList)
+
+        # 返回回测结果，列表为副本，修改后不影响统计
+        d = {}
+        d['capital'] = self.capital
+        d['maxCapital'] = self.maxCapital
+        d['drawdown'] = self.drawdown
+        d['maxDrawdown'] = drawdownArray.min()
+        d['totalResult'] = self.totalResult
+        d['totalTurnover'] = self.totalTurnover
+        d['totalCommission'] = self.totalCommission
+        d['totalSlippage'] = self.totalSlippage
+        d['timeList'] = list(self.timeList)
+        d['pnlList'] = list(self.pnlList)
+        d['capitalList'] = list(self.capitalList)
+        d['drawdownList'] = list(self.drawdownList)
+        d['winningRate'] = winningRate
+        d['averageWinning'] = averageWinning
+        d['averageLosing'] = averageLosing
+        d['profitLossRatio'] = profitLossRatio
+        d['posList'] = list(self.posList)
+        d['tradeTimeList'] = list(self.tradeTimeList)
+
+        # NumPy数组形式的时间序列
+        d['timeArray'] = np.array(self.timeList, dtype='datetime64[us]')
+        d['pnlArray'] = pnlArray
+        d['capitalArray'] = capitalArray
+        d['drawdownArray'] = drawdownArray
+
+        return d
+
+
+########################################################################
+class DailyResult(object):
+    """每个交易日的行情和成交记录"""
+
+    # ----------------------------------------------------------------------
+    def __init__(self, date, closePrice, startPos):
+        """Constructor"""
+        self.date = date                # 日期
+        self.closePrice = closePrice    # 收盘价
+        self.startPos = startPos        # 开盘持仓
+
+        self.posChange = 0              # 当日成交的持仓变化
+        self.cashFlow = 0               # 当日成交的持仓变化乘以成交价之和
+        self.turnover = 0               # 成交金额
+        self.commission = 0             # 手续费
+        self.slippage = 0               # 滑点
+        self.tradeCount = 0             # 成交笔数
+
+
+########################################################################
+class DailyStatistics(object):
+    """
+    逐日盯市统计
+
+    回测过程中只记录每日的收盘价和成交汇总，回测结束后使用NumPy
+    按日结算盈亏：持仓盈亏为开盘持仓乘以收盘价和昨收盘价之差，
+    交易盈亏为当日成交按收盘价计算的浮动盈亏。日期使用行情的自然日。
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.clear()
+
+    # ----------------------------------------------------------------------
+    def clear(self):
+        """清空统计"""
+        self.resultList = []        # 每日结果列表
+        self.result = None          # 当日结果
+        self.pos = 0                # 当前持仓
+
+    # ----------------------------------------------------------------------
+    def updatePrice(self, dt, price):
+        """更新最新价格，日期变化时创建新的每日结果"""
+        result = self.result
+
+        if result and result.date == dt.date():
+            result.closePrice = price
+        else:
+            self.result = DailyResult(dt.date(), price, self.pos)
+            self.resultList.append(self.result)
+
+    # ----------------------------------------------------------------------
+    def addTrade(self, trade, rate, slippage, size):
+        """加入一笔成交"""
+        if trade.direction == DIRECTION_LONG:
+            posChange = trade.volume
+        else:
+            posChange = -trade.volume
+
+        turnover = trade.price * trade.volume * size
+
+        result = self.result
+        result.posChange += posChange
+        result.cashFlow += posChange * trade.price
+        result.turnover += turnover
+        result.commission += turnover * rate
+        result.slippage += trade.volume * size * slippage
+        result.tradeCount += 1
+
+        self.pos += posChange
+
+    # ----------------------------------------------------------------------
+    def getResult(self, capital, size):
+        """结算每日盈亏并计算统计指标，没有数据时返回空字典"""
+        l = self.resultList
+        if not l:
+            return {}
+
+        closeArray = np.array([r.closePrice for r in l], dtype=float)
+        startPosArray = np.array([r.startPos for r in l], dtype=float)
+        posChangeArray = np.array([r.posChange for r in l], dtype=float)
+        cashFlowArray = np.array([r.cashFlow for r in l], dtype=float)
+        turnoverArray = np.array([r.turnover for r in l], dtype=float)
+        commissionArray = np.array([r.commission for r in l], dtype=float)
+        slippageArray = np.array([r.slippage for r in l], dtype=float)
+
+        # 第一天没有昨收盘价，此时开盘持仓为0，不影响持仓盈亏
+        preCloseArray = np.roll(closeArray, 1)
+        preCloseArray[0] = closeArray[0]
+
+        # 按日结算盈亏
+        positionPnlArray = startPosArray * (closeArray - preCloseArray) * size
+        tradingPnlArray = (posChangeArray * closeArray - cashFlowArray) * size
+        netPnlArray = positionPnlArray + tradingPnlArray - commissionArray - slippageArray
+
+        # 资金和回撤
+        balanceArray = capital + netPnlArray.cumsum()
+        highlevelArray = np.maximum(np.maximum.accumulate(balanceArray), capital)
+        drawdownArray = balanceArray - highlevelArray
+        ddPercentArray = drawdownArray / highlevelArray * 100
+
+        # 每日收益率
+        preBalanceArray = balanceArray - netPnlArray
+        returnArray = netPnlArray / preBalanceArray
+
+        totalDays = len(l)
+        endBalance = balanceArray[-1]
+        maxDdPercent = ddPercentArray.min()
+
+        totalReturn = (endBalance / capital - 1) * 100
+        annualizedReturn = totalReturn / totalDays * ANNUAL_DAYS
+        dailyReturn = returnArray.mean() * 100
+
+        if totalDays > 1:
+            returnStd = returnArray.std(ddof=1) * 100
+        else:
+            returnStd = 0
+
+        sharpeRatio = 0
+        if returnStd:
+            sharpeRatio = dailyReturn / returnStd * np.sqrt(ANNUAL_DAYS)
+
+        returnDrawdownRatio = 0
+        if maxDdPercent:
+            returnDrawdownRatio = -totalReturn / maxDdPercent
+
+        # 返回统计结果
+        d = {}
+        d['totalDays'] = totalDays
+        d['profitDays'] = int((netPnlArray > 0).sum())
+        d['lossDays'] = int((netPnlArray < 0).sum())
+        d['endBalance'] = float(endBalance)
+        d['maxDailyDrawdown'] = float(drawdownArray.min())
+        d['maxDdPercent'] = float(maxDdPercent)
+        d['totalNetPnl'] = float(netPnlArray.sum())
+        d['totalReturn'] = float(totalReturn)
+        d['annualizedReturn'] = float(annualizedReturn)
+        d['dailyReturn'] = float(dailyReturn)
+        d['returnStd'] = float(returnStd)
+        d['sharpeRatio'] = float(sharpeRatio)
+        d['returnDrawdownRatio'] = float(returnDrawdownRatio)
+        d['dailyNetPnl'] = float(netPnlArray.mean())
+        d['dailyTurnover'] = float(turnoverArray.mean())
+        d['dailyCommission'] = float(commissionArray.mean())
+        d['dailySlippage'] = float(slippageArray.mean())
+
+        # 每日数据
+        d['dateList'] = [r.date for r in l]
+        d['dailyCloseArray'] = closeArray
+        d['dailyPosArray'] = startPosArray + posChangeArray
+        d['dailyTradeCountArray'] = np.array([r.tradeCount for r in l])
+        d['dailyNetPnlArray'] = netPnlArray
+        d['balanceArray'] = balanceArray
+        d['dailyDrawdownArray'] = drawdownArray
+        d['dailyReturnArray'] = returnArray
+
+        return d
+
+
 
 ########################################################################
 class OptimizationSetting(object):
@@ -868,6 +1840,7 @@ class OptimizationSetting(object):
         self.paramDict = OrderedDict()
         
         self.optimizeTarget = ''        # 优化目标字段
+        self.search = None              # 参数搜索算法，为None时遍历全部参数组合
         
     # ----------------------------------------------------------------------
     def addParameter(self, name, start, end=None, step=None):
@@ -915,6 +1888,311 @@ class OptimizationSetting(object):
     def setOptimizeTarget(self, target):
         """设置优化目标字段"""
         self.optimizeTarget = target
+        
+    # ----------------------------------------------------------------------
+    def setSearch(self, search):
+        """
+        设置参数搜索算法，如RandomSearch、SuccessiveHalvingSearch、GeneticSearch
+        
+        参数组合较多时使用搜索算法代替遍历全部组合，例如：
+        setting = OptimizationSetting()
+        setting.setOptimizeTarget('sharpeRatio')
+        setting.addParameter('kkLength', 5, 50, 1)
+        setting.addParameter('kkDev', 1.0, 3.0, 0.1)
+        
+        # 随机抽取200组参数
+        setting.setSearch(RandomSearch(200))
+        # 先用1/9的数据回测243组参数，逐轮淘汰2/3，最后一轮使用全部数据
+        setting.setSearch(SuccessiveHalvingSearch(243, eta=3, minFraction=1/9.0))
+        # 遗传算法，每代50个个体，共20代
+        setting.setSearch(GeneticSearch(50, 20))
+        
+        engine.runParallelOptimization(KkStrategy, setting)
+        """
+        self.search = search
+        
+    # ----------------------------------------------------------------------
+    def getSettingCount(self):
+        """获取参数组合的总数"""
+        count = 1
+        for l in self.paramDict.values():
+            count *= len(l)
+        return count
+
+
+########################################################################
+class GridSearch(object):
+    """
+    参数搜索算法：遍历全部参数组合
+
+    搜索算法的run函数接收优化设置和回测函数evaluate(settingList, fraction=1)，
+    evaluate回测一组参数（fraction小于1时只使用开头部分的数据）并返回
+    [(参数字典, 目标值)]列表，run返回使用全部数据回测的结果列表。
+    """
+
+    # ----------------------------------------------------------------------
+    def run(self, optimizationSetting, evaluate):
+        """运行搜索"""
+        return evaluate(optimizationSetting.generateSetting())
+
+
+########################################################################
+class RandomSearch(object):
+    """参数搜索算法：随机抽取一定数量的参数组合，不生成全部组合"""
+
+    # ----------------------------------------------------------------------
+    def __init__(self, count=100, seed=None):
+        """Constructor"""
+        self.count = count                  # 抽取的参数组合数量
+        self.random = random.Random(seed)   # 随机数生成器，传入seed可以复现结果
+
+    # ----------------------------------------------------------------------
+    def run(self, optimizationSetting, evaluate):
+        """运行搜索"""
+        space = ParameterSpace(optimizationSetting, self.random)
+        indexList = space.sample(self.count)
+        return evaluate([space.getSetting(index) for index in indexList])
+
+
+########################################################################
+class SuccessiveHalvingSearch(object):
+    """
+    参数搜索算法：逐轮淘汰
+
+    随机抽取count组参数，先只用开头minFraction比例的数据回测，保留目标值
+    最好的1/eta进入下一轮，每轮的数据比例乘以eta，直到最后一轮使用全部数据。
+    表现差的参数只在少量数据上回测，总耗时远小于全部使用完整数据回测。
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, count=81, eta=3, minFraction=1/9, seed=None):
+        """Constructor"""
+        self.count = count                  # 第一轮的参数组合数量
+        self.eta = eta                      # 每轮保留的比例的倒数
+        self.minFraction = minFraction      # 第一轮使用的数据比例
+        self.random = random.Random(seed)
+
+    # ----------------------------------------------------------------------
+    def run(self, optimizationSetting, evaluate):
+        """运行搜索"""
+        space = ParameterSpace(optimizationSetting, self.random)
+        settingList = [space.getSetting(index) for index in space.sample(self.count)]
+
+        # 从全部数据开始往前推算每轮的数据比例
+        fractionList = [1]
+        while self.eta > 1 and fractionList[0] / self.eta >= self.minFraction * (1 - 1e-9):
+            fractionList.insert(0, fractionList[0] / self.eta)
+
+        for fraction in fractionList[:-1]:
+            resultList = evaluate(settingList, fraction)
+            resultList.sort(reverse=True, key=lambda result:result[1])
+
+            keepCount = max(1, len(resultList) // self.eta)
+            settingList = [setting for setting, targetValue in resultList[:keepCount]]
+
+        return evaluate(settingList)
+
+
+########################################################################
+class GeneticSearch(object):
+    """
+    参数搜索算法：遗传算法
+
+    每一代保留最优的个体，其余个体通过锦标赛选择父代、均匀交叉和变异产生，
+    变异时参数在取值列表中随机移动若干位。已经回测过的参数组合不再重复回测。
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, populationSize=50, generations=20, mutationRate=0.2,
+                 eliteRate=0.1, seed=None):
+        """Constructor"""
+        self.populationSize = populationSize    # 每一代的个体数量
+        self.generations = generations          # 代数
+        self.mutationRate = mutationRate        # 每个参数变异的概率
+        self.eliteRate = eliteRate              # 直接保留到下一代的最优个体比例
+        self.random = random.Random(seed)
+
+    # ----------------------------------------------------------------------
+    def run(self, optimizationSetting, evaluate):
+        """运行搜索"""
+        space = ParameterSpace(optimizationSetting, self.random)
+        resultDict = OrderedDict()      # 参数组合的位置：(参数字典, 目标值)
+
+        population = space.sample(self.populationSize)
+
+        for generation in range(self.generations):
+            # 回测新出现的个体
+            newList = [index for index in population if index not in resultDict]
+            settingList = [space.getSetting(index) for index in newList]
+            for index, result in zip(newList, self.evaluateOrdered(evaluate, settingList, space)):
+                resultDict[index] = result
+
+            population.sort(reverse=True, key=lambda index:resultDict[index][1])
+
+            # 最后一代或者全部组合都已回测时结束
+            if generation == self.generations - 1 or len(resultDict) >= space.count:
+                break
+
+            population = self.breed(population, resultDict, space)
+
+        return resultDict.values()
+
+    # ----------------------------------------------------------------------
+    def evaluateOrdered(self, evaluate, settingList, space):
+        """回测一组参数，结果按照参数的顺序返回"""
+        d = {}
+        for setting, targetValue in evaluate(settingList):
+            d[space.getIndex(setting)] = (setting, targetValue)
+        return [d[space.getIndex(setting)] for setting in settingList]
+
+    # ----------------------------------------------------------------------
+    def breed(self, population, resultDict, space):
+        """由按目标值排序的当前一代产生下一代"""
+        eliteCount = max(1, int(len(population) * self.eliteRate))
+        newPopulation = population[:eliteCount]
+        indexSet = set(newPopulation)
+
+        # 参数空间较小时可能无法产生足够的新个体，限制尝试次数
+        for i in range(self.populationSize * 20):
+            if len(newPopulation) >= self.populationSize:
+                break
+
+            parent1 = self.select(population, resultDict)
+            parent2 = self.select(population, resultDict)
+            child = self.mutate(self.crossover(parent1, parent2), space)
+
+            if child not in indexSet:
+                indexSet.add(child)
+                newPopulation.append(child)
+
+        return newPopulation
+
+    # ----------------------------------------------------------------------
+    def select(self, population, resultDict, size=3):
+        """锦标赛选择"""
+        l = [self.random.choice(population) for i in range(size)]
+        return max(l, key=lambda index:resultDict[index][1])
+
+    # ----------------------------------------------------------------------
+    def crossover(self, parent1, parent2):
+        """均匀交叉"""
+        return tuple([self.random.choice(pair) for pair in zip(parent1, parent2)])
+
+    # ----------------------------------------------------------------------
+    def mutate(self, index, space):
+        """变异，参数在取值列表中随机移动1到2位"""
+        l = list(index)
+        for n, size in enumerate(space.sizeList):
+            if size > 1 and self.random.random() < self.mutationRate:
+                step = self.random.choice([-2, -1, 1, 2])
+                l[n] = min(max(l[n] + step, 0), size - 1)
+        return tuple(l)
+
+
+########################################################################
+class ParameterSpace(object):
+    """参数空间，每组参数用各参数在取值列表中的位置组成的元组表示"""
+
+    # ----------------------------------------------------------------------
+    def __init__(self, optimizationSetting, randomGenerator):
+        """Constructor"""
+        self.nameList = optimizationSetting.paramDict.keys()
+        self.valueList = optimizationSetting.paramDict.values()
+        self.sizeList = [len(l) for l in self.valueList]
+        self.count = optimizationSetting.getSettingCount()
+        self.random = randomGenerator
+
+    # ----------------------------------------------------------------------
+    def getSetting(self, index):
+        """获取位置对应的参数字典"""
+        return dict([(name, values[i]) for name, values, i
+                     in zip(self.nameList, self.valueList, index)])
+
+    # ----------------------------------------------------------------------
+    def getIndex(self, setting):
+        """获取参数字典对应的位置"""
+        return tuple([values.index(setting[name]) for name, values
+                      in zip(self.nameList, self.valueList)])
+
+    # ----------------------------------------------------------------------
+    def sample(self, count):
+        """随机抽取不重复的count组参数"""
+        # 数量接近全部组合时直接打乱全部组合
+        if count * 2 >= self.count:
+            indexList = list(product(*[range(size) for size in self.sizeList]))
+            self.random.shuffle(indexList)
+            return indexList[:count]
+
+        indexSet = set()
+        indexList = []
+        while len(indexList) < count:
+            index = tuple([self.random.randrange(size) for size in self.sizeList])
+            if index not in indexSet:
+                indexSet.add(index)
+                indexList.append(index)
+        return indexList
+
+
+########################################################################
+class OptimizationResultStore(object):
+    """
+    参数优化结果的本地存储
+
+    每条结果为一行json（存储键、参数字典、回测结果的数值字段），只在文件末尾追加，
+    每写入一条就刷新到文件。进程被中断时最多损坏最后一行，读取时跳过即可。
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, path):
+        """Constructor"""
+        self.path = path
+        self.resultDict = {}        # 存储键：回测结果
+
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        # 读取已保存的结果
+        endsWithNewline = True
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                for line in f:
+                    endsWithNewline = line.endswith('\n')
+                    try:
+                        record = json.loads(line)
+                        self.resultDict[record['key']] = record['result']
+                    except (ValueError, KeyError, TypeError):
+                        continue
+
+        self.file = open(path, 'ab')
+
+        # 上次写入中断时最后一行不完整，换行后再追加
+        if not endsWithNewline:
+            self.file.write('\n')
+
+    # ----------------------------------------------------------------------
+    def get(self, key):
+        """获取结果，不存在时返回None"""
+        return self.resultDict.get(key)
+
+    # ----------------------------------------------------------------------
+    def put(self, key, setting, result):
+        """保存结果"""
+        self.resultDict[key] = result
+
+        record = {'key': key, 'setting': setting, 'result': result}
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    # ----------------------------------------------------------------------
+    def close(self):
+        """关闭存储"""
+        self.file.close()
+
+    # ----------------------------------------------------------------------
+    def __len__(self):
+        """已保存的结果数量"""
+        return len(self.resultDict)
 
 
 # ----------------------------------------------------------------------
@@ -924,6 +2202,13 @@ def formatNumber(n):
     return format(rn, ',')  # 加上千分符
     
 
+# ----------------------------------------------------------------------
+def getScalarResult(d):
+    """获取回测结果中的数值字段，用于优化时传输和保存"""
+    return dict([(k, v) for k, v in d.items() 
+                 if isinstance(v, (int, long, float)) and not isinstance(v, bool)])
+
+
 # ----------------------------------------------------------------------
 def optimize(strategyClass, setting, targetName,
              mode, startDate, initDays, endDate,
@@ -949,6 +2234,50 @@ def optimize(strategyClass, setting, targetName,
     return (str(setting), targetValue)    
 
 
+# 并行优化时子进程中的回测引擎和策略类
+processEngine = None
+processStrategyClass = None
+
+
+# ----------------------------------------------------------------------
+def initOptimizeProcess(engineSetting, strategyClass):
+    """并行优化时子进程的初始化函数，创建子进程中重复使用的回测引擎"""
+    global processEngine, processStrategyClass
+    
+    engine = BacktestingEngine()
+    engine.setBacktestingMode(engineSetting['mode'])
+    engine.setStartDate(engineSetting['startDate'], engineSetting['initDays'])
+    engine.setEndDate(engineSetting['endDate'])
+    engine.setSlippage(engineSetting['slippage'])
+    engine.setRate(engineSetting['rate'])
+    engine.setSize(engineSetting['size'])
+    engine.setPriceTick(engineSetting['priceTick'])
+    engine.setDatabase(engineSetting['dbName'], engineSetting['symbol'])
+    engine.setFastMode(engineSetting['fastMode'])
+    engine.setCacheFolder(engineSetting['cacheFolder'])
+    engine.setDailyMode(engineSetting['dailyMode'])
+    engine.setCapital(engineSetting['capital'])
+    
+    processEngine = engine
+    processStrategyClass = strategyClass
+    
+    
+# ----------------------------------------------------------------------
+def optimizeSetting(task):
+    """并行优化时在子进程中回测一组参数，task为(参数字典, 回测结束日期)"""
+    engine = processEngine
+    setting, endDate = task
+    
+    if endDate != engine.endDate:
+        engine.setEndDate(endDate)
+    
+    engine.clearBacktestingResult()
+    engine.initStrategy(processStrategyClass, setting)
+    engine.runBacktesting()
+    d = engine.calculateBacktestingResult()
+    return (setting, getScalarResult(d))
+
+
 if __name__ == '__main__':
     # 以下内容是一段回测脚本的演示，用户可以根据自己的需求修改
     # 建议使用ipython notebook或者spyder来做回测
@@ -960,6 +2289,9 @@ if __name__ == '__main__':
     
     # 设置引擎的回测模式为K线
     engine.setBacktestingMode(engine.BAR_MODE)
+    
+    # 使用K线快速回测
+    engine.setFastMode(True)
 
     # 设置回测用的数据起始日期
     engine.setStartDate('20110101')
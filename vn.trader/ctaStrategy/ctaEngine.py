@@ -28,7 +28,7 @@ from ctaBase import *
 from strategy import STRATEGY_CLASS
 from eventEngine import *
 from vtConstant import *
-from vtGateway import VtSubscribeReq, VtOrderReq, VtCancelOrderReq, VtLogData
+from vtGateway import VtSubscribeReq, VtOrderReq, VtCancelOrderReq, VtLogData, VtSlotData
 from vtFunction import todayDate
 
 
@@ -250,12 +250,11 @@ class CtaEngine(object):
         
         # 推送tick到对应的策略实例进行处理
         if tick.vtSymbol in self.tickStrategyDict:
-            # 将vtTickData数据转化为ctaTickData
-            ctaTick = CtaTickData()
-            d = ctaTick.__dict__
-            for key in d.keys():
+            # 将vtTickData数据转化为ctaTickData（使用__slots__版本，降低内存分配）
+            ctaTick = CtaSlotTickData()
+            for key in ctaTick.__slots__:
                 if key != 'datetime':
-                    d[key] = tick.__getattribute__(key)
+                    setattr(ctaTick, key, getattr(tick, key))
             # 添加datetime字段
             ctaTick.datetime = datetime.strptime(' '.join([tick.date, tick.time]), '%Y%m%d %H:%M:%S.%f')
             
@@ -328,8 +327,12 @@ class CtaEngine(object):
  
     # ----------------------------------------------------------------------
     def insertData(self, dbName, collectionName, data):
-        """插入数据到数据库（这里的data可以是CtaTickData或者CtaBarData）"""
-        self.mainEngine.dbInsert(dbName, collectionName, data.__dict__)
+        """插入数据到数据库（这里的data可以是CtaTickData或者CtaBarData，以及对应的__slots__版本）"""
+        if isinstance(data, VtSlotData):
+            d = data.toDict()
+        else:
+            d = data.__dict__
+        self.mainEngine.dbInsert(dbName, collectionName, d)
     
     # ----------------------------------------------------------------------
     def loadBar(self, dbName, collectionName, days):
@@ -337,12 +340,12 @@ class CtaEngine(object):
         startDate = self.today - timedelta(days)
         
         d = {'datetime':{'$gte':startDate}}
-        barData = self.mainEngine.dbQuery(dbName, collectionName, d)
+        barData = self.mainEngine.dbQueryIter(dbName, collectionName, d)
         
+        # 逐条读取并转换为和实盘推送、回测相同的__slots__版本数据类，不保存原始数据
         l = []
         for d in barData:
-            bar = CtaBarData()
-            bar.__dict__ = d
+            bar = CtaSlotBarData.fromDict(d)
             l.append(bar)
         return l
     
@@ -352,12 +355,12 @@ class CtaEngine(object):
         startDate = self.today - timedelta(days)
         
         d = {'datetime':{'$gte':startDate}}
-        tickData = self.mainEngine.dbQuery(dbName, collectionName, d)
+        tickData = self.mainEngine.dbQueryIter(dbName, collectionName, d)
         
+        # 逐条读取并转换为和实盘推送、回测相同的__slots__版本数据类，不保存原始数据
         l = []
         for d in tickData:
-            tick = CtaTickData()
-            tick.__dict__ = d
+            tick = CtaSlotTickData.fromDict(d)
             l.append(tick)
         return l    
     
@@ -1,18 +1,23 @@
 # encoding: UTF-8
 
 # 系统模块
-from Queue import Queue, Empty
-from threading import Thread
+from Queue import Empty
+from threading import Thread, Lock, Condition
 from time import sleep
-from collections import defaultdict
-
-# 第三方模块
-from PyQt4.QtCore import QTimer
+from timeit import default_timer
+from collections import deque
+from math import frexp
 
 # 自己开发的模块
 from eventType import *
 
 
+# 事件优先级，数值越小优先级越高
+EVENT_PRIORITY_HIGH = 0
+EVENT_PRIORITY_NORMAL = 1
+EVENT_PRIORITY_LOW = 2
+
+
 ########################################################################
 class EventEngine(object):
     """
@@ -24,7 +29,7 @@ class EventEngine(object):
     __queue：私有变量，事件队列
     __active：私有变量，事件引擎开关
     __thread：私有变量，事件处理线程
-    __timer：私有变量，计时器
+    __timer：私有变量，计时器（安装了PyQt4时为QTimer，否则为线程计时器）
     __handlers：私有变量，事件处理函数字典
     
     
@@ -38,6 +43,10 @@ class EventEngine(object):
     unregister：公共方法，向引擎中注销监听函数
     put：公共方法，向事件队列中存入新的事件
     
+    事件类型支持前缀监听：类型为eTick.IF1706的事件会先推送给注册在前缀
+    eTick.上的监听函数，再推送给注册在eTick.IF1706上的监听函数，因此
+    推送方只需存入一个带具体代码的事件。
+    
     事件监听函数必须定义为输入参数仅为一个event对象，即：
     
     函数
@@ -54,7 +63,7 @@ class EventEngine(object):
     def __init__(self):
         """初始化事件引擎"""
         # 事件队列
-        self.__queue = Queue()
+        self.__queue = EventQueue()
         
         # 事件引擎开关
         self.__active = False
@@ -63,15 +72,23 @@ class EventEngine(object):
         self.__thread = Thread(target = self.__run)
         
         # 计时器，用于触发计时器事件
-        self.__timer = QTimer()
-        self.__timer.timeout.connect(self.__onTimer)
+        self.__timer = TimerAdapter(self.__onTimer)
         
         # 这里的__handlers是一个字典，用来保存对应的事件调用关系
-        # 其中每个键对应的值是一个列表，列表中保存了对该事件进行监听的函数功能
-        self.__handlers = defaultdict(list)
+        # 其中每个键对应的值是一个元组，元组中保存了对该事件进行监听的函数功能
+        # 注册关系变化时不修改原有的字典和元组，而是生成新的对象整体替换（写时复制），
+        # 从而事件处理线程无需加锁即可读取
+        self.__handlers = {}
         
-        # __generalHandlers是一个列表，用来保存通用回调函数（所有事件均调用）
-        self.__generalHandlers = []
+        # __generalHandlers是一个元组，用来保存通用回调函数（所有事件均调用）
+        self.__generalHandlers = ()
+        
+        # __dispatchDict缓存每个事件类型最终要调用的处理函数元组
+        # （该类型的处理函数+通用处理函数），注册关系变化时整体替换
+        self.__dispatchDict = {}
+        
+        # 注册锁，仅用于保证多个线程同时注册时不会互相覆盖
+        self.__lock = Lock()
         
     # ----------------------------------------------------------------------
     def __run(self):
@@ -86,18 +103,25 @@ class EventEngine(object):
     # ----------------------------------------------------------------------
     def __process(self, event):
         """处理事件"""
-        # 检查是否存在对该事件进行监听的处理函数
-        if event.type_ in self.__handlers:
-            # 若存在，则按顺序将事件传递给处理函数执行
-            [handler(event) for handler in self.__handlers[event.type_]]
-            
-            # 以上语句为Python列表解析方式的写法，对应的常规循环写法为：
-            #for handler in self.__handlers[event.type_]:
-                #handler(event) 
-        
-        # 调用通用处理函数进行处理
-        if self.__generalHandlers:
-            [handler(event) for handler in self.__generalHandlers]
+        # 获取该事件类型对应的处理函数元组，若尚未缓存则生成
+        dispatchDict = self.__dispatchDict
+        handlers = dispatchDict.get(event.type_)
+        
+        if handlers is None:
+            handlers = self.__handlers.get(event.type_, ())
+            
+            # 对于后接具体代码的事件类型（如eTick.IF1706），同样调用监听
+            # 其前缀类型（如eTick.）的处理函数，从而一次推送即可同时送达两类监听
+            prefix = event.type_[:event.type_.find('.')+1]
+            if prefix and prefix != event.type_:
+                handlers = self.__handlers.get(prefix, ()) + handlers
+                
+            handlers = handlers + self.__generalHandlers
+            dispatchDict[event.type_] = handlers
+        
+        # 按顺序将事件传递给处理函数执行
+        for handler in handlers:
+            handler(event)
                
     # ----------------------------------------------------------------------
     def __onTimer(self):
@@ -139,114 +163,320 @@ class EventEngine(object):
     # ----------------------------------------------------------------------
     def register(self, type_, handler):
         """注册事件处理函数监听"""
-        # 尝试获取该事件类型对应的处理函数列表，若无defaultDict会自动创建新的list
-        handlerList = self.__handlers[type_]
-        
-        # 若要注册的处理器不在该事件的处理器列表中，则注册该事件
-        if handler not in handlerList:
-            handlerList.append(handler)
+        with self.__lock:
+            # 获取该事件类型对应的处理函数元组，若无则为空元组
+            handlers = self.__handlers.get(type_, ())
+            
+            # 若要注册的处理器不在该事件的处理器元组中，则生成新的字典替换原有字典
+            if handler not in handlers:
+                handlerDict = self.__handlers.copy()
+                handlerDict[type_] = handlers + (handler,)
+                self.__handlers = handlerDict
+                self.__dispatchDict = {}
             
     # ----------------------------------------------------------------------
     def unregister(self, type_, handler):
         """注销事件处理函数监听"""
-        # 尝试获取该事件类型对应的处理函数列表，若无则忽略该次注销请求   
-        handlerList = self.__handlers[type_]
-            
-        # 如果该函数存在于列表中，则移除
-        if handler in handlerList:
-            handlerList.remove(handler)
-
-        # 如果函数列表为空，则从引擎中移除该事件类型
-        if not handlerList:
-            del self.__handlers[type_]
+        with self.__lock:
+            # 获取该事件类型对应的处理函数元组，若无则忽略该次注销请求
+            handlers = self.__handlers.get(type_, ())
             
+            # 如果该函数存在于元组中，则生成新的字典替换原有字典
+            if handler in handlers:
+                handlerDict = self.__handlers.copy()
+                handlers = tuple([h for h in handlers if h != handler])
+                
+                # 如果函数元组为空，则从引擎中移除该事件类型
+                if handlers:
+                    handlerDict[type_] = handlers
+                else:
+                    del handlerDict[type_]
+                    
+                self.__handlers = handlerDict
+                self.__dispatchDict = {}
+        
     # ----------------------------------------------------------------------
     def put(self, event):
         """向事件队列中存入事件"""
         self.__queue.put(event)
         
+    # ----------------------------------------------------------------------
+    def qsize(self):
+        """获取队列中等待处理的事件数量"""
+        return self.__queue.qsize()
+        
     # ----------------------------------------------------------------------
     def registerGeneralHandler(self, handler):
         """注册通用事件处理函数监听"""
-        if handler not in self.__generalHandlers:
-            self.__generalHandlers.append(handler)
+        with self.__lock:
+            if handler not in self.__generalHandlers:
+                self.__generalHandlers = self.__generalHandlers + (handler,)
+                self.__dispatchDict = {}
             
     # ----------------------------------------------------------------------
     def unregisterGeneralHandler(self, handler):
         """注销通用事件处理函数监听"""
-        if handler in self.__generalHandlers:
-            self.__generalHandlers.remove(handler)
+        with self.__lock:
+            if handler in self.__generalHandlers:
+                self.__generalHandlers = tuple([h for h in self.__generalHandlers
+                                                if h != handler])
+                self.__dispatchDict = {}
+            
+    # ----------------------------------------------------------------------
+    def setEventPriority(self, type_, priority):
+        """设置事件类型（或前缀）在队列中的优先级"""
+        self.__queue.setPriority(type_, priority)
+        
+    # ----------------------------------------------------------------------
+    def setMaxQueueSize(self, maxSize):
+        """设置事件队列的最大长度，超过后可合并的事件只保留最新数据，0表示不限制"""
+        self.__queue.setMaxSize(maxSize)
         
+    # ----------------------------------------------------------------------
+    def setConflateTypes(self, types):
+        """设置队列超长时可以合并的事件类型（或前缀）"""
+        self.__queue.setConflateTypes(types)
 
 
 ########################################################################
 class EventEngine2(object):
     """
     计时器使用python线程的事件驱动引擎        
+    
+    分片模式（shardCount>0）：
+    委托、成交、持仓事件进入单独的高优先级队列，由主处理线程处理；
+    其他事件（行情等）按照事件类型（包含具体代码，如eTick.IF1706）分配到
+    shardCount个分片队列，每个分片有自己的处理线程。同一事件类型总是进入
+    同一个队列，因此同一合约的事件顺序不变，而缓慢的行情处理函数不会阻塞
+    委托成交的处理。
+    
+    注意分片模式下处理函数会在多个线程中被调用，注册的处理函数需要自行
+    保证线程安全，可以使用的处理函数见__init__的说明。
     """
+    
+    # 分片模式下进入高优先级队列的事件类型（前缀）
+    PRIORITY_TYPES = (EVENT_ORDER, EVENT_TRADE, EVENT_POSITION)
 
     # ----------------------------------------------------------------------
-    def __init__(self):
-        """初始化事件引擎"""
-        # 事件队列
-        self.__queue = Queue()
+    def __init__(self, shardCount=0):
+        """
+        初始化事件引擎
+        shardCount：分片队列的数量，默认为0即不分片，所有事件使用同一个队列
+        
+        分片模式下委托、成交、持仓事件在主处理线程中处理，其他事件在各分片线程中
+        处理，同一个对象注册的多个处理函数可能同时运行。只有以下处理函数可以在
+        分片模式下使用：
+        1. 不修改共享数据的函数，如界面组件的signal.emit（Qt跨线程信号）
+        2. 只处理行情事件、且按合约保存状态的函数（同一合约的行情总在同一个分片
+           中处理），如DrEngine的行情记录（数据存入Queue后由单独的线程写入数据库）
+        
+        CtaEngine、RmEngine、DataEngine的行情（或计时器）、委托、成交处理函数读写
+        同一组未加锁的字典，只能在不分片的引擎中使用，因此MainEngine创建的事件引擎
+        不使用分片模式，分片模式只用于单独创建的、注册上述处理函数的事件引擎。
+        """
+        # 事件队列（分片模式下作为高优先级队列）
+        self.__queue = EventQueue()
         
         # 事件引擎开关
         self.__active = False
         
         # 事件处理线程
-        self.__thread = Thread(target = self.__run)
+        self.__thread = Thread(target = self.__run, args=(self.__queue,))
+        
+        # 分片队列和对应的处理线程
+        self.__shardQueues = [EventQueue() for i in range(shardCount)]
+        self.__shardThreads = [Thread(target=self.__run, args=(queue,)) 
+                               for queue in self.__shardQueues]
         
         # 计时器，用于触发计时器事件
         self.__timer = Thread(target = self.__runTimer)
         self.__timerActive = False                      # 计时器工作状态
-        self.__timerSleep = 1                           # 计时器触发间隔（默认1秒）        
+        
+        # 计时器字典，键为计时器事件类型，值为触发间隔（秒），默认包含1秒的EVENT_TIMER
+        # 修改时整体替换，计时器线程无需加锁即可读取
+        self.__timerDict = {EVENT_TIMER: 1}
         
         # 这里的__handlers是一个字典，用来保存对应的事件调用关系
-        # 其中每个键对应的值是一个列表，列表中保存了对该事件进行监听的函数功能
-        self.__handlers = defaultdict(list)
+        # 其中每个键对应的值是一个元组，元组中保存了对该事件进行监听的函数功能
+        # 注册关系变化时不修改原有的字典和元组，而是生成新的对象整体替换（写时复制），
+        # 从而事件处理线程无需加锁即可读取
+        self.__handlers = {}
+        
+        # __generalHandlers是一个元组，用来保存通用回调函数（所有事件均调用）
+        self.__generalHandlers = ()
+        
+        # __dispatchDict缓存每个事件类型最终要调用的处理函数元组
+        # （该类型的处理函数+通用处理函数），注册关系变化时整体替换
+        self.__dispatchDict = {}
+        
+        # 注册锁，仅用于保证多个线程同时注册时不会互相覆盖
+        self.__lock = Lock()
         
-        # __generalHandlers是一个列表，用来保存通用回调函数（所有事件均调用）
-        self.__generalHandlers = []        
+        # 每批最多处理的事件数量
+        self.__batchSize = 100
+        
+        # 延迟统计相关
+        self.__statsActive = False      # 是否统计
+        self.__statsInterval = 0        # 发出统计事件的间隔（秒），0表示不发出
+        self.__statsTimerCount = 0      # 统计事件计时
+        self.__queueStats = {}          # 事件类型（前缀）对应的排队时间直方图
+        self.__handlerStats = {}        # 处理函数对应的执行时间直方图
         
     # ----------------------------------------------------------------------
-    def __run(self):
-        """引擎运行"""
+    def __run(self, queue):
+        """引擎运行，负责处理传入的队列中的事件"""
         while self.__active == True:
             try:
-                event = self.__queue.get(block=True, timeout=1)  # 获取事件的阻塞时间设为1秒
-                self.__process(event)
+                event = queue.get(block=True, timeout=1)  # 获取事件的阻塞时间设为1秒
             except Empty:
-                pass
+                continue
+            
+            # 取到事件后，将队列中已经积压的事件一次性取出，按顺序批量处理
+            for event in self.__drain(queue, event):
+                self.__process(event)
+            
+    # ----------------------------------------------------------------------
+    def __drain(self, queue, event):
+        """取出队列中积压的事件，和已经取到的事件组成一批（最多batchSize个）"""
+        batch = [event]
+        batch.extend(queue.getBatch(self.__batchSize - 1))
+        return batch
             
     # ----------------------------------------------------------------------
     def __process(self, event):
         """处理事件"""
-        # 检查是否存在对该事件进行监听的处理函数
-        if event.type_ in self.__handlers:
-            # 若存在，则按顺序将事件传递给处理函数执行
-            [handler(event) for handler in self.__handlers[event.type_]]
-            
-            # 以上语句为Python列表解析方式的写法，对应的常规循环写法为：
-            #for handler in self.__handlers[event.type_]:
-                #handler(event) 
+        # 获取该事件类型对应的处理函数元组，若尚未缓存则生成
+        dispatchDict = self.__dispatchDict
+        handlers = dispatchDict.get(event.type_)
+        
+        if handlers is None:
+            handlers = self.__handlers.get(event.type_, ())
+            
+            # 对于后接具体代码的事件类型（如eTick.IF1706），同样调用监听
+            # 其前缀类型（如eTick.）的处理函数，从而一次推送即可同时送达两类监听
+            prefix = event.type_[:event.type_.find('.')+1]
+            if prefix and prefix != event.type_:
+                handlers = self.__handlers.get(prefix, ()) + handlers
                 
-        # 调用通用处理函数进行处理
-        if self.__generalHandlers:
-            [handler(event) for handler in self.__generalHandlers]        
+            handlers = handlers + self.__generalHandlers
+            dispatchDict[event.type_] = handlers
+        
+        # 若启用了延迟统计，则使用统计版本的处理流程
+        if self.__statsActive:
+            self.__processWithStats(event, handlers)
+            return
+        
+        # 按顺序将事件传递给处理函数执行
+        for handler in handlers:
+            handler(event)
+            
+    # ----------------------------------------------------------------------
+    def __processWithStats(self, event, handlers):
+        """
+        处理事件，同时统计排队时间和每个处理函数的执行时间
+        
+        分片模式下多个线程可能同时更新同一个直方图，为了不在处理流程中加锁，
+        这里允许统计结果存在少量误差，仅用于诊断分析。
+        """
+        # 统计排队时间，按照事件类型的前缀汇总（如所有合约的TICK汇总到eTick.）
+        if event.putTime:
+            key = event.type_[:event.type_.find('.')+1] or event.type_
+            histogram = self.__queueStats.get(key)
+            if histogram is None:
+                histogram = self.__queueStats.setdefault(key, LatencyHistogram())
+            histogram.record(default_timer() - event.putTime)
+        
+        # 统计处理函数执行时间
+        handlerStats = self.__handlerStats
+        for handler in handlers:
+            start = default_timer()
+            handler(event)
+            cost = default_timer() - start
+            
+            histogram = handlerStats.get(handler)
+            if histogram is None:
+                histogram = handlerStats.setdefault(handler, LatencyHistogram())
+            histogram.record(cost)
+               
+    # ----------------------------------------------------------------------
+    def __onStatsTimer(self, event):
+        """计时器事件触发，定时发出延迟统计事件"""
+        self.__statsTimerCount += 1
+        
+        if self.__statsInterval and self.__statsTimerCount >= self.__statsInterval:
+            self.__statsTimerCount = 0
+            
+            statsEvent = Event(type_=EVENT_ENGINE_STATS)
+            statsEvent.dict_['data'] = self.getStats()
+            self.put(statsEvent)
                
     # ----------------------------------------------------------------------
     def __runTimer(self):
-        """运行在计时器线程中的循环函数"""
-        while self.__timerActive:
-            # 创建计时器事件
-            event = Event(type_=EVENT_TIMER)
+        """
+        运行在计时器线程中的循环函数
         
-            # 向队列中存入计时器事件
-            self.put(event)    
+        每个计时器的触发时间按照 起始时间+N*间隔 计算，而不是每次触发后再等待
+        一个间隔，因此存入事件的耗时不会累积成误差。若线程被阻塞错过了多次触发
+        （或系统时间被向前调整），则只补发一次，并跳到下一个未到的触发时间；
+        系统时间被向后调整（如NTP校时）导致距离下次触发超过一个间隔时，以当前
+        时间重新计算触发时间，避免计时器停止。
+        """
+        nextDict = {}       # 计时器事件类型对应的下次触发时间
+        
+        while self.__timerActive:
+            now = default_timer()
+            timerDict = self.__timerDict
+            
+            # 同步计时器的增加和删除
+            for type_ in nextDict.keys():
+                if type_ not in timerDict:
+                    del nextDict[type_]
             
-            # 等待
-            sleep(self.__timerSleep)
+            for type_, interval in timerDict.items():
+                if type_ not in nextDict:
+                    nextDict[type_] = now + interval
+            
+            # 触发已经到时间的计时器
+            for type_, nextTime in nextDict.items():
+                interval = timerDict[type_]
+                
+                # 系统时间被向后调整，重新计算触发时间
+                if nextTime - now > interval:
+                    nextDict[type_] = now + interval
+                    continue
+                
+                if now >= nextTime:
+                    # 创建计时器事件，并存入队列
+                    event = Event(type_=type_)
+                    self.put(event)
+                    
+                    nextDict[type_] = nextTime + (int((now - nextTime) / interval) + 1) * interval
+            
+            # 等待到最近的触发时间
+            if nextDict:
+                sleep(max(min(nextDict.values()) - default_timer(), 0))
+            else:
+                sleep(1)
+                
+    # ----------------------------------------------------------------------
+    def addTimer(self, type_, interval):
+        """
+        添加计时器，计时器线程启动后每隔interval秒发出一次type_类型的事件
+        若该类型的计时器已存在，则修改其触发间隔（如addTimer(EVENT_TIMER, 0.5)）
+        """
+        if interval <= 0:
+            raise ValueError(u'计时器间隔必须大于0')
+        
+        timerDict = self.__timerDict.copy()
+        timerDict[type_] = interval
+        self.__timerDict = timerDict
+        
+    # ----------------------------------------------------------------------
+    def removeTimer(self, type_):
+        """删除计时器"""
+        timerDict = self.__timerDict.copy()
+        timerDict.pop(type_, None)
+        self.__timerDict = timerDict
 
     # ----------------------------------------------------------------------
     def start(self, timer=True):
@@ -260,7 +490,10 @@ class EventEngine2(object):
         # 启动事件处理线程
         self.__thread.start()
         
-        # 启动计时器，计时器事件间隔默认设定为1秒
+        for thread in self.__shardThreads:
+            thread.start()
+        
+        # 启动计时器，EVENT_TIMER的间隔默认为1秒，其他计时器通过addTimer添加
         if timer:
             self.__timerActive = True
             self.__timer.start()
@@ -271,64 +504,472 @@ class EventEngine2(object):
         # 将引擎设为停止
         self.__active = False
         
-        # 停止计时器
+        # 停止计时器（若未启动计时器则无需等待）
         self.__timerActive = False
-        self.__timer.join()
+        if self.__timer.isAlive():
+            self.__timer.join()
         
         # 等待事件处理线程退出
         self.__thread.join()
+        
+        for thread in self.__shardThreads:
+            thread.join()
             
     # ----------------------------------------------------------------------
     def register(self, type_, handler):
         """注册事件处理函数监听"""
-        # 尝试获取该事件类型对应的处理函数列表，若无defaultDict会自动创建新的list
-        handlerList = self.__handlers[type_]
-        
-        # 若要注册的处理器不在该事件的处理器列表中，则注册该事件
-        if handler not in handlerList:
-            handlerList.append(handler)
+        with self.__lock:
+            # 获取该事件类型对应的处理函数元组，若无则为空元组
+            handlers = self.__handlers.get(type_, ())
+            
+            # 若要注册的处理器不在该事件的处理器元组中，则生成新的字典替换原有字典
+            if handler not in handlers:
+                handlerDict = self.__handlers.copy()
+                handlerDict[type_] = handlers + (handler,)
+                self.__handlers = handlerDict
+                self.__dispatchDict = {}
             
     # ----------------------------------------------------------------------
     def unregister(self, type_, handler):
         """注销事件处理函数监听"""
-        # 尝试获取该事件类型对应的处理函数列表，若无则忽略该次注销请求   
-        handlerList = self.__handlers[type_]
+        with self.__lock:
+            # 获取该事件类型对应的处理函数元组，若无则忽略该次注销请求
+            handlers = self.__handlers.get(type_, ())
             
-        # 如果该函数存在于列表中，则移除
-        if handler in handlerList:
-            handlerList.remove(handler)
-
-        # 如果函数列表为空，则从引擎中移除该事件类型
-        if not handlerList:
-            del self.__handlers[type_]  
+            # 如果该函数存在于元组中，则生成新的字典替换原有字典
+            if handler in handlers:
+                handlerDict = self.__handlers.copy()
+                handlers = tuple([h for h in handlers if h != handler])
+                
+                # 如果函数元组为空，则从引擎中移除该事件类型
+                if handlers:
+                    handlerDict[type_] = handlers
+                else:
+                    del handlerDict[type_]
+                    
+                self.__handlers = handlerDict
+                self.__dispatchDict = {}
         
     # ----------------------------------------------------------------------
     def put(self, event):
         """向事件队列中存入事件"""
-        self.__queue.put(event)
+        # 记录存入时间，用于统计排队时间
+        if self.__statsActive:
+            event.putTime = default_timer()
+        
+        # 非分片模式，或者委托、成交、持仓事件，存入主队列
+        if not self.__shardQueues or event.type_.startswith(self.PRIORITY_TYPES):
+            self.__queue.put(event)
+        # 其他事件按照事件类型存入对应的分片队列
+        else:
+            shard = hash(event.type_) % len(self.__shardQueues)
+            self.__shardQueues[shard].put(event)
+            
+    # ----------------------------------------------------------------------
+    def qsize(self):
+        """获取所有队列中等待处理的事件数量"""
+        return sum([queue.qsize() for queue in [self.__queue] + self.__shardQueues])
+        
+    # ----------------------------------------------------------------------
+    def setBatchSize(self, batchSize):
+        """设置每批最多处理的事件数量"""
+        self.__batchSize = max(int(batchSize), 1)
 
     # ----------------------------------------------------------------------
     def registerGeneralHandler(self, handler):
         """注册通用事件处理函数监听"""
-        if handler not in self.__generalHandlers:
-            self.__generalHandlers.append(handler)
+        with self.__lock:
+            if handler not in self.__generalHandlers:
+                self.__generalHandlers = self.__generalHandlers + (handler,)
+                self.__dispatchDict = {}
             
     # ----------------------------------------------------------------------
     def unregisterGeneralHandler(self, handler):
         """注销通用事件处理函数监听"""
-        if handler in self.__generalHandlers:
-            self.__generalHandlers.remove(handler)
+        with self.__lock:
+            if handler in self.__generalHandlers:
+                self.__generalHandlers = tuple([h for h in self.__generalHandlers
+                                                if h != handler])
+                self.__dispatchDict = {}
+            
+    # ----------------------------------------------------------------------
+    def setEventPriority(self, type_, priority):
+        """设置事件类型（或前缀）在队列中的优先级"""
+        for queue in [self.__queue] + self.__shardQueues:
+            queue.setPriority(type_, priority)
+        
+    # ----------------------------------------------------------------------
+    def setMaxQueueSize(self, maxSize):
+        """设置每个事件队列的最大长度，超过后可合并的事件只保留最新数据，0表示不限制"""
+        for queue in [self.__queue] + self.__shardQueues:
+            queue.setMaxSize(maxSize)
+        
+    # ----------------------------------------------------------------------
+    def setConflateTypes(self, types):
+        """设置队列超长时可以合并的事件类型（或前缀）"""
+        for queue in [self.__queue] + self.__shardQueues:
+            queue.setConflateTypes(types)
+            
+    # ----------------------------------------------------------------------
+    def setStatsActive(self, active, interval=0):
+        """
+        开关延迟统计功能
+        active：是否统计事件排队时间和处理函数执行时间
+        interval：每隔多少秒（计时器事件）发出一次EVENT_ENGINE_STATS统计事件，0表示不发出
+        """
+        self.__statsActive = active
+        self.__statsInterval = interval
+        self.__statsTimerCount = 0
+        
+        if active and interval:
+            self.register(EVENT_TIMER, self.__onStatsTimer)
+        else:
+            self.unregister(EVENT_TIMER, self.__onStatsTimer)
+            
+    # ----------------------------------------------------------------------
+    def clearStats(self):
+        """清空延迟统计数据"""
+        self.__queueStats = {}
+        self.__handlerStats = {}
+    
+    # ----------------------------------------------------------------------
+    def getStats(self):
+        """
+        获取延迟统计数据，返回字典：
+        queue：事件类型（前缀）对应排队时间的统计
+        handler：处理函数名称对应执行时间的统计
+        其中每项统计为包含count、mean、p50、p99、max的字典，时间单位为秒
+        """
+        queueStats = {}
+        for key, histogram in self.__queueStats.items():
+            queueStats[key] = histogram.getSummary()
+            
+        handlerStats = {}
+        for handler, histogram in self.__handlerStats.items():
+            handlerStats[getHandlerName(handler)] = histogram.getSummary()
+            
+        return {'queue': queueStats, 'handler': handlerStats}
+    
+    # ----------------------------------------------------------------------
+    def dumpStats(self):
+        """将延迟统计数据格式化为文本（时间单位为毫秒），按照最大值从高到低排序"""
+        stats = self.getStats()
+        
+        lines = []
+        for title, d in [(u'事件排队时间', stats['queue']), 
+                         (u'处理函数执行时间', stats['handler'])]:
+            lines.append(u'%s（毫秒）' % title)
+            lines.append('%-50s%10s%10s%10s%10s%10s' % ('name', 'count', 'mean', 
+                                                       'p50', 'p99', 'max'))
+            
+            l = sorted(d.items(), key=lambda item: item[1]['max'], reverse=True)
+            for name, summary in l:
+                lines.append('%-50s%10d%10.3f%10.3f%10.3f%10.3f' % (name, summary['count'],
+                                                                    summary['mean']*1000,
+                                                                    summary['p50']*1000,
+                                                                    summary['p99']*1000,
+                                                                    summary['max']*1000))
+            lines.append('')
+            
+        return '\n'.join(lines)
+
+
+########################################################################
+class EventQueue(object):
+    """
+    事件队列，用于替代Queue，增加了优先级和容量控制功能
+    
+    1. 优先级：事件类型（或前缀）可以设置不同的优先级，优先级高的事件先被
+       取出，同一优先级内的事件先进先出。默认全部事件为普通优先级（即和Queue
+       一样先进先出，不改变事件顺序），需要时通过setPriority设置，如将委托、
+       成交事件设为高优先级，TICK行情设为低优先级。
+    2. 容量控制：设置最大长度maxSize后，若队列中的事件数量已经达到该长度，
+       新到的可合并类型事件（默认为TICK行情）会直接替换队列中尚未处理的
+       同类型事件的数据（即每个合约只保留最新的行情），不再占用新的位置；
+       其他类型的事件（委托、成交等）永远不会被丢弃。maxSize为0时不做限制。
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.__mutex = Lock()
+        self.__notEmpty = Condition(self.__mutex)
+        
+        # 每个优先级对应一个deque
+        self.__queues = (deque(), deque(), deque())
+        self.__size = 0
+        
+        # 事件类型（或前缀）和优先级的映射字典，未设置的事件为普通优先级
+        self.__priorityDict = {}
+        
+        # 容量控制相关
+        self.__maxSize = 0                      # 最大长度，0表示不限制
+        self.__conflateTypes = (EVENT_TICK,)    # 可合并的事件类型（或前缀）
+        self.__pendingDict = {}                 # 可合并事件类型对应的最新一个尚未处理的事件
+        
+        self.conflatedCount = 0                 # 已经被合并掉的事件数量
+        
+    # ----------------------------------------------------------------------
+    def put(self, event):
+        """存入事件"""
+        type_ = event.type_
+        
+        # 先查找完整事件类型的优先级，若无则查找其前缀的优先级
+        priority = self.__priorityDict.get(type_)
+        if priority is None:
+            priority = self.__priorityDict.get(type_[:type_.find('.')+1], 
+                                               EVENT_PRIORITY_NORMAL)
+        
+        with self.__mutex:
+            if self.__maxSize and type_.startswith(self.__conflateTypes):
+                # 队列已满且存在尚未处理的同类型事件，则直接替换其数据
+                pending = self.__pendingDict.get(type_)
+                if pending is not None and self.__size >= self.__maxSize:
+                    pending.dict_ = event.dict_
+                    self.conflatedCount += 1
+                    return
+                
+                self.__pendingDict[type_] = event
+                
+            self.__queues[priority].append(event)
+            self.__size += 1
+            self.__notEmpty.notify()
+            
+    # ----------------------------------------------------------------------
+    def get(self, block=True, timeout=None):
+        """取出一个事件，若超时仍没有事件则抛出Empty异常"""
+        with self.__mutex:
+            if not self.__size and block:
+                self.__notEmpty.wait(timeout)
+            
+            if not self.__size:
+                raise Empty
+            
+            return self.__pop()
+        
+    # ----------------------------------------------------------------------
+    def getBatch(self, maxCount):
+        """不等待，一次性取出当前队列中的事件（最多maxCount个），返回列表"""
+        with self.__mutex:
+            return [self.__pop() for i in xrange(min(self.__size, maxCount))]
+        
+    # ----------------------------------------------------------------------
+    def __pop(self):
+        """从优先级最高的非空deque中取出事件，调用前必须已经加锁且队列非空"""
+        for queue in self.__queues:
+            if queue:
+                event = queue.popleft()
+                break
+        
+        self.__size -= 1
+        
+        if self.__pendingDict and self.__pendingDict.get(event.type_) is event:
+            del self.__pendingDict[event.type_]
+        
+        return event
+    
+    # ----------------------------------------------------------------------
+    def qsize(self):
+        """获取队列中的事件数量"""
+        return self.__size
+    
+    # ----------------------------------------------------------------------
+    def setPriority(self, type_, priority):
+        """设置事件类型（或前缀）的优先级"""
+        self.__priorityDict[type_] = priority
+        
+    # ----------------------------------------------------------------------
+    def setMaxSize(self, maxSize):
+        """设置最大长度，0表示不限制"""
+        self.__maxSize = maxSize
+        
+    # ----------------------------------------------------------------------
+    def setConflateTypes(self, types):
+        """设置可合并的事件类型（或前缀）"""
+        self.__conflateTypes = tuple(types)
+
+
+########################################################################
+class TimerAdapter(object):
+    """
+    EventEngine使用的计时器
+    
+    创建时才导入PyQt4：若已安装则使用QTimer（需要运行Qt事件循环），
+    否则使用python线程实现，从而服务器、回测等无界面程序导入本模块时
+    无需加载Qt，在未安装PyQt4的机器上也可以运行。
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, callback):
+        """
+        Constructor
+        callback：计时器触发时调用的函数，无参数
+        """
+        self.__callback = callback
+        self.__qtTimer = None               # Qt计时器
+        self.__thread = None                # 线程计时器
+        self.__active = False               # 线程计时器工作状态
+        self.__interval = 1                 # 线程计时器触发间隔（秒）
+        
+        try:
+            from PyQt4.QtCore import QTimer
+        except ImportError:
+            return
+        
+        self.__qtTimer = QTimer()
+        self.__qtTimer.timeout.connect(self.__callback)
+        
+    # ----------------------------------------------------------------------
+    def __run(self):
+        """
+        线程计时器的循环函数，按照 起始时间+N*间隔 触发，避免累积误差
+        错过多次触发（或系统时间被向前调整）时只触发一次，跳过错过的触发；
+        系统时间被向后调整时以当前时间重新计算触发时间
+        """
+        nextTime = default_timer() + self.__interval
+        
+        while self.__active:
+            interval = self.__interval
+            now = default_timer()
+            wait = nextTime - now
+            
+            # 系统时间被向后调整，重新计算触发时间
+            if wait > interval:
+                nextTime = now + interval
+                continue
+            
+            if wait > 0:
+                sleep(wait)
+                continue
+            
+            self.__callback()
+            nextTime += (int((now - nextTime) / interval) + 1) * interval
+        
+    # ----------------------------------------------------------------------
+    def start(self, msec):
+        """启动计时器，msec为触发间隔（毫秒），与QTimer.start一致"""
+        if self.__qtTimer:
+            self.__qtTimer.start(msec)
+            return
+        
+        self.__interval = msec / 1000.0
+        if not self.__active:
+            self.__active = True
+            self.__thread = Thread(target=self.__run)
+            self.__thread.daemon = True
+            self.__thread.start()
+        
+    # ----------------------------------------------------------------------
+    def stop(self):
+        """停止计时器"""
+        if self.__qtTimer:
+            self.__qtTimer.stop()
+            return
+        
+        self.__active = False
+        if self.__thread:
+            self.__thread.join()
+            self.__thread = None
+
+
+########################################################################
+class LatencyHistogram(object):
+    """
+    延迟直方图
+    
+    按照2的幂次（微秒）划分区间计数，内存占用固定，不保存每一个样本，
+    计算得到的分位数为所在区间的上限（不超过最大值）。
+    """
+    
+    BUCKET_COUNT = 32   # 区间数量，最后一个区间的上限约为2^31微秒
+
+    # ----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.buckets = [0] * self.BUCKET_COUNT    # 每个区间的样本数量
+        self.count = 0                            # 样本总数
+        self.total = 0.0                          # 样本总和（秒）
+        self.max = 0.0                            # 最大值（秒）
+        
+    # ----------------------------------------------------------------------
+    def record(self, seconds):
+        """记录一个样本，单位为秒"""
+        # 第i个区间对应[2^(i-1), 2^i)微秒
+        index = frexp(seconds * 1000000)[1]
+        if index < 0:
+            index = 0
+        elif index >= self.BUCKET_COUNT:
+            index = self.BUCKET_COUNT - 1
+        
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+            
+    # ----------------------------------------------------------------------
+    def getPercentile(self, percent):
+        """获取分位数（秒），percent为0-100"""
+        if not self.count:
+            return 0.0
+        
+        target = self.count * percent / 100.0
+        n = 0
+        for index, bucketCount in enumerate(self.buckets):
+            n += bucketCount
+            if n >= target:
+                return min((2 ** index) / 1000000.0, self.max)
+        
+        return self.max
+    
+    # ----------------------------------------------------------------------
+    def getSummary(self):
+        """获取统计摘要字典"""
+        d = {}
+        d['count'] = self.count
+        d['mean'] = self.total / self.count if self.count else 0.0
+        d['p50'] = self.getPercentile(50)
+        d['p99'] = self.getPercentile(99)
+        d['max'] = self.max
+        return d
 
 
 ########################################################################
-class Event:
+class Event(object):
     """事件对象"""
+    
+    # 使用__slots__保存属性，不再为每个事件对象额外创建__dict__
+    __slots__ = ('type_', 'dict_', 'putTime')
 
     # ----------------------------------------------------------------------
     def __init__(self, type_=None):
         """Constructor"""
         self.type_ = type_      # 事件类型
         self.dict_ = {}         # 字典用于保存具体的事件数据
+        self.putTime = 0        # 存入队列的时间，仅在事件引擎开启延迟统计时记录
+        
+    # ----------------------------------------------------------------------
+    def __getstate__(self):
+        """序列化状态（定义了__slots__的类需要提供，才能使用cPickle打包）"""
+        return (self.type_, self.dict_)
+    
+    # ----------------------------------------------------------------------
+    def __setstate__(self, state):
+        """恢复序列化状态（存入时间只在本进程内有意义，不做序列化）"""
+        self.type_, self.dict_ = state
+        self.putTime = 0
+
+
+# ----------------------------------------------------------------------
+def getHandlerName(handler):
+    """获取处理函数的名称，对象方法返回 类名.方法名"""
+    name = getattr(handler, '__name__', repr(handler))
+    
+    obj = getattr(handler, '__self__', None)
+    if obj is not None:
+        name = '.'.join([obj.__class__.__name__, name])
+        
+    return name
 
 
 # ----------------------------------------------------------------------
@@ -9,11 +9,18 @@
 常量的内容通常选择一个能够代表真实意义的字符串（便于理解）。
 
 建议将所有的常量定义放在该文件中，便于检查是否存在重复的现象。
+
+以.结尾的事件类型可以作为前缀使用：推送类型为EVENT_TICK+vtSymbol的事件时，
+注册在EVENT_TICK和EVENT_TICK+vtSymbol上的监听函数都会收到该事件。
 '''
 
 # 系统相关
 EVENT_TIMER = 'eTimer'                  # 计时器事件，每隔1秒发送一次
+EVENT_TIMER_FAST = 'eTimerFast'         # 快速计时器事件，需通过EventEngine2.addTimer添加
+EVENT_TIMER_SLOW = 'eTimerSlow'         # 慢速计时器事件，需通过EventEngine2.addTimer添加
+EVENT_TIMER_PUBLISH = 'eTimerPublish'   # VtServer合并推送行情的计时器事件
 EVENT_LOG = 'eLog'                      # 日志事件，全局通用
+EVENT_ENGINE_STATS = 'eEngineStats'     # 事件引擎延迟统计事件
 
 # Gateway相关
 EVENT_TICK = 'eTick.'                   # TICK行情事件，可后接具体的vtSymbol
@@ -3,6 +3,9 @@
 import threading
 import traceback
 import signal
+from itertools import count
+from Queue import Queue
+from timeit import default_timer
 
 import zmq
 from msgpack import packb, unpackb
@@ -102,7 +105,16 @@ class RpcObject(object):
 
 ########################################################################
 class RpcServer(RpcObject):
-    """RPC服务器"""
+    """
+    RPC服务器
+    
+    默认在服务器的工作线程中依次执行每个请求。
+    
+    调用useWorkerPool后，工作线程只负责收发socket上的数据，请求交给线程池执行，
+    耗时的调用（如查询大量数据的dbQuery）不会阻塞其他请求；其中发单、撤单等
+    函数进入单独的快速通道，由专门的线程处理。注意此时注册的函数可能在多个
+    线程中同时被调用。
+    """
 
     # ----------------------------------------------------------------------
     def __init__(self, repAddress, pubAddress):
@@ -111,20 +123,63 @@ class RpcServer(RpcObject):
         
         # 保存功能函数的字典，key是函数名，value是函数对象
         self.__functions = {}     
+        
+        # 调用统计字典，key是函数名，value是[调用次数, 失败次数, 总耗时, 最大耗时]
+        self.__callStats = {}
+        self.__statsLock = threading.Lock()
 
         # zmq端口相关
         self.__context = zmq.Context()
         
-        self.__socketREP = self.__context.socket(zmq.REP)   # 请求回应socket
+        # 请求回应socket，使用ROUTER以同时支持REQ客户端和流水线模式的DEALER客户端
+        self.__socketREP = self.__context.socket(zmq.ROUTER)
         self.__socketREP.bind(repAddress)
         
-        self.__socketPUB = self.__context.socket(zmq.PUB)   # 数据广播socket
+        # 数据广播socket，使用XPUB以获取客户端订阅的主题，没有客户端订阅的数据不做推送
+        self.__socketPUB = self.__context.socket(zmq.XPUB)
         self.__socketPUB.bind(pubAddress)
         
+        self.__topicSet = set()                           # 所有客户端订阅的主题（前缀）
+        self.__subscribedDict = {}                        # 缓存主题是否有客户端订阅
+        
         # 工作线程相关
         self.__active = False                             # 服务器的工作状态
         self.__thread = threading.Thread(target=self.run) # 服务器的工作线程
         
+        # 线程池相关
+        self.__workerCount = 0                            # 普通线程数量，0表示不使用线程池
+        self.__fastWorkerCount = 0                        # 快速通道线程数量
+        self.__fastNames = set()                          # 进入快速通道的函数名
+        self.__workerQueue = Queue()                      # 普通请求队列
+        self.__fastQueue = Queue()                        # 快速通道请求队列
+        self.__workers = []                               # 线程池中的线程
+        
+        # 线程池通过PUSH socket将调用结果交给工作线程发出
+        self.__replyAddress = 'inproc://rpcserver%s' % id(self)
+        self.__socketPULL = self.__context.socket(zmq.PULL)
+        self.__socketPULL.bind(self.__replyAddress)
+        
+    # ----------------------------------------------------------------------
+    def useWorkerPool(self, workerCount=4, fastNames=('sendOrder', 'cancelOrder'), 
+                      fastWorkerCount=1):
+        """
+        使用线程池处理请求，必须在start之前调用
+        workerCount：处理普通请求的线程数量
+        fastNames：进入快速通道的函数名
+        fastWorkerCount：快速通道的线程数量，默认为1以保证发单和撤单按照收到的顺序执行
+        """
+        self.__workerCount = workerCount
+        self.__fastWorkerCount = fastWorkerCount
+        self.__fastNames = set(fastNames)
+        
+        self.__workers = []
+        for i in range(workerCount):
+            self.__workers.append(threading.Thread(target=self.runWorker, 
+                                                   args=(self.__workerQueue,)))
+        for i in range(fastWorkerCount):
+            self.__workers.append(threading.Thread(target=self.runWorker, 
+                                                   args=(self.__fastQueue,)))
+    
     # ----------------------------------------------------------------------
     def start(self):
         """启动服务器"""
@@ -134,6 +189,11 @@ class RpcServer(RpcObject):
         # 启动工作线程
         if not self.__thread.isAlive():
             self.__thread.start()
+            
+        # 启动线程池
+        for worker in self.__workers:
+            if not worker.isAlive():
+                worker.start()
         
     # ----------------------------------------------------------------------
     def stop(self):
@@ -144,37 +204,141 @@ class RpcServer(RpcObject):
         # 等待工作线程退出
         if self.__thread.isAlive():
             self.__thread.join()
+            
+        # 通知线程池中的线程退出，并等待
+        for i in range(self.__workerCount):
+            self.__workerQueue.put(None)
+        for i in range(self.__fastWorkerCount):
+            self.__fastQueue.put(None)
+        
+        for worker in self.__workers:
+            if worker.isAlive():
+                worker.join()
     
     # ----------------------------------------------------------------------
     def run(self):
         """服务器运行函数"""
+        poller = zmq.Poller()
+        poller.register(self.__socketREP, zmq.POLLIN)
+        poller.register(self.__socketPULL, zmq.POLLIN)
+        
         while self.__active:
             # 使用poll来等待事件到达，等待1秒（1000毫秒）
-            if not self.__socketREP.poll(1000):
-                continue
+            events = dict(poller.poll(1000))
             
-            # 从请求响应socket收取请求数据
-            reqb = self.__socketREP.recv()
+            # 收取请求
+            if self.__socketREP in events:
+                while True:
+                    # 从请求响应socket收取请求数据，格式为[客户端标识, (请求编号,) 空帧, 请求数据]
+                    # 其中REQ客户端没有请求编号，最后一帧之前的部分原样返回即可送回对应的调用
+                    try:
+                        frames = self.__socketREP.recv_multipart(zmq.NOBLOCK)
+                    except zmq.Again:
+                        break
+                    envelope, reqb = frames[:-1], frames[-1]
+                    
+                    # 不使用线程池时直接执行调用，并通过请求响应socket返回调用结果
+                    if not self.__workers:
+                        repb = self.processRequest(reqb)
+                        self.__socketREP.send_multipart(envelope + [repb])
+                    # 否则根据函数名放入对应的请求队列
+                    else:
+                        name, args, kwargs = self.unpack(reqb)
+                        if name in self.__fastNames:
+                            self.__fastQueue.put((envelope, name, args, kwargs))
+                        else:
+                            self.__workerQueue.put((envelope, name, args, kwargs))
             
-            # 序列化解包
-            req = self.unpack(reqb)
+            # 将线程池的调用结果通过请求响应socket返回
+            if self.__socketPULL in events:
+                while True:
+                    try:
+                        frames = self.__socketPULL.recv_multipart(zmq.NOBLOCK)
+                    except zmq.Again:
+                        break
+                    self.__socketREP.send_multipart(frames)
+                    
+    # ----------------------------------------------------------------------
+    def runWorker(self, queue):
+        """线程池中线程的运行函数，执行队列中的请求，收到None时退出"""
+        socketPUSH = self.__context.socket(zmq.PUSH)
+        socketPUSH.connect(self.__replyAddress)
+        
+        while True:
+            task = queue.get()
+            if task is None:
+                break
             
-            # 获取函数名和参数
-            name, args, kwargs = req
+            envelope, name, args, kwargs = task
+            repb = self.callFunction(name, args, kwargs)
+            socketPUSH.send_multipart(envelope + [repb])
             
-            # 获取引擎中对应的函数对象，并执行调用，如果有异常则捕捉后返回
-            try:
-                func = self.__functions[name]
-                r = func(*args, **kwargs)
-                rep = [True, r]
-            except Exception as e:
-                rep = [False, traceback.format_exc()]
+        socketPUSH.close()
             
-            # 序列化打包
-            repb = self.pack(rep)
-            
-            # 通过请求响应socket返回调用结果
-            self.__socketREP.send(repb)
+    # ----------------------------------------------------------------------
+    def processRequest(self, reqb):
+        """处理一个序列化后的请求，返回序列化后的调用结果"""
+        # 序列化解包，获取函数名和参数
+        name, args, kwargs = self.unpack(reqb)
+        
+        return self.callFunction(name, args, kwargs)
+    
+    # ----------------------------------------------------------------------
+    def callFunction(self, name, args, kwargs):
+        """执行函数调用，返回序列化后的调用结果"""
+        start = default_timer()
+        
+        # 获取引擎中对应的函数对象，并执行调用，如果有异常则捕捉后返回
+        try:
+            func = self.__functions[name]
+            r = func(*args, **kwargs)
+            rep = [True, r]
+        except Exception as e:
+            rep = [False, traceback.format_exc()]
+        
+        # 序列化打包
+        repb = self.pack(rep)
+        
+        # 更新调用统计，耗时包括结果的序列化
+        cost = default_timer() - start
+        
+        with self.__statsLock:
+            stats = self.__callStats.get(name)
+            if stats is None:
+                stats = self.__callStats[name] = [0, 0, 0.0, 0.0]
+                
+            stats[0] += 1
+            if not rep[0]:
+                stats[1] += 1
+            stats[2] += cost
+            if cost > stats[3]:
+                stats[3] = cost
+        
+        return repb
+    
+    # ----------------------------------------------------------------------
+    def getCallStats(self):
+        """
+        获取每个函数的调用统计，返回字典，key是函数名，value是包含
+        count（调用次数）、error（失败次数）、total、mean、max（耗时，秒）的字典
+        """
+        with self.__statsLock:
+            callStats = dict([(name, list(stats)) for name, stats in self.__callStats.items()])
+        
+        d = {}
+        for name, (n, error, total, maxCost) in callStats.items():
+            d[name] = {'count': n, 
+                       'error': error,
+                       'total': total,
+                       'mean': total / n,
+                       'max': maxCost}
+        return d
+    
+    # ----------------------------------------------------------------------
+    def clearCallStats(self):
+        """清空调用统计"""
+        with self.__statsLock:
+            self.__callStats = {}
         
     # ----------------------------------------------------------------------
     def publish(self, topic, data):
@@ -183,12 +347,75 @@ class RpcServer(RpcObject):
         topic：主题内容
         data：具体的数据
         """
+        # 没有客户端订阅该主题时，无需序列化和推送
+        if not self.hasSubscriber(topic):
+            return
+        
         # 序列化数据
         datab = self.pack(data)
         
         # 通过广播socket发送数据
         self.__socketPUB.send_multipart([topic, datab])
         
+    # ----------------------------------------------------------------------
+    def publishRaw(self, topic, datab):
+        """
+        广播推送已经序列化的数据，用于使用其他方式编码的数据
+        （可以先通过hasSubscriber检查，避免编码没有客户端订阅的数据）
+        topic：主题内容
+        datab：序列化后的数据
+        """
+        self.__socketPUB.send_multipart([topic, datab])
+        
+    # ----------------------------------------------------------------------
+    def hasSubscriber(self, topic):
+        """检查是否有客户端订阅了该主题，需要在调用publish的线程中使用"""
+        self.__updateSubscription()
+        
+        subscribed = self.__subscribedDict.get(topic)
+        
+        if subscribed is None:
+            subscribed = False
+            for t in self.__topicSet:
+                if topic.startswith(t):
+                    subscribed = True
+                    break
+            self.__subscribedDict[topic] = subscribed
+        
+        return subscribed
+        
+    # ----------------------------------------------------------------------
+    def __updateSubscription(self):
+        """
+        收取客户端的订阅变化
+        XPUB对于同一主题只在第一个客户端订阅和最后一个客户端退订（或断开）时
+        发出通知，因此主题集合即为所有客户端订阅的并集
+        """
+        while True:
+            try:
+                msg = self.__socketPUB.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            
+            # 第一个字节为1表示订阅，0表示退订，其后为主题内容
+            subscribed = msg[0] == '\x01'
+            if subscribed:
+                self.__topicSet.add(msg[1:])
+            else:
+                self.__topicSet.discard(msg[1:])
+                
+            self.__subscribedDict = {}
+            self.onSubscription(msg[1:], subscribed)
+            
+    # ----------------------------------------------------------------------
+    def onSubscription(self, topic, subscribed):
+        """
+        主题的订阅状态发生变化，在调用hasSubscriber的线程中调用，由用户继承实现
+        topic：主题内容
+        subscribed：True表示第一个客户端订阅，False表示最后一个客户端退订
+        """
+        pass
+        
     # ----------------------------------------------------------------------
     def register(self, func):
         """注册函数"""
@@ -197,7 +424,16 @@ class RpcServer(RpcObject):
 
 ########################################################################
 class RpcClient(RpcObject):
-    """RPC客户端"""
+    """
+    RPC客户端
+    
+    默认使用REQ socket，每次调用都要等待上一次调用返回，且同时只能有一个调用。
+    
+    调用usePipeline后使用流水线模式：请求通过DEALER socket发出并附带请求编号，
+    由单独的IO线程负责收发，任意线程都可以同时发出调用，最多允许maxInflight个
+    调用同时等待返回。此时除了直接调用client.func(...)同步等待结果之外，还可以
+    通过client.asyncCall('func', ...)获取RpcFuture对象，异步等待结果或者添加回调。
+    """
     
     # ----------------------------------------------------------------------
     def __init__(self, reqAddress, subAddress):
@@ -216,37 +452,106 @@ class RpcClient(RpcObject):
         self.__active = False                                   # 客户端的工作状态
         self.__thread = threading.Thread(target=self.run)       # 客户端的工作线程
         
+        # 流水线模式相关
+        self.__pipeline = False                                 # 是否使用流水线模式
+        self.__inflight = None                                  # 限制同时等待返回的调用数量
+        self.__reqCount = count()                               # 请求编号
+        self.__futureDict = {}                                  # 请求编号对应的RpcFuture对象
+        self.__socketDEALER = None                              # 请求发出socket
+        self.__socketPULL = None                                # 接收各线程请求的socket
+        self.__pushAddress = 'inproc://rpcclient%s' % id(self)  # 各线程请求的发送地址
+        self.__local = threading.local()                        # 保存每个线程自己的PUSH socket
+        self.__pushSockets = []                                 # 所有线程的PUSH socket，停止时关闭
+        self.__futureLock = threading.Lock()                    # 保护客户端状态和请求字典
+        self.__ioThread = threading.Thread(target=self.runPipeline) # 流水线模式的IO线程
+        
     # ----------------------------------------------------------------------
     def __getattr__(self, name):
         """实现远程调用功能"""
-        # 执行远程调用任务
+        # 执行远程调用任务，等待并返回结果，调用失败则触发异常
         def dorpc(*args, **kwargs):
-            # 生成请求
-            req = [name, args, kwargs]
-            
-            # 序列化打包请求
-            reqb = self.pack(req)
+            return self.asyncCall(name, *args, **kwargs).get()
+        
+        return dorpc
+    
+    # ----------------------------------------------------------------------
+    def asyncCall(self, name, *args, **kwargs):
+        """
+        发出远程调用，返回RpcFuture对象
+        流水线模式下立即返回，否则等待调用完成后返回
+        """
+        future = RpcFuture()
+        
+        # 生成请求，并序列化打包
+        req = [name, args, kwargs]
+        reqb = self.pack(req)
+        
+        if self.__pipeline:
+            # 同时等待返回的调用数量达到上限时，阻塞直到有调用返回
+            self.__inflight.acquire()
             
+            # 客户端未启动或已停止时直接返回失败，不再等待没有IO线程处理的调用
+            # 加锁发出请求，避免PUSH socket在发出期间被stop关闭
+            with self.__futureLock:
+                if not self.__active:
+                    self.__inflight.release()
+                    future.setReply([False, u'RPC客户端未启动或已停止'])
+                    return future
+                
+                reqID = str(next(self.__reqCount))
+                self.__futureDict[reqID] = future
+                
+                # 通过本线程的PUSH socket交给IO线程发出
+                self.__getPushSocket().send_multipart([reqID, reqb])
+        else:
             # 发送请求并等待回应
             self.__socketREQ.send(reqb)
             repb = self.__socketREQ.recv()
             
             # 序列化解包回应
-            rep = self.unpack(repb)
-            
-            # 若正常则返回结果，调用失败则触发异常
-            if rep[0]:
-                return rep[1]
-            else:
-                raise RemoteException(rep[1])
+            future.setReply(self.unpack(repb))
         
-        return dorpc
+        return future
+    
+    # ----------------------------------------------------------------------
+    def __getPushSocket(self):
+        """
+        获取当前线程的PUSH socket，zmq的socket不能跨线程使用，因此每个线程各自创建
+        需要在持有__futureLock时调用
+        """
+        socket = getattr(self.__local, 'socket', None)
+        
+        # 客户端停止时会关闭所有PUSH socket，重新启动后需要重新创建
+        if socket is None or socket.closed:
+            socket = self.__context.socket(zmq.PUSH)
+            socket.connect(self.__pushAddress)
+            self.__local.socket = socket
+            self.__pushSockets.append(socket)
+            
+        return socket
+    
+    # ----------------------------------------------------------------------
+    def usePipeline(self, maxInflight=100):
+        """
+        使用流水线模式，必须在start之前调用
+        maxInflight：最多同时等待返回的调用数量
+        """
+        self.__pipeline = True
+        self.__inflight = threading.Semaphore(maxInflight)
     
     # ----------------------------------------------------------------------
     def start(self):
         """启动客户端"""
         # 连接端口
-        self.__socketREQ.connect(self.__reqAddress)
+        if self.__pipeline:
+            self.__socketDEALER = self.__context.socket(zmq.DEALER)
+            self.__socketDEALER.connect(self.__reqAddress)
+            
+            self.__socketPULL = self.__context.socket(zmq.PULL)
+            self.__socketPULL.bind(self.__pushAddress)
+        else:
+            self.__socketREQ.connect(self.__reqAddress)
+            
         self.__socketSUB.connect(self.__subAddress)
     
         # 将服务器设为启动
@@ -255,16 +560,72 @@ class RpcClient(RpcObject):
         # 启动工作线程
         if not self.__thread.isAlive():
             self.__thread.start()
+            
+        if self.__pipeline and not self.__ioThread.isAlive():
+            self.__ioThread.start()
     
     # ----------------------------------------------------------------------
     def stop(self):
         """停止客户端"""
-        # 将客户端设为停止
-        self.__active = False
+        # 将客户端设为停止，之后发出的调用直接返回失败
+        with self.__futureLock:
+            self.__active = False
         
         # 等待工作线程退出
         if self.__thread.isAlive():
             self.__thread.join()
+            
+        if self.__ioThread.isAlive():
+            self.__ioThread.join()
+            
+        # 尚未返回的调用全部设为失败，并释放占用的调用数量
+        with self.__futureLock:
+            futureDict = self.__futureDict
+            self.__futureDict = {}
+            pushSockets = self.__pushSockets
+            self.__pushSockets = []
+            
+        for future in futureDict.values():
+            self.__inflight.release()
+            future.setReply([False, u'RPC客户端已停止'])
+            
+        # 关闭各线程的PUSH socket
+        for socket in pushSockets:
+            socket.close(linger=0)
+        
+    # ----------------------------------------------------------------------
+    def runPipeline(self):
+        """流水线模式IO线程的运行函数，负责发出各线程的请求，并分发调用结果"""
+        poller = zmq.Poller()
+        poller.register(self.__socketPULL, zmq.POLLIN)
+        poller.register(self.__socketDEALER, zmq.POLLIN)
+        
+        while self.__active:
+            # 使用poll来等待事件到达，等待1秒（1000毫秒）
+            events = dict(poller.poll(1000))
+            
+            # 转发各线程的请求，帧格式与REQ保持一致：[请求编号, 空帧, 请求数据]
+            if self.__socketPULL in events:
+                while True:
+                    try:
+                        reqID, reqb = self.__socketPULL.recv_multipart(zmq.NOBLOCK)
+                    except zmq.Again:
+                        break
+                    self.__socketDEALER.send_multipart([reqID, '', reqb])
+            
+            # 收取调用结果，根据请求编号设置到对应的RpcFuture对象上
+            if self.__socketDEALER in events:
+                while True:
+                    try:
+                        reqID, empty, repb = self.__socketDEALER.recv_multipart(zmq.NOBLOCK)
+                    except zmq.Again:
+                        break
+                    
+                    future = self.__futureDict.pop(reqID, None)
+                    self.__inflight.release()
+                    
+                    if future:
+                        future.setReply(self.unpack(repb))
         
     # ----------------------------------------------------------------------
     def run(self):
@@ -278,11 +639,16 @@ class RpcClient(RpcObject):
             topic, datab = self.__socketSUB.recv_multipart()
             
             # 序列化解包
-            data = self.unpack(datab)
+            data = self.unpackPublish(topic, datab)
 
             # 调用回调函数处理
             self.callback(topic, data)
             
+    # ----------------------------------------------------------------------
+    def unpackPublish(self, topic, datab):
+        """解包广播数据，服务器使用publishRaw推送其他编码的数据时，由用户继承实现解码"""
+        return self.unpack(datab)
+            
     # ----------------------------------------------------------------------
     def callback(self, topic, data):
         """回调函数，必须由用户实现"""
@@ -296,8 +662,78 @@ class RpcClient(RpcObject):
         可以使用topic=''来订阅所有的主题
         """
         self.__socketSUB.setsockopt(zmq.SUBSCRIBE, topic)
+
+    # ----------------------------------------------------------------------
+    def unsubscribeTopic(self, topic):
+        """取消订阅特定主题的广播数据，服务器不再向本客户端推送该主题"""
+        self.__socketSUB.setsockopt(zmq.UNSUBSCRIBE, topic)
+
+
+
+########################################################################
+class RpcFuture(object):
+    """远程调用的结果，调用返回前可以先添加回调函数"""
+
+    # ----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.__event = threading.Event()    # 调用是否已返回
+        self.__reply = None                 # 调用返回的[是否成功, 结果或错误信息]
+        self.__callbacks = []               # 回调函数列表
+        self.__lock = threading.Lock()
         
+    # ----------------------------------------------------------------------
+    def setReply(self, reply):
+        """设置调用的返回，并执行回调函数"""
+        with self.__lock:
+            self.__reply = reply
+            self.__event.set()
+            callbacks, self.__callbacks = self.__callbacks, []
+        
+        for callback in callbacks:
+            self.__runCallback(callback)
+    
+    # ----------------------------------------------------------------------
+    def __runCallback(self, callback):
+        """执行回调函数，异常只打印不向外抛出，避免影响IO线程"""
+        try:
+            callback(self)
+        except Exception:
+            traceback.print_exc()
+            
+    # ----------------------------------------------------------------------
+    def addCallback(self, callback):
+        """
+        添加回调函数，调用返回后以该RpcFuture对象为参数执行
+        流水线模式下回调函数在IO线程中执行，不应进行耗时操作；
+        若调用已返回则立即在当前线程中执行
+        """
+        with self.__lock:
+            if not self.__event.isSet():
+                self.__callbacks.append(callback)
+                return
+        
+        self.__runCallback(callback)
+        
+    # ----------------------------------------------------------------------
+    def done(self):
+        """调用是否已返回"""
+        return self.__event.isSet()
     
+    # ----------------------------------------------------------------------
+    def get(self, timeout=None):
+        """
+        等待并获取调用结果，调用失败则触发异常
+        timeout：等待的秒数，默认一直等待
+        """
+        if not self.__event.wait(timeout):
+            raise RemoteException(u'RPC调用超时')
+        
+        if self.__reply[0]:
+            return self.__reply[1]
+        else:
+            raise RemoteException(self.__reply[1])
+
 
 ########################################################################
 class RemoteException(Exception):
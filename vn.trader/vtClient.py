@@ -4,12 +4,17 @@ import sys
 import os
 import ctypes
 import platform
+from threading import Thread
+from time import sleep
 
 import vtPath
 from uiMainWindow import *
 
 from eventEngine import *
-from vnrpc import RpcClient
+from vnrpc import RpcClient, RemoteException
+from vtCodec import VtEventCodec, FORMAT_PICKLE, COMPACT_TOPIC_PREFIX, CONFLATED_TOPIC_PREFIX
+from vtTickRing import TickRingReader
+import eventType
 
 from ctaStrategy.ctaEngine import CtaEngine
 from dataRecorder.drEngine import DrEngine
@@ -28,7 +33,13 @@ SETTING_FILENAME = os.path.join(path, SETTING_FILENAME)
 
 ########################################################################
 class VtClient(RpcClient):
-    """vn.trader客户端"""
+    """
+    vn.trader客户端
+    
+    和服务器运行在同一台机器上时，可以调用useSharedMemory从服务器的共享内存
+    环形缓冲区读取行情，此时只通过zmq订阅行情以外的事件。服务器停止或重新启动后
+    共享内存关闭，此时改为通过zmq订阅行情。
+    """
 
     # ----------------------------------------------------------------------
     def __init__(self, reqAddress, subAddress, eventEngine):
@@ -39,10 +50,186 @@ class VtClient(RpcClient):
         
         self.usePickle()
         
+        # 使用流水线模式，多个策略可以同时发出委托，不必等待其他调用返回
+        self.usePipeline()
+        
+        # 推送数据编码相关
+        self.codec = VtEventCodec()         # 紧凑编码器
+        self.format = FORMAT_PICKLE         # 和服务器协商确定的推送格式
+        
+        # 订阅的事件类型，均为空时订阅全部事件
+        self.typeList = []                  # 逐笔推送的事件类型
+        self.conflatedTypeList = []         # 合并推送的事件类型
+        
+        # 共享内存行情传输相关
+        self.shmActive = False              # 是否使用共享内存读取行情
+        self.shmInterval = 0                # 没有新行情时的等待时间（秒）
+        self.tickRing = None                # 行情环形缓冲区的读取者
+        self.tickSymbolSet = None           # 需要的行情合约代码，None表示全部
+        self.shmThread = Thread(target=self.runSharedMemory)
+        
+    # ----------------------------------------------------------------------
+    def subscribeEvent(self, type_, conflated=False):
+        """
+        订阅服务器推送的事件，需要在start之前调用，未调用时订阅全部事件
+        type_：事件类型，可以是前缀（如EVENT_TICK）或具体类型（如EVENT_TICK+vtSymbol）
+        conflated：是否只接收服务器合并后的最新行情（服务器需开启行情合并）
+        """
+        if conflated:
+            self.conflatedTypeList.append(type_)
+        else:
+            self.typeList.append(type_)
+        
+    # ----------------------------------------------------------------------
+    def useSharedMemory(self, interval=0.0001):
+        """
+        从服务器的共享内存读取行情，需要在start之前调用，服务器未开启共享内存
+        或者不在同一台机器上时，自动退回通过zmq接收行情
+        interval：没有新行情时的等待时间（秒），越小延迟越低，但占用的CPU越多
+        """
+        self.shmActive = True
+        self.shmInterval = interval
+        
+    # ----------------------------------------------------------------------
+    def start(self):
+        """启动客户端，并和服务器协商推送数据的格式"""
+        super(VtClient, self).start()
+        
+        # 旧版本的服务器不支持协商，使用pickle
+        try:
+            self.format = self.negotiateFormat([self.codec.formatName, FORMAT_PICKLE])
+        except RemoteException:
+            self.format = FORMAT_PICKLE
+            
+        # 打开共享内存，成功后行情不再通过zmq订阅
+        if self.shmActive:
+            self.openSharedMemory()
+            
+        # 订阅对应格式的推送
+        if self.format == FORMAT_PICKLE:
+            prefix = ''
+        else:
+            prefix = COMPACT_TOPIC_PREFIX
+            
+        if not self.typeList and not self.conflatedTypeList:
+            if not self.tickRing:
+                self.subscribeTopic(prefix)
+            else:
+                # 订阅行情以外的全部事件类型
+                for name, type_ in vars(eventType).items():
+                    if name.startswith('EVENT_') and type_ != EVENT_TICK:
+                        self.subscribeTopic(prefix + type_)
+        else:
+            for type_ in self.typeList:
+                if not (self.tickRing and type_.startswith(EVENT_TICK)):
+                    self.subscribeTopic(prefix + type_)
+            for type_ in self.conflatedTypeList:
+                self.subscribeTopic(prefix + CONFLATED_TOPIC_PREFIX + type_)
+                
+        if self.tickRing:
+            self.shmThread.start()
+            
+    # ----------------------------------------------------------------------
+    def openSharedMemory(self):
+        """打开服务器的共享内存行情缓冲区"""
+        # 旧版本的服务器不支持共享内存
+        try:
+            info = self.getSharedMemoryInfo()
+        except RemoteException:
+            info = None
+            
+        # 服务器未开启共享内存，或者共享内存文件不在本机
+        if not info or not os.path.exists(info['filename']):
+            return
+        
+        try:
+            self.tickRing = TickRingReader(info['filename'])
+        except ValueError:
+            return
+        
+        # 需要的行情合约代码
+        tickTypeList = [type_ for type_ in self.typeList if type_.startswith(EVENT_TICK)]
+        if (self.typeList or self.conflatedTypeList) and EVENT_TICK not in tickTypeList:
+            self.tickSymbolSet = set([type_[len(EVENT_TICK):] for type_ in tickTypeList])
+        
+    # ----------------------------------------------------------------------
+    def runSharedMemory(self):
+        """共享内存行情的读取线程"""
+        tickRing = self.tickRing
+        symbolSet = self.tickSymbolSet
+        put = self.eventEngine.put
+        
+        while self.shmActive:
+            l = tickRing.read()
+            
+            if not l:
+                # 服务器停止或重新启动，改为通过zmq订阅行情
+                if tickRing.isClosed():
+                    self.subscribeTick()
+                    break
+                
+                sleep(self.shmInterval)
+                continue
+            
+            for tick in l:
+                if symbolSet is None or tick.vtSymbol in symbolSet:
+                    event = Event(type_=EVENT_TICK+tick.vtSymbol)
+                    event.dict_['data'] = tick
+                    put(event)
+                    
+        tickRing.close()
+        
+    # ----------------------------------------------------------------------
+    def subscribeTick(self):
+        """通过zmq订阅需要的行情，用于共享内存关闭后"""
+        if self.format == FORMAT_PICKLE:
+            prefix = ''
+        else:
+            prefix = COMPACT_TOPIC_PREFIX
+            
+        if not self.typeList and not self.conflatedTypeList:
+            self.subscribeTopic(prefix + EVENT_TICK)
+        else:
+            for type_ in self.typeList:
+                if type_.startswith(EVENT_TICK):
+                    self.subscribeTopic(prefix + type_)
+        
+    # ----------------------------------------------------------------------
+    def stop(self):
+        """停止客户端"""
+        super(VtClient, self).stop()
+        
+        # 停止共享内存行情的读取线程
+        self.shmActive = False
+        if self.shmThread.isAlive():
+            self.shmThread.join()
+        
+    # ----------------------------------------------------------------------
+    def unpackPublish(self, topic, datab):
+        """解包广播数据"""
+        compact = topic.startswith(COMPACT_TOPIC_PREFIX)
+        if compact:
+            topic = topic[len(COMPACT_TOPIC_PREFIX):]
+        
+        # 只处理与协商格式一致的推送，忽略推送给其他客户端的数据
+        useCompact = self.format != FORMAT_PICKLE
+        if compact != useCompact:
+            return None
+        
+        # 订阅全部事件时，忽略推送给其他客户端的合并行情
+        if topic.startswith(CONFLATED_TOPIC_PREFIX) and not self.conflatedTypeList:
+            return None
+        
+        if compact:
+            return self.codec.decode(datab)
+        else:
+            return self.unpack(datab)
+        
     # ----------------------------------------------------------------------
     def callback(self, topic, data):
         """回调函数"""
-        self.eventEngine.put(data)
+        if data is not None:
+            self.eventEngine.put(data)
 
 
 ########################################################################
@@ -73,7 +260,7 @@ class ClientEngine(object):
     # ----------------------------------------------------------------------
     def sendOrder(self, orderReq, gatewayName):
         """对特定接口发单"""
-        self.client.sendOrder(orderReq, gatewayName)    
+        return self.client.sendOrder(orderReq, gatewayName)    
     
     # ----------------------------------------------------------------------
     def cancelOrder(self, cancelOrderReq, gatewayName):
@@ -118,9 +305,30 @@ class ClientEngine(object):
         self.client.dbInsert(dbName, collectionName, d)
     
     # ----------------------------------------------------------------------
-    def dbQuery(self, dbName, collectionName, d):
-        """从MongoDB中读取数据，d是查询要求，返回的是数据库查询的数据列表"""
-        return self.client.dbQuery(dbName, collectionName, d)
+    def dbQuery(self, dbName, collectionName, d, projection=None):
+        """
+        从MongoDB中读取数据，d是查询要求，返回的是数据库查询的数据列表
+        通过分块查询读取，服务器不会一次性生成全部数据，读取期间也不会阻塞其他调用
+        """
+        return list(self.dbQueryIter(dbName, collectionName, d, projection))
+    
+    # ----------------------------------------------------------------------
+    def dbQueryIter(self, dbName, collectionName, d, projection=None, chunkSize=1000):
+        """从MongoDB中分块读取数据，返回逐条生成数据的生成器"""
+        cursorID = self.client.dbQueryOpen(dbName, collectionName, d, projection)
+        if cursorID is None:
+            return
+        
+        try:
+            finished = False
+            while not finished:
+                l, finished = self.client.dbQueryNext(cursorID, chunkSize)
+                for data in l:
+                    yield data
+        finally:
+            # 提前退出时关闭服务器上的指针
+            if not finished:
+                self.client.dbQueryClose(cursorID)
         
     # ----------------------------------------------------------------------
     def dbUpdate(self, dbName, collectionName, d, flt, upsert=False):
@@ -172,8 +380,6 @@ def main():
     reqAddress = 'tcp://localhost:2014'
     subAddress = 'tcp://localhost:0602'
     client = VtClient(reqAddress, subAddress, eventEngine)
-
-    client.subscribeTopic('')
     client.start()
     
     # 初始化Qt应用对象
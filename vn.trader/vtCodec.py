@@ -0,0 +1,137 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了VtServer推送事件使用的紧凑编码。
+
+行情、成交、委托、持仓、资金事件按照固定的字段顺序打包为msgpack数组：
+[数据类型编号, 事件类型, 字段1, 字段2, ...]，不再包含字段名、rawData以及
+pickle需要的类信息；其他事件仍使用pickle序列化，打包为[0, 事件类型, pickle数据]。
+
+字段表发生变化时编码格式的名称随之变化，客户端和服务器通过negotiateFormat
+确认双方使用相同的字段表，否则退回使用pickle。
+
+紧凑编码和合并推送的主题与pickle推送共用一个广播socket，订阅全部主题（''）的
+旧版本客户端同样会收到这些主题，且无法解包紧凑编码的数据，因此推送协议的版本
+由1（只有pickle）升级为2，服务器只有在调用useCompactFormat后才使用紧凑编码。
+'''
+
+import hashlib
+import cPickle
+from itertools import izip
+from operator import attrgetter
+
+from msgpack import packb, unpackb
+
+from eventEngine import Event
+from vtGateway import (VtTickData, VtTradeData, VtOrderData, VtPositionData, VtAccountData,
+                       VtSlotTickData, VtSlotTradeData, VtSlotOrderData)
+
+
+# 推送协议的版本，2表示支持紧凑编码和合并推送的主题前缀
+PROTOCOL_VERSION = 2
+
+# 使用pickle的格式名称
+FORMAT_PICKLE = 'pickle'
+
+# 紧凑编码推送数据的主题前缀，与pickle格式的推送区分
+COMPACT_TOPIC_PREFIX = '~'
+
+# 合并推送行情的主题前缀，位于格式前缀之后，如'#eTick.IF1706'、'~#eTick.IF1706'
+CONFLATED_TOPIC_PREFIX = '#'
+
+# 各数据类的字段表（不包含rawData）
+TICK_FIELDS = ('gatewayName', 'symbol', 'exchange', 'vtSymbol',
+               'lastPrice', 'lastVolume', 'volume', 'openInterest', 'time', 'date',
+               'openPrice', 'highPrice', 'lowPrice', 'preClosePrice',
+               'upperLimit', 'lowerLimit',
+               'bidPrice1', 'bidPrice2', 'bidPrice3', 'bidPrice4', 'bidPrice5',
+               'askPrice1', 'askPrice2', 'askPrice3', 'askPrice4', 'askPrice5',
+               'bidVolume1', 'bidVolume2', 'bidVolume3', 'bidVolume4', 'bidVolume5',
+               'askVolume1', 'askVolume2', 'askVolume3', 'askVolume4', 'askVolume5')
+
+TRADE_FIELDS = ('gatewayName', 'symbol', 'exchange', 'vtSymbol',
+                'tradeID', 'vtTradeID', 'orderID', 'vtOrderID',
+                'direction', 'offset', 'price', 'volume', 'tradeTime')
+
+ORDER_FIELDS = ('gatewayName', 'symbol', 'exchange', 'vtSymbol',
+                'orderID', 'vtOrderID', 'direction', 'offset', 'price',
+                'totalVolume', 'tradedVolume', 'status', 'orderTime', 'cancelTime',
+                'frontID', 'sessionID')
+
+POSITION_FIELDS = ('gatewayName', 'symbol', 'exchange', 'vtSymbol',
+                   'direction', 'position', 'frozen', 'price', 'vtPositionName',
+                   'ydPosition', 'positionProfit')
+
+ACCOUNT_FIELDS = ('gatewayName', 'accountID', 'vtAccountID',
+                  'preBalance', 'balance', 'available', 'commission', 'margin',
+                  'closeProfit', 'positionProfit')
+
+# 数据类型编号、解码后使用的数据类、字段表、可编码的数据类
+SCHEMA_LIST = [
+    (1, VtTickData, TICK_FIELDS, (VtTickData, VtSlotTickData)),
+    (2, VtTradeData, TRADE_FIELDS, (VtTradeData, VtSlotTradeData)),
+    (3, VtOrderData, ORDER_FIELDS, (VtOrderData, VtSlotOrderData)),
+    (4, VtPositionData, POSITION_FIELDS, (VtPositionData,)),
+    (5, VtAccountData, ACCOUNT_FIELDS, (VtAccountData,)),
+]
+
+# 非以上数据类型的事件
+CODE_PICKLE = 0
+
+
+########################################################################
+class VtEventCodec(object):
+    """事件编码器"""
+
+    # ----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.encodeDict = {}    # 数据类对应的(编号, 取字段值的函数)
+        self.decodeDict = {}    # 编号对应的(数据类, 字段表)
+
+        for code, dataClass, fields, encodeClasses in SCHEMA_LIST:
+            getter = attrgetter(*fields)
+            for cls in encodeClasses:
+                self.encodeDict[cls] = (code, getter)
+            self.decodeDict[code] = (dataClass, fields)
+
+        # 编码格式名称，包含字段表的摘要
+        schema = repr([(code, fields) for code, dataClass, fields, encodeClasses in SCHEMA_LIST])
+        self.formatName = 'compact.' + hashlib.md5(schema).hexdigest()[:8]
+
+    # ----------------------------------------------------------------------
+    def encode(self, event):
+        """编码事件"""
+        data = event.dict_.get('data')
+        schema = self.encodeDict.get(data.__class__)
+
+        # 不在字段表中的数据类型使用pickle
+        if schema is None:
+            l = [CODE_PICKLE, event.type_, cPickle.dumps(event, 2)]
+        else:
+            code, getter = schema
+            l = [code, event.type_]
+            l.extend(getter(data))
+
+        # 使用bin类型区分str和unicode，解码后的字符串类型与编码前一致
+        return packb(l, use_bin_type=True)
+
+    # ----------------------------------------------------------------------
+    def decode(self, datab):
+        """解码事件"""
+        l = unpackb(datab, encoding='utf-8')
+        code = l[0]
+
+        if code == CODE_PICKLE:
+            return cPickle.loads(l[2])
+
+        dataClass, fields = self.decodeDict[code]
+
+        d = dict(izip(fields, l[2:]))
+        d['rawData'] = None
+        data = dataClass.__new__(dataClass)
+        data.__dict__ = d
+
+        event = Event(type_=l[1])
+        event.dict_['data'] = data
+        return event
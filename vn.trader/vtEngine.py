@@ -3,6 +3,9 @@
 import shelve
 from collections import OrderedDict
 from datetime import datetime
+from itertools import count
+from threading import Lock
+from time import time
 
 from pymongo import MongoClient
 from pymongo.errors import ConnectionFailure
@@ -21,6 +24,9 @@ from riskManager.rmEngine import RmEngine
 ########################################################################
 class MainEngine(object):
     """主引擎"""
+    
+    # 分块查询的数据库指针超过该时间（秒）未读取则关闭
+    DB_CURSOR_TIMEOUT = 600
 
     # ----------------------------------------------------------------------
     def __init__(self):
@@ -28,7 +34,7 @@ class MainEngine(object):
         # 记录今日日期
         self.todayDate = datetime.now().strftime('%Y%m%d')
         
-        # 创建事件引擎
+        # 创建事件引擎，CtaEngine、RmEngine等的处理函数没有加锁，不能使用分片模式
         self.eventEngine = EventEngine2()
         self.eventEngine.start()
         
@@ -38,6 +44,11 @@ class MainEngine(object):
         # MongoDB数据库相关
         self.dbClient = None    # MongoDB客户端对象
         
+        # 分块查询相关
+        self.dbCursorDict = {}              # 指针编号对应的[数据库指针, 最后读取时间]
+        self.dbCursorCount = count(1)       # 指针编号
+        self.dbCursorLock = Lock()          # 分块查询在RPC线程池中执行，需要加锁
+        
         # 调用一个个初始化函数
         self.initGateway()
 
@@ -187,12 +198,15 @@ class MainEngine(object):
             self.writeLog(text.DATA_INSERT_FAILED)
     
     # ----------------------------------------------------------------------
-    def dbQuery(self, dbName, collectionName, d):
-        """从MongoDB中读取数据，d是查询要求，返回的是数据库查询的指针"""
+    def dbQuery(self, dbName, collectionName, d, projection=None):
+        """
+        从MongoDB中读取数据，d是查询要求，返回的是数据库查询的数据列表
+        projection是需要返回的字段，如{'_id': False}，默认返回全部字段
+        """
         if self.dbClient:
             db = self.dbClient[dbName]
             collection = db[collectionName]
-            cursor = collection.find(d)
+            cursor = collection.find(d, projection)
             if cursor:
                 return list(cursor)
             else:
@@ -201,6 +215,84 @@ class MainEngine(object):
             self.writeLog(text.DATA_QUERY_FAILED)   
             return []
         
+    # ----------------------------------------------------------------------
+    def dbQueryIter(self, dbName, collectionName, d, projection=None, chunkSize=1000):
+        """从MongoDB中逐条读取数据，每次从数据库读取chunkSize条，不会一次性生成全部数据"""
+        if self.dbClient:
+            db = self.dbClient[dbName]
+            collection = db[collectionName]
+            return collection.find(d, projection).batch_size(chunkSize)
+        else:
+            self.writeLog(text.DATA_QUERY_FAILED)
+            return iter([])
+        
+    # ----------------------------------------------------------------------
+    def dbQueryOpen(self, dbName, collectionName, d, projection=None):
+        """
+        打开分块查询，返回指针编号，之后通过dbQueryNext分块读取数据，
+        用于通过RPC读取大量数据，避免一次性生成和传输全部数据
+        """
+        if not self.dbClient:
+            self.writeLog(text.DATA_QUERY_FAILED)
+            return None
+        
+        # 清除长时间未读取的指针，正在读取的指针已从字典中取出，不会被清除
+        now = time()
+        with self.dbCursorLock:
+            expiredList = [cursorID for cursorID, (cursor, lastTime) in self.dbCursorDict.items()
+                           if now - lastTime > self.DB_CURSOR_TIMEOUT]
+        for cursorID in expiredList:
+            self.dbQueryClose(cursorID)
+        
+        db = self.dbClient[dbName]
+        collection = db[collectionName]
+        cursor = collection.find(d, projection)
+        
+        with self.dbCursorLock:
+            cursorID = next(self.dbCursorCount)
+            self.dbCursorDict[cursorID] = [cursor, now]
+        return cursorID
+    
+    # ----------------------------------------------------------------------
+    def dbQueryNext(self, cursorID, chunkSize=1000):
+        """
+        读取分块查询的下一块数据，返回[数据列表, 是否已读取完毕]
+        读取完毕后自动关闭指针
+        """
+        # 读取期间将指针从字典中取出，避免被其他线程清除或关闭
+        with self.dbCursorLock:
+            cursorData = self.dbCursorDict.pop(cursorID, None)
+        if not cursorData:
+            return [[], True]
+        
+        cursor = cursorData[0]
+        
+        # 读取出错（如网络中断、指针超时）时关闭指针，读取成功后才放回字典
+        finished = True
+        try:
+            l = []
+            for d in cursor:
+                l.append(d)
+                if len(l) >= chunkSize:
+                    finished = False
+                    break
+        finally:
+            if finished:
+                cursor.close()
+                
+        if not finished:
+            with self.dbCursorLock:
+                self.dbCursorDict[cursorID] = [cursor, time()]
+        return [l, finished]
+    
+    # ----------------------------------------------------------------------
+    def dbQueryClose(self, cursorID):
+        """关闭分块查询"""
+        with self.dbCursorLock:
+            cursorData = self.dbCursorDict.pop(cursorID, None)
+        if cursorData:
+            cursorData[0].close()
+        
     # ----------------------------------------------------------------------
     def dbUpdate(self, dbName, collectionName, d, flt, upsert=False):
         """向MongoDB中更新数据，d是具体数据，flt是过滤条件，upsert代表若无是否要插入"""
@@ -20,67 +20,42 @@ class VtGateway(object):
     # ----------------------------------------------------------------------
     def onTick(self, tick):
         """市场行情推送"""
-        # 通用事件
-        event1 = Event(type_=EVENT_TICK)
-        event1.dict_['data'] = tick
-        self.eventEngine.put(event1)
-        
-        # 特定合约代码的事件
-        event2 = Event(type_=EVENT_TICK+tick.vtSymbol)
-        event2.dict_['data'] = tick
-        self.eventEngine.put(event2)
+        # 特定合约代码的事件，注册在通用事件上的监听函数同样会收到
+        event = Event(type_=EVENT_TICK+tick.vtSymbol)
+        event.dict_['data'] = tick
+        self.eventEngine.put(event)
     
     # ----------------------------------------------------------------------
     def onTrade(self, trade):
         """成交信息推送"""
-        # 通用事件
-        event1 = Event(type_=EVENT_TRADE)
-        event1.dict_['data'] = trade
-        self.eventEngine.put(event1)
-        
-        # 特定合约的成交事件
-        event2 = Event(type_=EVENT_TRADE+trade.vtSymbol)
-        event2.dict_['data'] = trade
-        self.eventEngine.put(event2)        
+        # 特定合约的事件，注册在通用事件上的监听函数同样会收到
+        event = Event(type_=EVENT_TRADE+trade.vtSymbol)
+        event.dict_['data'] = trade
+        self.eventEngine.put(event)
     
     # ----------------------------------------------------------------------
     def onOrder(self, order):
         """订单变化推送"""
-        # 通用事件
-        event1 = Event(type_=EVENT_ORDER)
-        event1.dict_['data'] = order
-        self.eventEngine.put(event1)
-        
-        # 特定订单编号的事件
-        event2 = Event(type_=EVENT_ORDER+order.vtOrderID)
-        event2.dict_['data'] = order
-        self.eventEngine.put(event2)
+        # 特定订单编号的事件，注册在通用事件上的监听函数同样会收到
+        event = Event(type_=EVENT_ORDER+order.vtOrderID)
+        event.dict_['data'] = order
+        self.eventEngine.put(event)
     
     # ----------------------------------------------------------------------
     def onPosition(self, position):
         """持仓信息推送"""
-        # 通用事件
-        event1 = Event(type_=EVENT_POSITION)
-        event1.dict_['data'] = position
-        self.eventEngine.put(event1)
-        
-        # 特定合约代码的事件
-        event2 = Event(type_=EVENT_POSITION+position.vtSymbol)
-        event2.dict_['data'] = position
-        self.eventEngine.put(event2)
+        # 特定合约代码的事件，注册在通用事件上的监听函数同样会收到
+        event = Event(type_=EVENT_POSITION+position.vtSymbol)
+        event.dict_['data'] = position
+        self.eventEngine.put(event)
     
     # ----------------------------------------------------------------------
     def onAccount(self, account):
         """账户信息推送"""
-        # 通用事件
-        event1 = Event(type_=EVENT_ACCOUNT)
-        event1.dict_['data'] = account
-        self.eventEngine.put(event1)
-        
-        # 特定合约代码的事件
-        event2 = Event(type_=EVENT_ACCOUNT+account.vtAccountID)
-        event2.dict_['data'] = account
-        self.eventEngine.put(event2)
+        # 特定账户代码的事件，注册在通用事件上的监听函数同样会收到
+        event = Event(type_=EVENT_ACCOUNT+account.vtAccountID)
+        event.dict_['data'] = account
+        self.eventEngine.put(event)
     
     # ----------------------------------------------------------------------
     def onError(self, error):
@@ -439,3 +414,181 @@ class VtCancelOrderReq(object):
     
     
     
+########################################################################
+class VtSlotData(object):
+    """
+    使用__slots__保存属性的数据类基类
+    
+    对象不再各自创建__dict__，在需要大量创建数据对象的场景下（如同时记录
+    上百个合约的行情）可以明显降低内存占用和GC压力。属性的读写方式和
+    对应的普通数据类完全一致，但不能动态添加__slots__之外的属性。
+    
+    子类需要在__slots__中列出全部属性（包括gatewayName和rawData）。
+    """
+    __slots__ = ()
+
+    # ----------------------------------------------------------------------
+    def __getstate__(self):
+        """序列化状态（定义了__slots__的类需要提供，才能使用cPickle打包）"""
+        return tuple([getattr(self, key) for key in self.__slots__])
+    
+    # ----------------------------------------------------------------------
+    def __setstate__(self, state):
+        """恢复序列化状态，state中的数值和__slots__一一对应"""
+        for key, value in zip(self.__slots__, state):
+            setattr(self, key, value)
+    
+    # ----------------------------------------------------------------------
+    def toDict(self):
+        """转化为字典，用于替代普通数据类的__dict__（如插入数据库）"""
+        return dict([(key, getattr(self, key)) for key in self.__slots__])
+    
+    # ----------------------------------------------------------------------
+    @classmethod
+    def fromDict(cls, d):
+        """从字典创建对象，字典中不属于该类的键（如数据库的_id）会被忽略"""
+        obj = cls()
+        for key in cls.__slots__:
+            if key in d:
+                setattr(obj, key, d[key])
+        return obj
+
+
+########################################################################
+class VtSlotTickData(VtSlotData):
+    """Tick行情数据类（__slots__版本，属性和VtTickData相同）"""
+    __slots__ = ('gatewayName', 'rawData',
+                 'symbol', 'exchange', 'vtSymbol',
+                 'lastPrice', 'lastVolume', 'volume', 'openInterest', 'time', 'date',
+                 'openPrice', 'highPrice', 'lowPrice', 'preClosePrice',
+                 'upperLimit', 'lowerLimit',
+                 'bidPrice1', 'bidPrice2', 'bidPrice3', 'bidPrice4', 'bidPrice5',
+                 'askPrice1', 'askPrice2', 'askPrice3', 'askPrice4', 'askPrice5',
+                 'bidVolume1', 'bidVolume2', 'bidVolume3', 'bidVolume4', 'bidVolume5',
+                 'askVolume1', 'askVolume2', 'askVolume3', 'askVolume4', 'askVolume5')
+
+    # ----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.gatewayName = EMPTY_STRING         # Gateway名称        
+        self.rawData = None                     # 原始数据
+        
+        # 代码相关
+        self.symbol = EMPTY_STRING              # 合约代码
+        self.exchange = EMPTY_STRING            # 交易所代码
+        self.vtSymbol = EMPTY_STRING            # 合约在vt系统中的唯一代码，通常是 合约代码.交易所代码
+        
+        # 成交数据
+        self.lastPrice = EMPTY_FLOAT            # 最新成交价
+        self.lastVolume = EMPTY_INT             # 最新成交量
+        self.volume = EMPTY_INT                 # 今天总成交量
+        self.openInterest = EMPTY_INT           # 持仓量
+        self.time = EMPTY_STRING                # 时间 11:20:56.5
+        self.date = EMPTY_STRING                # 日期 20151009
+        
+        # 常规行情
+        self.openPrice = EMPTY_FLOAT            # 今日开盘价
+        self.highPrice = EMPTY_FLOAT            # 今日最高价
+        self.lowPrice = EMPTY_FLOAT             # 今日最低价
+        self.preClosePrice = EMPTY_FLOAT
+        
+        self.upperLimit = EMPTY_FLOAT           # 涨停价
+        self.lowerLimit = EMPTY_FLOAT           # 跌停价
+        
+        # 五档行情
+        self.bidPrice1 = EMPTY_FLOAT
+        self.bidPrice2 = EMPTY_FLOAT
+        self.bidPrice3 = EMPTY_FLOAT
+        self.bidPrice4 = EMPTY_FLOAT
+        self.bidPrice5 = EMPTY_FLOAT
+        
+        self.askPrice1 = EMPTY_FLOAT
+        self.askPrice2 = EMPTY_FLOAT
+        self.askPrice3 = EMPTY_FLOAT
+        self.askPrice4 = EMPTY_FLOAT
+        self.askPrice5 = EMPTY_FLOAT        
+        
+        self.bidVolume1 = EMPTY_INT
+        self.bidVolume2 = EMPTY_INT
+        self.bidVolume3 = EMPTY_INT
+        self.bidVolume4 = EMPTY_INT
+        self.bidVolume5 = EMPTY_INT
+        
+        self.askVolume1 = EMPTY_INT
+        self.askVolume2 = EMPTY_INT
+        self.askVolume3 = EMPTY_INT
+        self.askVolume4 = EMPTY_INT
+        self.askVolume5 = EMPTY_INT
+
+
+########################################################################
+class VtSlotTradeData(VtSlotData):
+    """成交数据类（__slots__版本，属性和VtTradeData相同）"""
+    __slots__ = ('gatewayName', 'rawData',
+                 'symbol', 'exchange', 'vtSymbol',
+                 'tradeID', 'vtTradeID', 'orderID', 'vtOrderID',
+                 'direction', 'offset', 'price', 'volume', 'tradeTime')
+
+    # ----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.gatewayName = EMPTY_STRING         # Gateway名称        
+        self.rawData = None                     # 原始数据
+        
+        # 代码编号相关
+        self.symbol = EMPTY_STRING              # 合约代码
+        self.exchange = EMPTY_STRING            # 交易所代码
+        self.vtSymbol = EMPTY_STRING            # 合约在vt系统中的唯一代码，通常是 合约代码.交易所代码
+        
+        self.tradeID = EMPTY_STRING             # 成交编号
+        self.vtTradeID = EMPTY_STRING           # 成交在vt系统中的唯一编号，通常是 Gateway名.成交编号
+        
+        self.orderID = EMPTY_STRING             # 订单编号
+        self.vtOrderID = EMPTY_STRING           # 订单在vt系统中的唯一编号，通常是 Gateway名.订单编号
+        
+        # 成交相关
+        self.direction = EMPTY_UNICODE          # 成交方向
+        self.offset = EMPTY_UNICODE             # 成交开平仓
+        self.price = EMPTY_FLOAT                # 成交价格
+        self.volume = EMPTY_INT                 # 成交数量
+        self.tradeTime = EMPTY_STRING           # 成交时间
+
+
+########################################################################
+class VtSlotOrderData(VtSlotData):
+    """订单数据类（__slots__版本，属性和VtOrderData相同）"""
+    __slots__ = ('gatewayName', 'rawData',
+                 'symbol', 'exchange', 'vtSymbol',
+                 'orderID', 'vtOrderID',
+                 'direction', 'offset', 'price', 'totalVolume', 'tradedVolume', 'status',
+                 'orderTime', 'cancelTime',
+                 'frontID', 'sessionID')
+
+    # ----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.gatewayName = EMPTY_STRING         # Gateway名称        
+        self.rawData = None                     # 原始数据
+        
+        # 代码编号相关
+        self.symbol = EMPTY_STRING              # 合约代码
+        self.exchange = EMPTY_STRING            # 交易所代码
+        self.vtSymbol = EMPTY_STRING            # 合约在vt系统中的唯一代码，通常是 合约代码.交易所代码
+        
+        self.orderID = EMPTY_STRING             # 订单编号
+        self.vtOrderID = EMPTY_STRING           # 订单在vt系统中的唯一编号，通常是 Gateway名.订单编号
+        
+        # 报单相关
+        self.direction = EMPTY_UNICODE          # 报单方向
+        self.offset = EMPTY_UNICODE             # 报单开平仓
+        self.price = EMPTY_FLOAT                # 报单价格
+        self.totalVolume = EMPTY_INT            # 报单总数量
+        self.tradedVolume = EMPTY_INT           # 报单成交数量
+        self.status = EMPTY_UNICODE             # 报单状态
+        
+        self.orderTime = EMPTY_STRING           # 发单时间
+        self.cancelTime = EMPTY_STRING          # 撤单时间
+        
+        # CTP/LTS相关
+        self.frontID = EMPTY_INT                # 前置机编号
+        self.sessionID = EMPTY_INT              # 连接编号
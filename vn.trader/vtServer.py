@@ -2,20 +2,39 @@
 
 import sys
 import os
+import struct
 
 from datetime import datetime
 from time import sleep
 from threading import Thread
 
 import vtPath
-import eventType
+from eventType import *
 from vnrpc import RpcServer
 from vtEngine import MainEngine
+from vtCodec import (VtEventCodec, PROTOCOL_VERSION, FORMAT_PICKLE, 
+                     COMPACT_TOPIC_PREFIX, CONFLATED_TOPIC_PREFIX)
+from vtTickRing import TickRingWriter, DEFAULT_CAPACITY
 
 
 ########################################################################
 class VtServer(RpcServer):
-    """vn.trader服务器"""
+    """
+    vn.trader服务器
+    
+    事件推送的主题为 格式前缀+合并前缀+事件类型，客户端可以只订阅需要的事件类型
+    和合约（如~eTick.IF1706、~eOrder.），服务器只对有客户端订阅的主题进行编码推送。
+    
+    zmq的订阅按照前缀匹配，订阅全部主题（''）的旧版本客户端（推送协议版本1）
+    也会收到带前缀的主题：紧凑编码的数据无法解包，合并推送的行情会重复收到。
+    因此紧凑编码和行情合并默认关闭，只应在所有客户端都已升级后开启。
+    
+    调用setConflateInterval开启行情合并后，订阅合并主题（如~#eTick.IF1706）的
+    客户端每隔固定时间只收到每个合约的最新行情，适用于网络较慢的界面客户端。
+    
+    调用useSharedMemory后行情同时写入共享内存环形缓冲区，同一台机器上的客户端
+    可以直接从共享内存读取行情，不再经过网络传输和序列化。
+    """
 
     # ----------------------------------------------------------------------
     def __init__(self, repAddress, pubAddress):
@@ -23,6 +42,22 @@ class VtServer(RpcServer):
         super(VtServer, self).__init__(repAddress, pubAddress)
         self.usePickle()
         
+        # 使用线程池处理请求，发单和撤单不会被耗时的数据库查询阻塞
+        self.useWorkerPool()
+        
+        # 推送数据编码相关
+        self.codec = VtEventCodec()         # 紧凑编码器
+        self.compactEnabled = False         # 是否允许客户端使用紧凑编码
+        
+        # 行情合并推送相关
+        self.conflateInterval = 0           # 合并推送的间隔（毫秒），0表示不合并
+        self.conflateDict = {}              # 事件类型对应的最新行情事件
+        self.conflatedTopicDict = {}        # 客户端订阅的合并推送主题对应的事件类型
+        self.conflatedTypeDict = {}         # 缓存事件类型是否有客户端订阅合并推送
+        
+        # 共享内存行情传输相关
+        self.tickRing = None                # 行情环形缓冲区的写入者
+        
         # 创建主引擎对象
         self.engine = MainEngine()
         
@@ -38,20 +73,156 @@ class VtServer(RpcServer):
         self.register(self.engine.dbConnect)
         self.register(self.engine.dbInsert)
         self.register(self.engine.dbQuery)
+        self.register(self.engine.dbQueryOpen)
+        self.register(self.engine.dbQueryNext)
+        self.register(self.engine.dbQueryClose)
         self.register(self.engine.dbUpdate)
         self.register(self.engine.getContract)
         self.register(self.engine.getAllContracts)
         self.register(self.engine.getOrder)
         self.register(self.engine.getAllWorkingOrders)
         self.register(self.engine.getAllGatewayNames)
+        self.register(self.getProtocolVersion)
+        self.register(self.negotiateFormat)
+        self.register(self.getSharedMemoryInfo)
         
         # 注册事件引擎发送的事件处理监听
         self.engine.eventEngine.registerGeneralHandler(self.eventHandler)
+        self.engine.eventEngine.register(EVENT_TIMER_PUBLISH, self.publishConflated)
         
     # ----------------------------------------------------------------------
     def eventHandler(self, event):
         """事件处理"""
-        self.publish(event.type_, event)
+        # 行情写入共享内存，个别字段无效（如None）的行情写入失败时不影响推送
+        if self.tickRing and event.type_.startswith(EVENT_TICK):
+            try:
+                self.tickRing.write(event.dict_['data'])
+            except struct.error as e:
+                printLog(u'行情写入共享内存失败：%s' % e)
+        
+        self.publishEvent('', event)
+        
+        # 有客户端订阅合并推送时，缓存最新的行情事件，等待计时器触发后推送
+        if (self.conflateInterval and event.type_.startswith(EVENT_TICK) and
+            self.hasConflatedSubscriber(event.type_)):
+            self.conflateDict[event.type_] = event
+            
+    # ----------------------------------------------------------------------
+    def publishEvent(self, prefix, event):
+        """
+        按照客户端协商的格式推送事件
+        prefix：格式前缀之后、事件类型之前的主题前缀
+        """
+        # pickle格式的推送，没有客户端订阅该主题时publish不做编码
+        self.publish(prefix + event.type_, event)
+        
+        # 开启紧凑编码后，在带前缀的主题上推送紧凑编码的数据
+        if self.compactEnabled:
+            topic = COMPACT_TOPIC_PREFIX + prefix + event.type_
+            if self.hasSubscriber(topic):
+                self.publishRaw(topic, self.codec.encode(event))
+                
+    # ----------------------------------------------------------------------
+    def onSubscription(self, topic, subscribed):
+        """记录客户端订阅的合并推送主题"""
+        type_ = topic
+        if type_.startswith(COMPACT_TOPIC_PREFIX):
+            type_ = type_[len(COMPACT_TOPIC_PREFIX):]
+        if not type_.startswith(CONFLATED_TOPIC_PREFIX):
+            return
+        
+        if subscribed:
+            self.conflatedTopicDict[topic] = type_[len(CONFLATED_TOPIC_PREFIX):]
+        else:
+            self.conflatedTopicDict.pop(topic, None)
+        self.conflatedTypeDict = {}
+        
+    # ----------------------------------------------------------------------
+    def hasConflatedSubscriber(self, type_):
+        """
+        检查是否有客户端订阅了该事件类型的合并推送
+        只检查以合并前缀开头的订阅，订阅全部主题（''）的客户端不会触发行情合并；
+        订阅变化在此前的publishEvent中已经收取
+        """
+        subscribed = self.conflatedTypeDict.get(type_)
+        
+        if subscribed is None:
+            subscribed = False
+            for t in self.conflatedTopicDict.values():
+                if type_.startswith(t):
+                    subscribed = True
+                    break
+            self.conflatedTypeDict[type_] = subscribed
+            
+        return subscribed
+    
+    # ----------------------------------------------------------------------
+    def publishConflated(self, event):
+        """计时器触发，推送合并后的最新行情"""
+        conflateDict, self.conflateDict = self.conflateDict, {}
+        
+        for tickEvent in conflateDict.values():
+            self.publishEvent(CONFLATED_TOPIC_PREFIX, tickEvent)
+            
+    # ----------------------------------------------------------------------
+    def setConflateInterval(self, interval):
+        """
+        设置行情合并推送的间隔
+        interval：间隔毫秒数，0表示关闭合并推送
+        """
+        self.conflateInterval = interval
+        
+        if interval:
+            self.engine.eventEngine.addTimer(EVENT_TIMER_PUBLISH, interval / 1000.0)
+        else:
+            self.engine.eventEngine.removeTimer(EVENT_TIMER_PUBLISH)
+            self.conflateDict = {}
+            
+    # ----------------------------------------------------------------------
+    def useCompactFormat(self, enabled=True):
+        """
+        允许客户端协商使用紧凑编码的推送
+        开启后订阅全部主题的旧版本客户端会收到无法解包的数据，需要先升级所有客户端
+        """
+        self.compactEnabled = enabled
+        
+    # ----------------------------------------------------------------------
+    def getProtocolVersion(self):
+        """获取服务器的推送协议版本"""
+        return PROTOCOL_VERSION
+        
+    # ----------------------------------------------------------------------
+    def negotiateFormat(self, formatList):
+        """
+        协商推送数据的格式
+        formatList：客户端支持的格式名称列表，按照优先顺序排列
+        返回服务器选定的格式，未开启紧凑编码或双方字段表不一致时使用pickle
+        """
+        if not self.compactEnabled:
+            return FORMAT_PICKLE
+        
+        for fmt in formatList:
+            if fmt in (self.codec.formatName, FORMAT_PICKLE):
+                return fmt
+            
+        return FORMAT_PICKLE
+        
+    # ----------------------------------------------------------------------
+    def useSharedMemory(self, prefix=None, capacity=DEFAULT_CAPACITY):
+        """
+        将行情写入共享内存环形缓冲区，供同一台机器上的客户端读取
+        prefix：共享内存文件路径的前缀，默认使用内存文件系统中的文件，每次启动使用
+                不同的文件，客户端通过getSharedMemoryInfo获取
+        capacity：缓冲区能保存的行情数量，客户端落后超过该数量时会丢失行情
+        """
+        self.tickRing = TickRingWriter(prefix, capacity)
+        
+    # ----------------------------------------------------------------------
+    def getSharedMemoryInfo(self):
+        """获取共享内存行情缓冲区的信息，未使用共享内存时返回None"""
+        if not self.tickRing:
+            return None
+        return self.tickRing.getInfo()
         
     # ----------------------------------------------------------------------
     def stopServer(self):
@@ -61,6 +232,10 @@ class VtServer(RpcServer):
         
         # 停止服务器线程
         self.stop()
+        
+        # 关闭共享内存
+        if self.tickRing:
+            self.tickRing.close()
 
 
 # ----------------------------------------------------------------------
@@ -0,0 +1,325 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了本机进程间传输行情的共享内存环形缓冲区。
+
+VtServer将行情按照固定的二进制格式写入内存映射文件中的环形缓冲区，运行在同一台
+机器上的VtClient直接从映射的内存中读取，不再经过zmq的网络传输和pickle序列化，
+RPC调用和其他事件的推送仍然使用原有的方式。
+
+内存布局：
+1. 文件头（128字节）：标识、版本、槽位数量、槽位大小、字段表摘要，偏移64处为写入序号，
+   偏移72处为写入者的代数（每次启动不同，关闭时清零）
+2. 之后为capacity个槽位，每个槽位开头8字节为该槽位保存的行情序号+1，之后为行情数据
+
+只有一个写入者（服务器），可以有任意多个读取者，读取者各自记录读取进度，互不影响。
+写入者每次启动都创建新的文件（文件名包含进程号和启动时间），通过getInfo告知
+读取者，从不截断或覆盖其他读取者可能映射着的文件；关闭时将文件头中的代数清零
+并删除文件，读取者检查到代数变化后需要重新获取文件名并打开。
+写入者写入槽位前先将槽位序号清零，写完数据后再写入序号，读取者在复制数据前后
+检查槽位序号，不一致说明读取期间数据被覆盖（读取速度跟不上写入），此时跳过被
+覆盖的数据并计入丢失数量。
+'''
+
+import os
+import mmap
+import struct
+import hashlib
+import tempfile
+from time import time
+from itertools import izip
+
+from vtGateway import VtTickData
+
+
+# 文件标识和版本
+RING_MAGIC = 'VTTICKRB'
+RING_VERSION = 2
+
+# 默认的槽位数量
+DEFAULT_CAPACITY = 65536
+
+# 文件头格式：标识、版本、槽位数量、槽位大小、字段表摘要
+HEADER_STRUCT = struct.Struct('<8sIII16s')
+HEADER_SIZE = 128
+
+# 写入序号的位置，单独占用一个缓存行
+WRITE_SEQ_OFFSET = 64
+
+# 写入者代数的位置，0表示写入者已关闭
+GENERATION_OFFSET = 72
+
+# 序号格式，使用本机字节序，读写序号都是一次8字节的内存复制，不会读到写了一半的序号
+# 注意struct.pack_into会先将目标内存清零再写入，因此写入序号时使用切片赋值
+SEQ_STRUCT = struct.Struct('@Q')
+SEQ_SIZE = SEQ_STRUCT.size
+
+# 行情字段表，字符串字段使用固定长度，超出部分会被截断
+# 部分接口（如OKCOIN）的成交量和持仓量为小数，因此数量字段也使用浮点数，
+# 读取时整数值还原为int，和其他接口推送的行情保持一致
+TICK_LAYOUT = [
+    ('gatewayName', '16s'),
+    ('symbol', '32s'),
+    ('exchange', '16s'),
+    ('vtSymbol', '48s'),
+    ('time', '16s'),
+    ('date', '16s'),
+
+    ('lastPrice', 'd'),
+    ('openPrice', 'd'),
+    ('highPrice', 'd'),
+    ('lowPrice', 'd'),
+    ('preClosePrice', 'd'),
+    ('upperLimit', 'd'),
+    ('lowerLimit', 'd'),
+    ('bidPrice1', 'd'),
+    ('bidPrice2', 'd'),
+    ('bidPrice3', 'd'),
+    ('bidPrice4', 'd'),
+    ('bidPrice5', 'd'),
+    ('askPrice1', 'd'),
+    ('askPrice2', 'd'),
+    ('askPrice3', 'd'),
+    ('askPrice4', 'd'),
+    ('askPrice5', 'd'),
+
+    ('lastVolume', 'd'),
+    ('volume', 'd'),
+    ('openInterest', 'd'),
+    ('bidVolume1', 'd'),
+    ('bidVolume2', 'd'),
+    ('bidVolume3', 'd'),
+    ('bidVolume4', 'd'),
+    ('bidVolume5', 'd'),
+    ('askVolume1', 'd'),
+    ('askVolume2', 'd'),
+    ('askVolume3', 'd'),
+    ('askVolume4', 'd'),
+    ('askVolume5', 'd'),
+]
+
+TICK_FIELDS = [name for name, fmt in TICK_LAYOUT]
+TICK_STRUCT = struct.Struct('@' + ''.join([fmt for name, fmt in TICK_LAYOUT]))
+
+# 字符串字段的位置
+STRING_INDEXES = [i for i, (name, fmt) in enumerate(TICK_LAYOUT) if fmt.endswith('s')]
+
+# 数量字段的位置（成交量、持仓量、盘口数量）
+VOLUME_INDEXES = [i for i, (name, fmt) in enumerate(TICK_LAYOUT) 
+                  if 'olume' in name or name == 'openInterest']
+
+# 字段表摘要，读取者据此确认和写入者使用相同的格式
+LAYOUT_DIGEST = hashlib.md5(repr(TICK_LAYOUT)).digest()
+
+# 槽位大小，按照64字节对齐
+SLOT_SIZE = (SEQ_SIZE + TICK_STRUCT.size + 63) // 64 * 64
+
+
+# ----------------------------------------------------------------------
+def getDefaultFilename():
+    """获取默认的共享内存文件路径前缀，Linux下优先使用内存文件系统/dev/shm"""
+    if os.path.isdir('/dev/shm'):
+        folder = '/dev/shm'
+    else:
+        folder = tempfile.gettempdir()
+    return os.path.join(folder, 'vnpy_tick')
+
+
+########################################################################
+class TickRingWriter(object):
+    """环形缓冲区的写入者，一个文件只能有一个写入者"""
+
+    # ----------------------------------------------------------------------
+    def __init__(self, prefix=None, capacity=DEFAULT_CAPACITY):
+        """
+        Constructor
+        prefix：共享内存文件路径的前缀，每次启动在其后加上进程号和启动时间
+        """
+        self.generation = int(time() * 1000000)     # 写入者代数，使用启动时间
+        self.filename = '%s.%s.%s.ring' % (prefix or getDefaultFilename(), 
+                                           os.getpid(), self.generation)
+        self.capacity = capacity
+        self.writeSeq = 0           # 下一条行情的序号
+
+        # 每次启动创建新文件并映射到内存，不会截断读取者正在映射的旧文件（否则读取者
+        # 会因SIGBUS崩溃），也不需要在Windows下覆盖已存在的文件
+        size = HEADER_SIZE + SLOT_SIZE * capacity
+
+        self.file = open(self.filename, 'w+b')
+        self.file.truncate(size)
+        self.buffer = mmap.mmap(self.file.fileno(), size)
+
+        # 先写入序号和代数再写入文件头，读取者检查到文件头时序号已经有效
+        self.setSeq(WRITE_SEQ_OFFSET, 0)
+        self.setSeq(GENERATION_OFFSET, self.generation)
+        HEADER_STRUCT.pack_into(self.buffer, 0, RING_MAGIC, RING_VERSION,
+                                capacity, SLOT_SIZE, LAYOUT_DIGEST)
+
+    # ----------------------------------------------------------------------
+    def write(self, tick):
+        """写入一条行情"""
+        seq = self.writeSeq
+        offset = HEADER_SIZE + (seq % self.capacity) * SLOT_SIZE
+
+        values = [getattr(tick, name) for name in TICK_FIELDS]
+        for i in STRING_INDEXES:
+            if isinstance(values[i], unicode):
+                values[i] = values[i].encode('utf-8')
+
+        # 槽位序号清零，写入数据后再写入序号
+        self.setSeq(offset, 0)
+        TICK_STRUCT.pack_into(self.buffer, offset + SEQ_SIZE, *values)
+        self.setSeq(offset, seq + 1)
+
+        # 更新写入序号，读取者只读取序号之前的数据
+        self.writeSeq = seq + 1
+        self.setSeq(WRITE_SEQ_OFFSET, self.writeSeq)
+
+    # ----------------------------------------------------------------------
+    def setSeq(self, offset, seq):
+        """写入序号"""
+        self.buffer[offset:offset+SEQ_SIZE] = SEQ_STRUCT.pack(seq)
+
+    # ----------------------------------------------------------------------
+    def close(self):
+        """关闭共享内存，通知读取者并删除文件"""
+        self.setSeq(GENERATION_OFFSET, 0)
+        self.buffer.close()
+        self.file.close()
+
+        # Windows下有读取者映射着文件时无法删除，留给操作系统清理
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+    # ----------------------------------------------------------------------
+    def getInfo(self):
+        """获取读取者打开缓冲区需要的信息"""
+        return {'filename': self.filename,
+                'capacity': self.capacity,
+                'generation': self.generation,
+                'version': RING_VERSION}
+
+
+########################################################################
+class TickRingReader(object):
+    """环形缓冲区的读取者"""
+
+    # ----------------------------------------------------------------------
+    def __init__(self, filename):
+        """
+        Constructor
+        filename：写入者getInfo返回的共享内存文件路径
+        """
+        self.filename = filename
+
+        self.file = open(self.filename, 'rb')
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # 检查文件头
+        magic, version, capacity, slotSize, digest = HEADER_STRUCT.unpack_from(self.buffer, 0)
+        if (magic != RING_MAGIC or version != RING_VERSION or
+            slotSize != SLOT_SIZE or digest != LAYOUT_DIGEST):
+            self.close()
+            raise ValueError(u'共享内存文件格式不一致：%s' % self.filename)
+
+        self.capacity = capacity
+        self.generation = self.getGeneration()          # 打开时写入者的代数
+        self.lost = 0                                   # 因读取过慢被覆盖而丢失的行情数量
+        self.readSeq = self.getWriteSeq()               # 下一条读取的行情序号，从当前位置开始读取
+
+    # ----------------------------------------------------------------------
+    def getGeneration(self):
+        """获取写入者的代数"""
+        return SEQ_STRUCT.unpack_from(self.buffer, GENERATION_OFFSET)[0]
+
+    # ----------------------------------------------------------------------
+    def isClosed(self):
+        """写入者是否已经关闭（服务器停止或重新启动），此后需要重新获取文件名并打开"""
+        return self.getGeneration() != self.generation
+
+    # ----------------------------------------------------------------------
+    def getWriteSeq(self):
+        """获取写入者的写入序号"""
+        return SEQ_STRUCT.unpack_from(self.buffer, WRITE_SEQ_OFFSET)[0]
+
+    # ----------------------------------------------------------------------
+    def read(self, maxCount=1000):
+        """读取新的行情，返回行情对象列表，没有新行情时返回空列表"""
+        writeSeq = self.getWriteSeq()
+
+        if writeSeq == self.readSeq:
+            return []
+
+        # 落后超过一圈时跳过已被覆盖的数据
+        if writeSeq - self.readSeq > self.capacity:
+            self.lost += writeSeq - self.capacity - self.readSeq
+            self.readSeq = writeSeq - self.capacity
+
+        buf = self.buffer
+        capacity = self.capacity
+        unpackSeq = SEQ_STRUCT.unpack_from
+        unpackTick = TICK_STRUCT.unpack_from
+
+        l = []
+        seq = self.readSeq
+        end = min(writeSeq, seq + maxCount)
+
+        while seq < end:
+            offset = HEADER_SIZE + (seq % capacity) * SLOT_SIZE
+
+            # 复制数据前后的槽位序号都正确时数据才有效
+            seq1 = unpackSeq(buf, offset)[0]
+            values = unpackTick(buf, offset + SEQ_SIZE)
+            seq2 = unpackSeq(buf, offset)[0]
+
+            if seq1 != seq + 1 or seq2 != seq + 1:
+                # 数据已被覆盖，跳到最早的有效数据处
+                newSeq = self.getWriteSeq() - capacity + 1
+                if newSeq > seq:
+                    self.lost += newSeq - seq
+                    seq = newSeq
+                    end = max(end, seq)
+                else:
+                    self.lost += 1
+                    seq += 1
+                continue
+
+            l.append(self.createTick(values))
+            seq += 1
+
+        self.readSeq = seq
+        return l
+
+    # ----------------------------------------------------------------------
+    def createTick(self, values):
+        """根据字段值创建行情对象"""
+        values = list(values)
+        for i in STRING_INDEXES:
+            values[i] = values[i].rstrip('\0')
+        for i in VOLUME_INDEXES:
+            v = values[i]
+            if v.is_integer():
+                values[i] = int(v)
+
+        d = dict(izip(TICK_FIELDS, values))
+        d['rawData'] = None
+
+        tick = VtTickData.__new__(VtTickData)
+        tick.__dict__ = d
+        return tick
+
+    # ----------------------------------------------------------------------
+    def close(self):
+        """关闭共享内存"""
+        closed = self.getGeneration() == 0
+        self.buffer.close()
+        self.file.close()
+
+        # 写入者关闭时（Windows下）因为读取者还映射着文件而未能删除的，由读取者删除
+        if closed and os.path.exists(self.filename):
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass